@@ -3,53 +3,80 @@ from flask_cors import CORS
 from routes.user_routes import user_bp
 from routes.patient_routes import patient_bp
 from routes.appointment_routes import appointment_bp
-from db import mongo
+from routes.dashboard_routes import dashboard_bp, summary_cache
+from routes.batch_routes import batch_bp
+from routes.sync_routes import sync_bp
+from routes.appointment_routes import busy_cache
+from utils.auth import token_cache, user_cache
+from models.sessions import revocation_cache
+from utils import metrics
+from models.db import get_db, ping
+from models.migrations import apply_migrations
 import os
 
-app = Flask(__name__)
-
-# Configure trailing slashes
-app.url_map.strict_slashes = False
-
-# Configure CORS properly
-CORS(app, resources={
-    r"/api/*": {
-        "origins": ["http://localhost:5000", "http://127.0.0.1:5000"],
-        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"],
-        "supports_credentials": True,
-        "expose_headers": ["Authorization"],
-        "allow_credentials": True
-    }
-})
-
-# MongoDB configuration
-app.config["MONGO_URI"] = "mongodb://localhost:27017/doctor_assistant"
-mongo.init_app(app)
-
-# Register blueprints
-app.register_blueprint(user_bp, url_prefix='/api/user')
-app.register_blueprint(patient_bp, url_prefix='/api/patients')
-app.register_blueprint(appointment_bp, url_prefix='/api/appointments')
-
-# Serve frontend static files
-@app.route('/')
-def serve_index():
-    return send_from_directory('../frontend', 'login.html')
-
-@app.route('/<path:path>')
-def serve_static(path):
-    return send_from_directory('../frontend', path)
-
-# Test database connection
-@app.route('/api/test-connection')
-def test_connection():
-    try:
-        # Test MongoDB connection
-        mongo.db.command('ping')
-        return jsonify({"message": "Database connection successful"}), 200
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+def create_app():
+    """Create and configure the Flask application."""
+    app = Flask(__name__)
+
+    # Configure trailing slashes
+    app.url_map.strict_slashes = False
+
+    # Configure CORS properly
+    CORS(app, resources={
+        r"/api/*": {
+            "origins": ["http://localhost:5000", "http://127.0.0.1:5000"],
+            "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+            "allow_headers": ["Content-Type", "Authorization", "If-None-Match", "If-Modified-Since"],
+            "supports_credentials": True,
+            "expose_headers": ["Authorization", "Link", "X-Total-Count", "ETag", "Last-Modified"],
+            "allow_credentials": True
+        }
+    })
+
+    # Apply pending index migrations (disable with RUN_MIGRATIONS=0 and use migrate.py)
+    if os.getenv('RUN_MIGRATIONS', '1') == '1':
+        try:
+            applied = apply_migrations(get_db())
+            if applied:
+                print(f"Applied migrations: {applied}")
+        except Exception as e:
+            print(f"Failed to apply migrations: {e}")
+
+    # Request / database / cache metrics, served on /metrics
+    metrics.init_app(app)
+    for name, cache in (('users', user_cache), ('tokens', token_cache), ('revocations', revocation_cache),
+                        ('busy', busy_cache), ('dashboard', summary_cache)):
+        metrics.register_cache(name, cache)
+
+    # Register blueprints
+    app.register_blueprint(user_bp, url_prefix='/api/user')
+    app.register_blueprint(patient_bp, url_prefix='/api/patients')
+    app.register_blueprint(appointment_bp, url_prefix='/api/appointments')
+    app.register_blueprint(dashboard_bp, url_prefix='/api/dashboard')
+    app.register_blueprint(batch_bp, url_prefix='/api/batch')
+    app.register_blueprint(sync_bp, url_prefix='/api/sync')
+
+    # Serve frontend static files
+    @app.route('/')
+    def serve_index():
+        return send_from_directory('../frontend', 'login.html')
+
+    @app.route('/<path:path>')
+    def serve_static(path):
+        return send_from_directory('../frontend', path)
+
+    # Test database connection
+    @app.route('/api/test-connection')
+    def test_connection():
+        # Cached for a few seconds so health probes don't hammer the database
+        ok, error = ping()
+        if ok:
+            return jsonify({"message": "Database connection successful"}), 200
+        return jsonify({"error": error}), 500
+
+    return app
+
+app = create_app()
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
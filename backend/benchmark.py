@@ -0,0 +1,427 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from werkzeug.security import generate_password_hash
+
+# Optional: in-memory MongoDB stand-in (pip install -r requirements-dev.txt)
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+# The app must not touch a real server while it is being imported
+os.environ.setdefault('RUN_MIGRATIONS', '0')
+
+from models import db as database
+from utils.passwords import HASH_METHOD
+
+ADMIN_PASSWORD = 'admin123'
+DOCTOR_PASSWORD = 'doctor123'
+CONDITIONS = ['asthma', 'diabetes', 'hypertension', 'migraine', 'arthritis', 'anemia']
+FIRST_NAMES = ['John', 'Jane', 'Alex', 'Maria', 'Sam', 'Priya', 'Omar', 'Lena', 'Ravi', 'Chen']
+LAST_NAMES = ['Doe', 'Smith', 'Khan', 'Garcia', 'Lee', 'Patel', 'Brown', 'Silva', 'Nair', 'Wong']
+
+# Scenarios the in-memory stand-in can't run: it does not implement $unionWith
+MONGODB_ONLY = {
+    'GET /api/dashboard/summary',
+    'GET /api/patients/<id>/timeline',
+    'POST /api/batch (page load)'
+}
+
+
+def seed(db, patients, appointments, doctors, history):
+    """Fill the database with users, patients and appointments."""
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    db.users.insert_one({
+        'username': 'admin',
+        'email': 'admin@hospital.com',
+        'password': generate_password_hash(ADMIN_PASSWORD, HASH_METHOD),
+        'role': 'admin',
+        'created_at': now
+    })
+    # Hashing is slow on purpose, every doctor shares one hash
+    doctor_hash = generate_password_hash(DOCTOR_PASSWORD, HASH_METHOD)
+    doctor_ids = db.users.insert_many([
+        {
+            'username': f'doctor{i}',
+            'email': f'doctor{i}@hospital.com',
+            'password': doctor_hash,
+            'role': 'doctor',
+            'created_at': now
+        }
+        for i in range(doctors)
+    ]).inserted_ids
+
+    from models.history import HISTORY_COLLECTION, build_buckets
+    from utils.search import search_keys
+    batch = []
+    patient_docs = []
+    for i in range(patients):
+        doctor_id = doctor_ids[i % doctors]
+        patient = {
+            'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}',
+            'email': f'patient{i}@example.com',
+            'phone': f'555{i:07d}',
+            'address': f'{i} Main Street',
+            'date_of_birth': f'{rng.randint(1940, 2015)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            'doctor_id': str(doctor_id),
+            'current_conditions': rng.choice(CONDITIONS),
+            'doctor_notes': f'Follow up on {rng.choice(CONDITIONS)}',
+            'allergies': [rng.choice(['penicillin', 'peanuts', 'latex'])],
+            'medications': [rng.choice(['metformin', 'ibuprofen', 'salbutamol'])],
+            'created_at': now,
+            'updated_at': now
+        }
+        patient['search_keys'] = search_keys(patient)
+        batch.append(patient)
+        if len(batch) >= 1000:
+            db.patients.insert_many(batch)
+            patient_docs.extend(batch)
+            batch = []
+    if batch:
+        db.patients.insert_many(batch)
+        patient_docs.extend(batch)
+
+    buckets = [
+        bucket
+        for patient in patient_docs
+        for bucket in build_buckets(patient['_id'], patient['doctor_id'], [
+            {'condition': rng.choice(CONDITIONS), 'notes': 'x' * 200, 'date': now - timedelta(days=30 * n)}
+            for n in range(history, 0, -1)
+        ])
+    ]
+    for offset in range(0, len(buckets), 1000):
+        db[HISTORY_COLLECTION].insert_many(buckets[offset:offset + 1000])
+
+    batch = []
+    start_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    for i in range(appointments):
+        patient = patient_docs[i % len(patient_docs)]
+        start = start_day + timedelta(days=i // 16 % 60, hours=9 + i % 16 // 2, minutes=30 * (i % 2))
+        batch.append({
+            'patient_id': patient['_id'],
+            'doctor_id': ObjectId(patient['doctor_id']),
+            'date': start.strftime('%Y-%m-%d'),
+            'time': start.strftime('%H:%M'),
+            'duration': 30,
+            'start': start,
+            'end': start + timedelta(minutes=30),
+            'reason': rng.choice(CONDITIONS),
+            'status': 'scheduled',
+            'created_at': now,
+            'updated_at': now
+        })
+        if len(batch) >= 1000:
+            db.appointments.insert_many(batch)
+            batch = []
+    if batch:
+        db.appointments.insert_many(batch)
+
+    return {
+        'admin_id': db.users.find_one({'username': 'admin'})['_id'],
+        'doctor_ids': [str(doctor_id) for doctor_id in doctor_ids],
+        'patient_ids': [str(patient['_id']) for patient in patient_docs],
+        'appointment_ids': [str(a['_id']) for a in db.appointments.find({}, {'_id': 1}).limit(1000)]
+    }
+
+
+def build_scenarios(db, data):
+    """Return (name, method, path, token, body-factory) for every blueprint route.
+
+    path is either a string or a function returning one; such functions create
+    the document a request consumes (e.g. the one it deletes) before it is timed.
+    """
+    from models.sessions import start_session
+    counter = iter(range(10 ** 9))
+    lock = threading.Lock()
+
+    def unique():
+        with lock:
+            return next(counter)
+
+    def new_patient():
+        n = unique()
+        return {'name': f'Bench Patient {n}', 'email': f'bench{n}@example.com', 'phone': f'777{n:07d}',
+                'address': 'Bench Street', 'date_of_birth': '1990-01-01'}
+
+    def new_appointment():
+        n = unique()
+        day = (datetime.utcnow() + timedelta(days=400 + n // 16)).strftime('%Y-%m-%d')
+        return {'patient_id': data['patient_ids'][0], 'doctor_id': data['doctor_ids'][0], 'date': day,
+                'time': f'{9 + n % 16 // 2:02d}:{30 * (n % 2):02d}', 'reason': 'benchmark'}
+
+    def import_body():
+        rows = [new_patient() for _ in range(50)]
+        return '\n'.join(json.dumps(row) for row in rows)
+
+    def stored_patient():
+        patient = dict(new_patient(), doctor_id=data['doctor_ids'][0], created_at=datetime.utcnow())
+        return f"/api/patients/{db.patients.insert_one(patient).inserted_id}"
+
+    def stored_appointments(count, **fields):
+        # Far enough ahead not to collide with the seeded or benchmark-created bookings
+        n = unique()
+        first = datetime.utcnow().replace(hour=7, minute=0, second=0, microsecond=0) + timedelta(days=5000 + n)
+        now = datetime.utcnow()
+        return db.appointments.insert_many([dict({
+            'patient_id': ObjectId(data['patient_ids'][0]),
+            'doctor_id': ObjectId(data['doctor_ids'][0]),
+            'date': (first + timedelta(weeks=week)).strftime('%Y-%m-%d'),
+            'time': '07:00',
+            'duration': 30,
+            'start': first + timedelta(weeks=week),
+            'end': first + timedelta(weeks=week, minutes=30),
+            'reason': 'benchmark',
+            'status': 'scheduled',
+            'created_at': now,
+            'updated_at': now
+        }, **fields) for week in range(count)]).inserted_ids
+
+    def stored_series():
+        series_id = ObjectId()
+        stored_appointments(4, series_id=series_id, recurrence={'freq': 'weekly', 'count': 4})
+        return f'/api/appointments/series/{series_id}'
+
+    def refresh_token():
+        return {'refresh_token': start_session(db, ObjectId(data['doctor_ids'][0]))[1]}
+
+    series_path = stored_series()
+
+    patient_id = data['patient_ids'][0]
+    appointment_id = data['appointment_ids'][0]
+    doctor_id = data['doctor_ids'][0]
+    today = datetime.utcnow().strftime('%Y-%m-%d')
+    week = (datetime.utcnow() + timedelta(days=6)).strftime('%Y-%m-%d')
+    return [
+        ('GET /api/test-connection', 'GET', '/api/test-connection', None, None),
+        ('POST /api/user/login', 'POST', '/api/user/login', None,
+         lambda: {'username': 'doctor0', 'password': DOCTOR_PASSWORD}),
+        ('GET /api/user/profile', 'GET', '/api/user/profile', 'doctor', None),
+        ('GET /api/user/doctors', 'GET', '/api/user/doctors', 'admin', None),
+        ('GET /api/user/cache-stats', 'GET', '/api/user/cache-stats', 'admin', None),
+        ('POST /api/user/refresh', 'POST', '/api/user/refresh', None, refresh_token),
+        ('POST /api/user/logout', 'POST', '/api/user/logout', None, refresh_token),
+        ('GET /metrics', 'GET', '/metrics', None, None),
+        ('GET /api/patients (doctor)', 'GET', '/api/patients/', 'doctor', None),
+        ('GET /api/patients (admin)', 'GET', '/api/patients/?limit=100', 'admin', None),
+        ('GET /api/patients?fields=*', 'GET', '/api/patients/?fields=*', 'admin', None),
+        ('GET /api/patients/search prefix', 'GET', '/api/patients/search?q=jo&mode=prefix', 'doctor', None),
+        ('GET /api/patients/<id>/history', 'GET', f'/api/patients/{patient_id}/history', 'admin', None),
+        ('GET /api/patients/<id>/timeline', 'GET', f'/api/patients/{patient_id}/timeline', 'admin', None),
+        ('POST /api/patients/<id>/history', 'POST', f'/api/patients/{patient_id}/history', 'admin',
+         lambda: {'condition': 'checkup', 'notes': 'benchmark'}),
+        ('POST /api/patients', 'POST', '/api/patients/', 'doctor', new_patient),
+        ('PUT /api/patients/<id>', 'PUT', f'/api/patients/{patient_id}', 'admin', lambda: {'address': f'{unique()} Road'}),
+        ('DELETE /api/patients/<id>', 'DELETE', stored_patient, 'admin', None),
+        ('POST /api/patients/import', 'POST', '/api/patients/import', 'doctor', import_body),
+        ('GET /api/appointments (doctor)', 'GET', '/api/appointments/', 'doctor', None),
+        ('GET /api/appointments (admin)', 'GET', '/api/appointments/?limit=100', 'admin', None),
+        ('GET /api/appointments?expand=patient,doctor', 'GET',
+         '/api/appointments/?limit=100&expand=patient,doctor', 'admin', None),
+        ('GET /api/appointments/<id>', 'GET', f'/api/appointments/{appointment_id}', 'doctor', None),
+        ('POST /api/appointments', 'POST', '/api/appointments/', 'admin', new_appointment),
+        # Evening slots, clear of the seeded 09:00-17:00 bookings; runs the double-booking check
+        ('PUT /api/appointments/<id>', 'PUT', f'/api/appointments/{appointment_id}', 'admin',
+         lambda: {'time': f'{17 + unique() % 4}:30', 'notes': 'benchmark'}),
+        ('DELETE /api/appointments/<id>', 'DELETE',
+         lambda: f'/api/appointments/{stored_appointments(1)[0]}', 'admin', None),
+        ('PUT /api/appointments/series/<id>', 'PUT', series_path, 'admin',
+         lambda: {'reason': f'benchmark {unique()}'}),
+        ('DELETE /api/appointments/series/<id>', 'DELETE', stored_series, 'admin', None),
+        ('GET /api/appointments/availability', 'GET',
+         f'/api/appointments/availability?doctor_id={doctor_id}&from={today}&to={week}', 'doctor', None),
+        ('GET /api/dashboard/summary', 'GET', '/api/dashboard/summary', 'doctor', None),
+        ('GET /api/sync (doctor, full)', 'GET', '/api/sync', 'doctor', None),
+        ('POST /api/batch (lists)', 'POST', '/api/batch', 'doctor', lambda: {'requests': [
+            {'path': '/api/user/profile'},
+            {'path': '/api/patients/'},
+            {'path': '/api/appointments/'}
+        ]}),
+        ('POST /api/batch (page load)', 'POST', '/api/batch', 'doctor', lambda: {'requests': [
+            {'path': '/api/user/profile'},
+            {'path': '/api/patients/'},
+            {'path': '/api/appointments/'},
+            {'path': '/api/dashboard/summary'}
+        ]}),
+    ]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def failed(response):
+    """Whether a response is an error; a batch fails if any of its sub-requests did."""
+    if response.status_code >= 400:
+        return True
+    body = response.get_json(silent=True) if response.is_json else None
+    if isinstance(body, dict) and isinstance(body.get('responses'), list):
+        return any(sub.get('status', 500) >= 400 for sub in body['responses'])
+    return False
+
+
+def run_scenario(app, scenario, tokens, requests, concurrency):
+    """Fire the requests of one scenario from a thread pool and time each of them."""
+    name, method, path, role, body = scenario
+    local = threading.local()
+    headers = {'Authorization': f'Bearer {tokens[role]}'} if role else {}
+    if name == 'POST /api/patients/import':
+        headers['Content-Type'] = 'application/x-ndjson'
+
+    def call(_):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        target = path() if callable(path) else path
+        payload = body() if body else None
+        started = time.perf_counter()
+        if isinstance(payload, str):
+            response = local.client.open(target, method=method, data=payload, headers=headers, buffered=True)
+        else:
+            response = local.client.open(target, method=method, json=payload, headers=headers, buffered=True)
+        size = len(response.get_data())
+        return time.perf_counter() - started, response.status_code, size, failed(response)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency * 1000 for latency, _, _, _ in results)
+    errors = sum(1 for _, _, _, error in results if error)
+    statuses = {}
+    for _, status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'endpoint': name,
+        'requests': requests,
+        'errors': errors,
+        'statuses': statuses,
+        'throughput_rps': round(requests / elapsed, 1),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_bytes': round(sum(size for _, _, size, _ in results) / len(results))
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def print_report(results, previous=None):
+    before = {entry['endpoint']: entry for entry in (previous or {}).get('results', [])}
+    print(f"{'endpoint':<38} {'rps':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'err':>5}")
+    for entry in results:
+        if entry.get('skipped'):
+            print(f"{entry['endpoint']:<38} skipped: {entry['skipped']}")
+            continue
+        line = (f"{entry['endpoint']:<38} {entry['throughput_rps']:>9} {entry['p50_ms']:>9} "
+                f"{entry['p95_ms']:>9} {entry['p99_ms']:>9} {entry['errors']:>5}")
+        old = before.get(entry['endpoint'])
+        if old and old.get('p95_ms'):
+            change = (entry['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100
+            line += f"   p95 {change:+.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test every API endpoint and report latency percentiles')
+    parser.add_argument('--backend', choices=['mongomock', 'mongodb'], default='mongomock',
+                        help='in-memory stand-in, or the server in MONGO_URI (uses a throwaway database)')
+    parser.add_argument('--patients', type=int, default=2000)
+    parser.add_argument('--appointments', type=int, default=5000)
+    parser.add_argument('--doctors', type=int, default=10)
+    parser.add_argument('--history', type=int, default=5, help='medical history entries per patient')
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--only', help='only run endpoints whose name contains this text')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='previous results file to compare p95 latency against')
+    args = parser.parse_args()
+
+    if args.backend == 'mongomock':
+        if mongomock is None:
+            parser.error('mongomock is not installed (pip install -r requirements-dev.txt)')
+        database.set_client(mongomock.MongoClient())
+        # The stand-in can only return decoded documents
+        os.environ['RAW_BSON_READS'] = '0'
+    else:
+        database.DB_NAME = f"{database.DB_NAME}_benchmark"
+        database.get_client().drop_database(database.DB_NAME)
+
+    from app import create_app
+    from models.migrations import apply_migrations
+    from utils import metrics
+    from utils.auth import generate_token
+
+    db = database.get_db()
+    if args.backend == 'mongodb':
+        # The in-memory stand-in neither uses indexes nor supports capped collections
+        apply_migrations(db)
+    print(f"Seeding {args.patients} patients, {args.appointments} appointments, {args.doctors} doctors...")
+    data = seed(db, args.patients, args.appointments, args.doctors, args.history)
+    app = create_app()
+    tokens = {
+        'admin': generate_token(db.users.find_one({'username': 'admin'})),
+        'doctor': generate_token(db.users.find_one({'username': 'doctor0'}))
+    }
+
+    results = []
+    for scenario in build_scenarios(db, data):
+        name = scenario[0]
+        if args.only and args.only not in name:
+            continue
+        if args.backend == 'mongomock' and name in MONGODB_ONLY:
+            results.append({'endpoint': name, 'skipped': 'needs --backend mongodb'})
+        elif name == 'GET /metrics' and not metrics.METRICS_ENABLED:
+            results.append({'endpoint': name, 'skipped': 'METRICS_ENABLED is off'})
+        else:
+            results.append(run_scenario(app, scenario, tokens, args.requests, args.concurrency))
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_report(results, previous)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'config': vars(args),
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.backend == 'mongodb':
+        database.get_client().drop_database(database.DB_NAME)
+
+    # Fail the run (e.g. in CI) rather than report the latency of error responses
+    failing = [entry['endpoint'] for entry in results if entry.get('errors')]
+    if failing:
+        print(f"\nScenarios with errors: {', '.join(failing)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
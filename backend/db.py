@@ -1,3 +0,0 @@
-from flask_pymongo import PyMongo
-
-mongo = PyMongo() 
\ No newline at end of file
@@ -0,0 +1,38 @@
+import argparse
+
+from models.db import get_db
+from models.migrations import MIGRATIONS, applied_versions, apply_migrations, unindexed_queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply database migrations and indexes')
+    parser.add_argument('--status', action='store_true', help='list migrations and whether they are applied')
+    parser.add_argument('--report', action='store_true', help='list queries that still run without an index')
+    args = parser.parse_args()
+
+    db = get_db()
+
+    if args.status:
+        applied = applied_versions(db)
+        for version, description, _ in MIGRATIONS:
+            state = 'applied' if version in applied else 'pending'
+            print(f"{version:>4}  {state:<8} {description}")
+        return
+
+    if args.report:
+        report = unindexed_queries(db)
+        if not report:
+            print("All known queries use an index")
+        for entry in report:
+            print(f"{entry['collection']}: filter={entry['filter']} sort={entry['sort']} stages={entry['stages']}")
+        return
+
+    applied = apply_migrations(db)
+    if applied:
+        print(f"Applied migrations: {', '.join(str(version) for version in applied)}")
+    else:
+        print("Database is up to date")
+
+
+if __name__ == "__main__":
+    main()
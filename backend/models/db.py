@@ -1,33 +1,109 @@
 from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+from pymongo.errors import PyMongoError
 import os
+import threading
+import time
+
+from utils.metrics import METRICS_ENABLED, mongo_listener
+from utils.slowlog import SlowOperationLog
 
 # MongoDB connection string from environment variables
 MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
 DB_NAME = os.getenv('DB_NAME', 'doctor_assistant')
 
-# Global variable to store the database connection
-_db = None
+# How long a /api/test-connection result is reused, in seconds
+HEALTH_CHECK_TTL = float(os.getenv('MONGO_HEALTH_CHECK_TTL', '5'))
 
-def init_db():
-    """Initialize the database connection."""
-    global _db
-    try:
-        client = MongoClient(MONGO_URI)
-        # Test the connection
-        client.admin.command('ping')
-        _db = client[DB_NAME]
-        print(f"Successfully connected to MongoDB database: {DB_NAME}")
-    except ConnectionFailure as e:
-        print(f"Failed to connect to MongoDB: {e}")
-        raise
-    except Exception as e:
-        print(f"An error occurred while connecting to MongoDB: {e}")
-        raise
+# The one MongoClient of this process (with its pool and monitoring threads)
+_client = None
+_client_pid = None
+_lock = threading.Lock()
+_health = {'checked_at': 0.0, 'ok': False, 'error': None}
+
+def client_options():
+    """Build the MongoClient options from the environment."""
+    options = {
+        'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', '100')),
+        'minPoolSize': int(os.getenv('MONGO_MIN_POOL_SIZE', '0')),
+        'maxIdleTimeMS': int(os.getenv('MONGO_MAX_IDLE_TIME_MS', '300000')),
+        'waitQueueTimeoutMS': int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '5000')),
+        'serverSelectionTimeoutMS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+        'connectTimeoutMS': int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+        'socketTimeoutMS': int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '30000')),
+        # Do not open sockets until the first operation, so the client can be
+        # created before a pre-fork server forks its workers
+        'connect': False
+    }
+    listeners = []
+    if METRICS_ENABLED:
+        listeners.append(mongo_listener)
+    if slow_operations.enabled:
+        listeners.append(slow_operations)
+    if listeners:
+        options['event_listeners'] = listeners
+    compressors = os.getenv('MONGO_COMPRESSORS')  # e.g. "zstd,snappy,zlib"
+    if compressors:
+        options['compressors'] = compressors
+    return options
+
+def _reset_after_fork():
+    """A client inherited across fork() must not be used; start clean in the child."""
+    global _client, _client_pid, _lock
+    _client = None
+    _client_pid = None
+    _lock = threading.Lock()
+    _health.update(checked_at=0.0, ok=False, error=None)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def get_client():
+    """Get the shared MongoClient, created lazily once per process."""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _lock:
+            if _client is None or _client_pid != pid:
+                _client = MongoClient(MONGO_URI, **client_options())
+                _client_pid = pid
+    return _client
+
+def set_client(client):
+    """Use an existing client (e.g. an in-memory stand-in) instead of connecting."""
+    global _client, _client_pid
+    with _lock:
+        _client = client
+        _client_pid = os.getpid()
+        _health.update(checked_at=0.0, ok=False, error=None)
 
 def get_db():
     """Get the database connection."""
-    global _db
-    if _db is None:
-        init_db()
-    return _db 
\ No newline at end of file
+    return get_client()[DB_NAME]
+
+# Commands slower than SLOW_OP_THRESHOLD_MS, see /api/user/slow-operations
+slow_operations = SlowOperationLog(get_client, get_db)
+
+def ping():
+    """Check the database connection, reusing the last result for HEALTH_CHECK_TTL seconds.
+
+    Returns (ok, error message or None).
+    """
+    now = time.monotonic()
+    if now - _health['checked_at'] < HEALTH_CHECK_TTL:
+        return _health['ok'], _health['error']
+    try:
+        get_client().admin.command('ping')
+        ok, error = True, None
+    except PyMongoError as e:
+        ok, error = False, str(e)
+    _health.update(checked_at=now, ok=ok, error=error)
+    return ok, error
+
+def init_db():
+    """Initialize the database connection and check that it is reachable."""
+    ok, error = ping()
+    if not ok:
+        print(f"Failed to connect to MongoDB: {error}")
+        raise ConnectionError(error)
+    print(f"Successfully connected to MongoDB database: {DB_NAME}")
+    return get_db()
@@ -0,0 +1,55 @@
+from datetime import datetime
+
+from bson import ObjectId
+
+# Change log of the patient fields shown on the timeline:
+#   {patient_id, doctor_id, field, added: [...], removed: [...], date}
+EVENTS_COLLECTION = 'patient_events'
+
+# Patient fields whose changes are recorded
+TRACKED_FIELDS = ('medications', 'allergies')
+
+
+def _as_object_id(value):
+    return value if isinstance(value, ObjectId) else ObjectId(value)
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def change_events(patient_id, doctor_id, before, after, date=None):
+    """Build the events describing how the tracked fields changed between two versions of a patient."""
+    date = date or datetime.utcnow()
+    events = []
+    for field in TRACKED_FIELDS:
+        if field not in after:
+            continue
+        old, new = _as_list(before.get(field)), _as_list(after.get(field))
+        added = [item for item in new if item not in old]
+        removed = [item for item in old if item not in new]
+        if added or removed:
+            events.append({
+                'patient_id': _as_object_id(patient_id),
+                'doctor_id': doctor_id,
+                'field': field,
+                'added': added,
+                'removed': removed,
+                'date': date
+            })
+    return events
+
+
+def record_changes(db, patient_id, doctor_id, before, after, date=None):
+    """Log the changes of the tracked fields, if any."""
+    events = change_events(patient_id, doctor_id, before, after, date)
+    if events:
+        db[EVENTS_COLLECTION].insert_many(events)
+    return events
+
+
+def delete_events(db, patient_id):
+    """Delete the change log of a patient."""
+    db[EVENTS_COLLECTION].delete_many({'patient_id': _as_object_id(patient_id)})
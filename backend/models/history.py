@@ -0,0 +1,246 @@
+import base64
+import json
+import os
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from utils.pagination import PaginationError
+
+# Medical history lives in bucket documents of up to HISTORY_BUCKET_SIZE
+# entries each, numbered per patient by `seq`:
+#   {patient_id, doctor_id, seq, count, dated, first_date, last_date, entries: [...]}
+# Entries are in chronological order within a bucket and across seq numbers.
+# dated counts the entries with a real date, the ones the timeline shows.
+HISTORY_COLLECTION = 'patient_history'
+HISTORY_BUCKET_SIZE = int(os.getenv('HISTORY_BUCKET_SIZE', '100'))
+
+# Patients whose embedded medical_history arrays are moved per migration batch
+HISTORY_MIGRATION_BATCH = int(os.getenv('HISTORY_MIGRATION_BATCH', '500'))
+
+
+def _as_object_id(value):
+    return value if isinstance(value, ObjectId) else ObjectId(value)
+
+
+def parse_entry_date(value):
+    """Parse an ISO 8601 entry date into a naive UTC datetime (raises ValueError)."""
+    if isinstance(value, datetime):
+        return value
+    date = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+
+def _entry_dates(entries):
+    return [entry['date'] for entry in entries if isinstance(entry, dict) and isinstance(entry.get('date'), datetime)]
+
+
+def _parse_stored_dates(entries):
+    """Copy of entries with string dates parsed; ones that don't parse are left as they are."""
+    parsed = []
+    for entry in entries:
+        if isinstance(entry, dict) and isinstance(entry.get('date'), str):
+            try:
+                entry = dict(entry, date=parse_entry_date(entry['date']))
+            except ValueError:
+                pass
+        parsed.append(entry)
+    return parsed
+
+
+def build_buckets(patient_id, doctor_id, entries, first_seq=0, size=None):
+    """Split entries into bucket documents numbered from first_seq."""
+    size = size or HISTORY_BUCKET_SIZE
+    now = datetime.utcnow()
+    buckets = []
+    for offset in range(0, len(entries), size):
+        chunk = entries[offset:offset + size]
+        dates = _entry_dates(chunk)
+        buckets.append({
+            'patient_id': _as_object_id(patient_id),
+            'doctor_id': doctor_id,
+            'seq': first_seq + offset // size,
+            'count': len(chunk),
+            'dated': len(dates),
+            'first_date': min(dates) if dates else None,
+            'last_date': max(dates) if dates else None,
+            'entries': chunk,
+            'created_at': now
+        })
+    return buckets
+
+
+def add_entries(db, patient_id, doctor_id, entries):
+    """Append entries to the patient's latest bucket, opening new buckets when it is full."""
+    patient_id = _as_object_id(patient_id)
+    collection = db[HISTORY_COLLECTION]
+    entries = list(entries)
+    while entries:
+        latest = collection.find_one({'patient_id': patient_id}, {'seq': 1, 'count': 1}, sort=[('seq', -1)])
+        if latest and latest['count'] < HISTORY_BUCKET_SIZE:
+            chunk = entries[:HISTORY_BUCKET_SIZE - latest['count']]
+            dates = _entry_dates(chunk)
+            update = {'$push': {'entries': {'$each': chunk}}, '$inc': {'count': len(chunk), 'dated': len(dates)}}
+            if dates:
+                update['$min'] = {'first_date': min(dates)}
+                update['$max'] = {'last_date': max(dates)}
+            # Only succeeds if no concurrent writer filled the bucket meanwhile
+            result = collection.update_one(
+                {'_id': latest['_id'], 'count': {'$lte': HISTORY_BUCKET_SIZE - len(chunk)}}, update)
+            if result.modified_count:
+                entries = entries[len(chunk):]
+            continue
+
+        seq = latest['seq'] + 1 if latest else 0
+        bucket = build_buckets(patient_id, doctor_id, entries[:HISTORY_BUCKET_SIZE], first_seq=seq)[0]
+        try:
+            collection.insert_one(bucket)
+        except DuplicateKeyError:
+            # Another writer opened this bucket first; append to it instead
+            continue
+        entries = entries[HISTORY_BUCKET_SIZE:]
+
+
+def encode_position(seq, index):
+    """Build an opaque cursor pointing at an entry of a bucket."""
+    raw = json.dumps({'s': seq, 'i': index}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_position(token):
+    """Decode a cursor produced by encode_position into (seq, index)."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        seq, index = payload['s'], payload['i']
+    except (ValueError, KeyError, TypeError):
+        raise PaginationError('Invalid pagination cursor')
+    if not isinstance(seq, int) or not isinstance(index, int) or index < 0:
+        raise PaginationError('Invalid pagination cursor')
+    return seq, index
+
+
+def history_page(db, patient_id, limit, after=None):
+    """Return one page of history entries, newest first, and the cursor of the next page."""
+    query = {'patient_id': _as_object_id(patient_id)}
+    if after:
+        query['seq'] = {'$lte': after[0]}
+    # Enough buckets for a full page, read newest first
+    cursor = db[HISTORY_COLLECTION].find(query, {'seq': 1, 'entries': 1}).sort('seq', -1)
+    cursor = cursor.batch_size(limit // HISTORY_BUCKET_SIZE + 2)
+
+    entries = []
+    try:
+        for bucket in cursor:
+            index = len(bucket['entries']) - 1
+            if after and bucket['seq'] == after[0]:
+                index = min(index, after[1])
+            while index >= 0:
+                if len(entries) == limit:
+                    return entries, encode_position(bucket['seq'], index)
+                entries.append(bucket['entries'][index])
+                index -= 1
+    finally:
+        cursor.close()
+    return entries, None
+
+
+def delete_history(db, patient_id):
+    """Delete every history bucket of a patient."""
+    db[HISTORY_COLLECTION].delete_many({'patient_id': _as_object_id(patient_id)})
+
+
+def migrate_patient_history(db, patient):
+    """Move a patient's embedded medical_history array into buckets.
+
+    The buckets get negative seq numbers so they sort before any entry
+    written since the upgrade. Buckets left over from an interrupted run are
+    replaced, so this can be repeated safely.
+    """
+    # Older entries may carry their date as a string
+    entries = _parse_stored_dates(patient.get('medical_history') or [])
+    collection = db[HISTORY_COLLECTION]
+    collection.delete_many({'patient_id': patient['_id'], 'seq': {'$lt': 0}})
+    if entries:
+        count = -(-len(entries) // HISTORY_BUCKET_SIZE)
+        try:
+            collection.insert_many(build_buckets(patient['_id'], patient.get('doctor_id'), entries, first_seq=-count))
+        except BulkWriteError:
+            # A concurrent request is moving the same history
+            return
+    db.patients.update_one({'_id': patient['_id']}, {'$unset': {'medical_history': ''}})
+
+
+def migrate_legacy_history(db):
+    """Move every embedded medical_history array into buckets, batch by batch.
+
+    Reads keep working while this runs: the history endpoint migrates a
+    patient on first access, and new entries already go to buckets.
+    """
+    migrated = 0
+    while True:
+        patients = list(db.patients.find(
+            {'medical_history': {'$exists': True}},
+            {'medical_history': 1, 'doctor_id': 1}
+        ).limit(HISTORY_MIGRATION_BATCH))
+        if not patients:
+            return migrated
+        for patient in patients:
+            migrate_patient_history(db, patient)
+        migrated += len(patients)
+
+
+def parse_history_dates(db):
+    """Store the string dates of bucketed history entries as real dates.
+
+    The timeline only shows entries with a date, so entries written with a
+    string date were missing from it. Dates that don't parse are left alone.
+    """
+    collection = db[HISTORY_COLLECTION]
+    skipped = set()
+    converted = 0
+    while True:
+        query = {'entries.date': {'$type': 'string'}, '_id': {'$nin': list(skipped)}}
+        buckets = list(collection.find(query, {'entries': 1, 'count': 1}).limit(HISTORY_MIGRATION_BATCH))
+        if not buckets:
+            return converted
+        for bucket in buckets:
+            entries = _parse_stored_dates(bucket['entries'])
+            if entries == bucket['entries']:
+                skipped.add(bucket['_id'])
+                continue
+            dates = _entry_dates(entries)
+            # An entry appended meanwhile changes count; the bucket is then read again
+            result = collection.update_one(
+                {'_id': bucket['_id'], 'count': bucket['count']},
+                {'$set': {'entries': entries, 'dated': len(dates), 'first_date': min(dates), 'last_date': max(dates)}})
+            if result.modified_count:
+                converted += 1
+                # Any string date left doesn't parse
+                skipped.add(bucket['_id'])
+
+
+def count_dated_entries(db):
+    """Store on each history bucket how many of its entries have a real date.
+
+    Buckets written before the count existed get it here; a bucket appended
+    to meanwhile is counted again.
+    """
+    collection = db[HISTORY_COLLECTION]
+    retry = []
+    counted = 0
+    while True:
+        query = {'$or': [{'dated': {'$exists': False}}, {'_id': {'$in': retry}}]}
+        buckets = list(collection.find(query, {'entries': 1, 'count': 1}).limit(HISTORY_MIGRATION_BATCH))
+        if not buckets:
+            return counted
+        retry = []
+        for bucket in buckets:
+            result = collection.update_one({'_id': bucket['_id'], 'count': bucket['count']},
+                                           {'$set': {'dated': len(_entry_dates(bucket['entries']))}})
+            if result.matched_count:
+                counted += 1
+            else:
+                retry.append(bucket['_id'])
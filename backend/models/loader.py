@@ -0,0 +1,83 @@
+from flask import g, has_app_context
+
+from models.db import get_db
+
+
+class Deferred:
+    """A value queued on a Loader, fetched together with every other queued value."""
+
+    __slots__ = ('_loader', '_key')
+
+    def __init__(self, loader, key):
+        self._loader = loader
+        self._key = key
+
+    def get(self):
+        """The loaded document, or None if it doesn't exist."""
+        return self._loader._resolve(self._key)
+
+
+class Loader:
+    """Batch and memoize reference lookups for the length of a request.
+
+    load() only queues a key; the first get() on any queued value sends one
+    $in query per (collection, field, projection) for everything queued so
+    far. Results, including misses, are kept until the request ends, so a
+    reference is fetched at most once however many rows point to it.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._queue = {}
+        self._cache = {}
+
+    def load(self, collection, key, field='_id', fields=None):
+        """Queue a lookup of the document of collection whose field equals key."""
+        batch = (collection, field, tuple(fields) if fields else None)
+        if (batch, key) not in self._cache:
+            self._queue.setdefault(batch, set()).add(key)
+        return Deferred(self, (batch, key))
+
+    def load_many(self, collection, keys, field='_id', fields=None):
+        """Look up several keys at once; returns {key: document or None}."""
+        deferred = {key: self.load(collection, key, field, fields) for key in keys}
+        return {key: value.get() for key, value in deferred.items()}
+
+    def prime(self, collection, document, field='_id', fields=None):
+        """Remember a document already in hand."""
+        self._cache[((collection, field, tuple(fields) if fields else None), document[field])] = document
+
+    def clear(self, collection, key=None):
+        """Forget what was loaded from a collection (after writing to it)."""
+        for cached in list(self._cache):
+            if cached[0][0] == collection and (key is None or cached[1] == key):
+                del self._cache[cached]
+
+    def dispatch(self):
+        """Send the queued lookups, one query per collection, field and projection."""
+        queue, self._queue = self._queue, {}
+        for batch, keys in queue.items():
+            collection, field, fields = batch
+            projection = dict.fromkeys(fields, 1) if fields else None
+            if projection is not None and field != '_id':
+                projection[field] = 1
+            for key in keys:
+                self._cache.setdefault((batch, key), None)
+            for document in self.db[collection].find({field: {'$in': list(keys)}}, projection):
+                # For non-unique fields any one matching document is kept
+                if self._cache.get((batch, document.get(field))) is None:
+                    self._cache[(batch, document.get(field))] = document
+
+    def _resolve(self, key):
+        if key not in self._cache:
+            self.dispatch()
+        return self._cache.get(key)
+
+
+def get_loader():
+    """The Loader of the current request (a fresh one outside of a request)."""
+    if not has_app_context():
+        return Loader(get_db())
+    if 'loader' not in g:
+        g.loader = Loader(get_db())
+    return g.loader
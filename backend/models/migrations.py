@@ -0,0 +1,227 @@
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ASCENDING, TEXT, IndexModel, UpdateOne
+
+from models.events import EVENTS_COLLECTION
+from models.history import HISTORY_COLLECTION, count_dated_entries, migrate_legacy_history, parse_history_dates
+from models.sessions import REFRESH_TOKENS_COLLECTION, REVOKED_SESSIONS_COLLECTION
+from models.sync import SYNC_TOMBSTONE_DAYS, TOMBSTONES_COLLECTION
+from utils.projection import PATIENT_REFERENCE
+from utils.search import SEARCH_KEY_FIELDS, search_keys
+from utils.slowlog import ensure_slow_log, plan_stages
+
+# Declared indexes, by collection. Add new indexes here and create them
+# from a new migration at the end of MIGRATIONS.
+INDEXES = {
+    'users': [
+        IndexModel([('username', ASCENDING)], name='username_unique', unique=True),
+        IndexModel([('email', ASCENDING)], name='email_unique', unique=True),
+        IndexModel([('role', ASCENDING)], name='role'),
+    ],
+    'patients': [
+        IndexModel([('email', ASCENDING)], name='email_unique', unique=True),
+        IndexModel([('doctor_id', ASCENDING), ('_id', ASCENDING)], name='doctor_id'),
+        IndexModel([('doctor_id', ASCENDING), ('created_at', ASCENDING), ('_id', ASCENDING)], name='doctor_id_created_at'),
+        IndexModel([('created_at', ASCENDING), ('_id', ASCENDING)], name='created_at'),
+        IndexModel(
+            [('name', TEXT), ('email', TEXT), ('phone', TEXT), ('current_conditions', TEXT), ('doctor_notes', TEXT)],
+            name='patient_text',
+            weights={'name': 10, 'email': 5, 'phone': 5, 'current_conditions': 2, 'doctor_notes': 1}
+        ),
+        IndexModel([('search_keys', ASCENDING)], name='search_keys'),
+        IndexModel([('doctor_id', ASCENDING), ('search_keys', ASCENDING)], name='doctor_id_search_keys'),
+        IndexModel([('doctor_id', ASCENDING), ('updated_at', ASCENDING), ('_id', ASCENDING)], name='doctor_id_updated_at'),
+        IndexModel([('updated_at', ASCENDING), ('_id', ASCENDING)], name='updated_at'),
+    ],
+    'appointments': [
+        IndexModel([('doctor_id', ASCENDING), ('date', ASCENDING)], name='doctor_id_date'),
+        IndexModel([('doctor_id', ASCENDING), ('_id', ASCENDING)], name='doctor_id'),
+        IndexModel([('doctor_id', ASCENDING), ('created_at', ASCENDING), ('_id', ASCENDING)], name='doctor_id_created_at'),
+        IndexModel([('created_at', ASCENDING), ('_id', ASCENDING)], name='created_at'),
+        IndexModel([('patient_id', ASCENDING)], name='patient_id'),
+        IndexModel([('series_id', ASCENDING), ('date', ASCENDING)], name='series_id_date', sparse=True),
+        IndexModel([('doctor_id', ASCENDING), ('start', ASCENDING), ('end', ASCENDING)], name='doctor_id_start_end'),
+        IndexModel([('patient_id', ASCENDING), ('start', ASCENDING), ('_id', ASCENDING)], name='patient_id_start'),
+        IndexModel([('doctor_id', ASCENDING), ('updated_at', ASCENDING), ('_id', ASCENDING)], name='doctor_id_updated_at'),
+        IndexModel([('updated_at', ASCENDING), ('_id', ASCENDING)], name='updated_at'),
+    ],
+    HISTORY_COLLECTION: [
+        IndexModel([('patient_id', ASCENDING), ('seq', ASCENDING)], name='patient_id_seq', unique=True),
+        IndexModel([('patient_id', ASCENDING), ('last_date', ASCENDING)], name='patient_id_last_date'),
+    ],
+    EVENTS_COLLECTION: [
+        IndexModel([('patient_id', ASCENDING), ('date', ASCENDING), ('_id', ASCENDING)], name='patient_id_date'),
+    ],
+    REFRESH_TOKENS_COLLECTION: [
+        IndexModel([('expires_at', ASCENDING)], name='expires_at_ttl', expireAfterSeconds=0),
+        IndexModel([('session_id', ASCENDING)], name='session_id'),
+        IndexModel([('user_id', ASCENDING), ('expires_at', ASCENDING)], name='user_id_expires_at'),
+    ],
+    REVOKED_SESSIONS_COLLECTION: [
+        IndexModel([('expires_at', ASCENDING)], name='expires_at_ttl', expireAfterSeconds=0),
+    ],
+    TOMBSTONES_COLLECTION: [
+        IndexModel([('doctor_id', ASCENDING), ('updated_at', ASCENDING), ('_id', ASCENDING)], name='doctor_id_updated_at'),
+        # The retention is fixed when the index is created (change it with collMod)
+        IndexModel([('updated_at', ASCENDING)], name='updated_at_ttl',
+                   expireAfterSeconds=int(SYNC_TOMBSTONE_DAYS * 86400)),
+    ],
+}
+
+# Collection recording which migrations have been applied
+MIGRATIONS_COLLECTION = 'schema_migrations'
+
+
+def ensure_indexes(db, *collections):
+    """Create the declared indexes for the given collections (all if none given)."""
+    for name in collections or INDEXES:
+        db[name].create_indexes(INDEXES[name])
+
+
+def backfill_appointment_times(db):
+    """Derive native start/end datetimes from the date/time strings of older appointments."""
+    db.appointments.update_many(
+        {'start': {'$exists': False}, 'date': {'$type': 'string'}, 'time': {'$type': 'string'}},
+        [
+            {'$set': {'start': {'$dateFromString': {
+                'dateString': {'$concat': ['$date', 'T', '$time']},
+                'onError': None
+            }}}},
+            {'$set': {'end': {'$add': ['$start', {'$multiply': [{'$ifNull': ['$duration', 30]}, 60000]}]}}}
+        ]
+    )
+
+
+def backfill_search_keys(db, batch_size=1000):
+    """Compute the autocomplete keys of patients created before they existed."""
+    projection = {field: 1 for field in SEARCH_KEY_FIELDS}
+    operations = []
+    for patient in db.patients.find({'search_keys': {'$exists': False}}, projection):
+        operations.append(UpdateOne({'_id': patient['_id']}, {'$set': {'search_keys': search_keys(patient)}}))
+        if len(operations) >= batch_size:
+            db.patients.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        db.patients.bulk_write(operations, ordered=False)
+
+
+def backfill_patient_summaries(db):
+    """Embed the patient name/email/phone in appointments created before the copy existed."""
+    db.appointments.aggregate([
+        {'$match': {'patient_summary': {'$exists': False}, 'patient_id': {'$type': 'objectId'}}},
+        {'$lookup': {
+            'from': 'patients',
+            'localField': 'patient_id',
+            'foreignField': '_id',
+            'as': 'patient'
+        }},
+        {'$unwind': '$patient'},
+        {'$project': {'patient_summary': {field: f'$patient.{field}' for field in PATIENT_REFERENCE}}},
+        {'$merge': {'into': 'appointments', 'on': '_id', 'whenMatched': 'merge', 'whenNotMatched': 'discard'}}
+    ])
+
+
+def backfill_updated_at(db):
+    """Stamp updated_at on patients and appointments last written before sync existed."""
+    for name in ('patients', 'appointments'):
+        db[name].update_many(
+            {'updated_at': {'$exists': False}},
+            [{'$set': {'updated_at': {'$ifNull': ['$created_at', {'$toDate': '$_id'}]}}}]
+        )
+
+
+# Versioned migrations, applied in order. Never edit or reorder an entry
+# that has been released - append a new one instead.
+MIGRATIONS = [
+    (1, 'Create initial indexes', lambda db: ensure_indexes(db, 'users', 'patients', 'appointments')),
+    (2, 'Index appointment series', lambda db: ensure_indexes(db, 'appointments')),
+    (3, 'Add appointment start/end and interval index', lambda db: (
+        backfill_appointment_times(db), ensure_indexes(db, 'appointments'))),
+    (4, 'Add patient search indexes', lambda db: (backfill_search_keys(db), ensure_indexes(db, 'patients'))),
+    (5, 'Create capped slow operation log', ensure_slow_log),
+    (6, 'Move medical history into buckets', lambda db: (
+        ensure_indexes(db, HISTORY_COLLECTION), migrate_legacy_history(db))),
+    (7, 'Index the patient timeline', lambda db: ensure_indexes(db, 'appointments', EVENTS_COLLECTION)),
+    (8, 'Embed patient summaries in appointments', backfill_patient_summaries),
+    (9, 'Create refresh token sessions', lambda db: ensure_indexes(
+        db, REFRESH_TOKENS_COLLECTION, REVOKED_SESSIONS_COLLECTION)),
+    (10, 'Add updated_at stamps and tombstones for delta sync', lambda db: (
+        backfill_updated_at(db), ensure_indexes(db, 'patients', 'appointments', TOMBSTONES_COLLECTION))),
+    (11, 'Parse string history dates and index bucket dates', lambda db: (
+        parse_history_dates(db), ensure_indexes(db, HISTORY_COLLECTION))),
+    (12, 'Count dated entries of history buckets', count_dated_entries),
+]
+
+
+def applied_versions(db):
+    """Return the set of migration versions already applied."""
+    return {doc['_id'] for doc in db[MIGRATIONS_COLLECTION].find({}, {'_id': 1})}
+
+
+def pending_migrations(db):
+    """Return the migrations that have not been applied yet."""
+    applied = applied_versions(db)
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+
+def apply_migrations(db):
+    """Apply every pending migration in order.
+
+    Each migration is idempotent, so running this concurrently from several
+    workers only repeats work that is a no-op the second time.
+    """
+    applied = []
+    for version, description, migrate in pending_migrations(db):
+        migrate(db)
+        db[MIGRATIONS_COLLECTION].update_one(
+            {'_id': version},
+            {'$set': {'description': description, 'applied_at': datetime.utcnow()}},
+            upsert=True
+        )
+        applied.append(version)
+    return applied
+
+
+# Representative query shapes issued by the routes, checked by unindexed_queries()
+QUERY_SHAPES = [
+    ('users', {'username': ''}, None),
+    ('users', {'email': ''}, None),
+    ('users', {'role': 'doctor'}, None),
+    ('patients', {'email': ''}, None),
+    ('patients', {'doctor_id': ''}, [('_id', ASCENDING)]),
+    ('patients', {'doctor_id': ''}, [('created_at', ASCENDING), ('_id', ASCENDING)]),
+    ('patients', {}, [('created_at', ASCENDING), ('_id', ASCENDING)]),
+    ('appointments', {'doctor_id': ObjectId()}, [('_id', ASCENDING)]),
+    ('appointments', {'doctor_id': ObjectId(), 'date': ''}, None),
+    ('appointments', {'patient_id': ObjectId()}, None),
+    (HISTORY_COLLECTION, {'patient_id': ObjectId()}, [('seq', -1)]),
+    (HISTORY_COLLECTION, {'patient_id': ObjectId(), 'last_date': {'$ne': None}}, [('last_date', -1)]),
+    ('appointments', {'patient_id': ObjectId(), 'start': {'$lte': datetime.utcnow()}}, [('start', -1), ('_id', -1)]),
+    (EVENTS_COLLECTION, {'patient_id': ObjectId(), 'date': {'$lte': datetime.utcnow()}}, [('date', -1), ('_id', -1)]),
+    ('appointments', {'doctor_id': ObjectId(), 'start': {'$lt': datetime.utcnow()}}, [('start', ASCENDING)]),
+    ('patients', {'doctor_id': '', 'updated_at': {'$lt': datetime.utcnow()}}, [('updated_at', ASCENDING), ('_id', ASCENDING)]),
+    ('appointments', {'doctor_id': ObjectId(), 'updated_at': {'$lt': datetime.utcnow()}},
+     [('updated_at', ASCENDING), ('_id', ASCENDING)]),
+    (TOMBSTONES_COLLECTION, {'doctor_id': '', 'updated_at': {'$lt': datetime.utcnow()}},
+     [('updated_at', ASCENDING), ('_id', ASCENDING)]),
+]
+
+
+def unindexed_queries(db, shapes=None):
+    """Explain each query shape and report the ones that scan the whole collection."""
+    report = []
+    for collection, query, sort in shapes or QUERY_SHAPES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain().get('queryPlanner', {}).get('winningPlan', {})
+        stages = set(plan_stages(plan))
+        if 'COLLSCAN' in stages or 'SORT' in stages:
+            report.append({
+                'collection': collection,
+                'filter': sorted(query),
+                'sort': [key for key, _ in sort or []],
+                'stages': sorted(stages)
+            })
+    return report
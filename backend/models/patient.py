@@ -1,66 +1,105 @@
-from flask import Blueprint, request, jsonify
-from pymongo import MongoClient
 from datetime import datetime
-from bson import ObjectId
-
-patient_bp = Blueprint('patient', __name__)
-client = MongoClient('mongodb://localhost:27017/')
-db = client['doctor_assistant']
-
-# Get all patients
-@patient_bp.route('/', methods=['GET'])
-def get_patients():
-    patients = list(db.patients.find({}))
-    for patient in patients:
-        patient['_id'] = str(patient['_id'])
-    return jsonify(patients)
-
-# Add a new patient
-@patient_bp.route('/add', methods=['POST'])
-def add_patient():
-    data = request.json
-    db.patients.insert_one(data)
-    return jsonify({"message": "Patient added successfully"})
-
-# Update patient data
-@patient_bp.route('/update/<int:patient_id>', methods=['PUT'])
-def update_patient(patient_id):
-    data = request.json
-    db.patients.update_one({"patient_id": patient_id}, {"$set": data})
-    return jsonify({"message": "Patient updated successfully"})
-
-# Delete a patient
-@patient_bp.route('/delete/<int:patient_id>', methods=['DELETE'])
-def delete_patient(patient_id):
-    db.patients.delete_one({"patient_id": patient_id})
-    return jsonify({"message": "Patient deleted successfully"})
+import json
+import os
+from bson import ObjectId, decode as decode_bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from models.events import record_changes
+from models.history import add_entries
+from models.sync import record_moves
+from utils.references import sync_patient_summary
+from utils.versioning import bump_version
+
+# Read patients as undecoded BSON that is only parsed when a field is used
+# (set RAW_BSON_READS=0 for a driver or stand-in that can't return RawBSONDocument)
+RAW_BSON_READS = os.getenv('RAW_BSON_READS', '1') == '1'
+RAW_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+def raw_patients(db):
+    """The patients collection, returning RawBSONDocuments when enabled."""
+    if not RAW_BSON_READS:
+        return db.patients
+    return db.patients.with_options(codec_options=RAW_CODEC_OPTIONS)
+
+def decode(doc):
+    """Turn a RawBSONDocument into a dict in one pass (nested documents included)."""
+    return decode_bson(doc.raw) if isinstance(doc, RawBSONDocument) else doc
+
+def _isoformat(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def _json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, RawBSONDocument):
+        return decode(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def serialize(doc):
+    """Build the to_dict() form of a patient straight from its (raw or decoded) document."""
+    doc = decode(doc)
+    data = {"id": str(doc.get("_id"))}
+    for name, default in FIELDS:
+        if name == "doctor_id":
+            continue
+        value = doc.get(name)
+        if value is None:
+            value = default() if callable(default) else default
+        data[name] = value
+    data["created_at"] = _isoformat(data["created_at"])
+    data["updated_at"] = _isoformat(data["updated_at"])
+    return data
+
+class _Field:
+    """Patient attribute read from the wrapped document when accessed."""
+    __slots__ = ("name", "default")
+
+    def __init__(self, name, default=None):
+        self.name = name
+        self.default = default
+
+    def __get__(self, patient, owner=None):
+        if patient is None:
+            return self
+        value = patient._doc.get(self.name)
+        if value is None:
+            return self.default() if callable(self.default) else self.default
+        return value
 
 class Patient:
+    """A patient wrapping its MongoDB document (a dict or a RawBSONDocument).
+
+    Nothing is copied out of the document up front: each field is read, and a
+    raw document decoded, only when it is used.
+    """
+    __slots__ = ("_doc",)
+
+    name = _Field("name")
+    age = _Field("age")
+    gender = _Field("gender")
+    doctor_id = _Field("doctor_id")
+    contact_number = _Field("contact_number", "")
+    email = _Field("email", "")
+    address = _Field("address", "")
+    allergies = _Field("allergies", list)
+    medications = _Field("medications", list)
+    created_at = _Field("created_at")
+    updated_at = _Field("updated_at")
+
     def __init__(self, patient_data):
-        """Initialize Patient object with data from MongoDB."""
+        """Wrap a patient document from MongoDB."""
         if patient_data is None:
             raise ValueError("Patient data cannot be None")
-            
-        self.id = str(patient_data.get("_id"))
-        self.name = patient_data.get("name")
-        self.age = patient_data.get("age")
-        self.gender = patient_data.get("gender")
-        self.contact_number = patient_data.get("contact_number", "")
-
-        self.email = patient_data.get("email", "")
-
-        self.address = patient_data.get("address", "")
+        self._doc = patient_data
 
-        self.medical_history = patient_data.get("medical_history", [])
-        self.allergies = patient_data.get("allergies", [])
-        self.medications = patient_data.get("medications", [])
-
-        self.allergies = patient_data.get("allergies", [])
-        self.medications = patient_data.get("medications", [])
-        self.created_at = patient_data.get("created_at", datetime.utcnow().isoformat())
-
-        self.updated_at = patient_data.get("updated_at", datetime.utcnow().isoformat())
+    @property
+    def id(self):
+        return str(self._doc.get("_id"))
 
+    def __repr__(self):
+        return f"<Patient {self.id}>"
 
     @staticmethod
     def create_patient(db, patient_data):
@@ -72,6 +111,9 @@ class Patient:
             
             # Insert patient into database
             result = db.patients.insert_one(patient_data)
+            record_changes(db, result.inserted_id, patient_data.get("doctor_id"), {}, patient_data,
+                           patient_data["created_at"])
+            bump_version(db, 'patients', patient_data.get("doctor_id"))
             return str(result.inserted_id)
         except Exception as e:
             raise Exception(f"Failed to create patient: {str(e)}")
@@ -82,7 +124,7 @@ class Patient:
         try:
             if isinstance(patient_id, str):
                 patient_id = ObjectId(patient_id)
-            patient_data = db.patients.find_one({"_id": patient_id})
+            patient_data = raw_patients(db).find_one({"_id": patient_id})
             return Patient(patient_data) if patient_data else None
         except Exception as e:
             raise Exception(f"Failed to find patient: {str(e)}")
@@ -91,11 +133,16 @@ class Patient:
     def get_all_patients(db):
         """Get all patients."""
         try:
-            patients = list(db.patients.find())
-            return [Patient(patient).to_dict() for patient in patients]
+            return [serialize(patient) for patient in raw_patients(db).find({}, PROJECTION)]
         except Exception as e:
             raise Exception(f"Failed to get patients: {str(e)}")
 
+    @staticmethod
+    def iter_json(db, query=None):
+        """Yield matching patients as JSON strings, straight from the BSON (no Patient objects)."""
+        for patient in raw_patients(db).find(query or {}, PROJECTION):
+            yield json.dumps(serialize(patient), default=_json_default, separators=(",", ":"))
+
     def update(self, db, update_data):
         """Update patient information."""
         try:
@@ -104,22 +151,22 @@ class Patient:
                 {"_id": ObjectId(self.id)},
                 {"$set": update_data}
             )
+            if result.modified_count:
+                record_changes(db, self.id, self.doctor_id, self._doc, update_data, update_data["updated_at"])
+                if "doctor_id" in update_data:
+                    record_moves(db, "patients", [self._doc], update_data["doctor_id"], update_data["updated_at"])
+                sync_patient_summary(db, self.id, update_data)
+                bump_version(db, 'patients', self.doctor_id)
             return result.modified_count > 0
         except Exception as e:
             raise Exception(f"Failed to update patient: {str(e)}")
 
     def add_medical_history(self, db, history_entry):
-        """Add a medical history entry."""
+        """Add a medical history entry (stored in the patient_history buckets)."""
         try:
             history_entry["date"] = datetime.utcnow()
-            result = db.patients.update_one(
-                {"_id": ObjectId(self.id)},
-                {
-                    "$push": {"medical_history": history_entry},
-                    "$set": {"updated_at": datetime.utcnow()}
-                }
-            )
-            return result.modified_count > 0
+            add_entries(db, self.id, self.doctor_id, [history_entry])
+            return True
         except Exception as e:
             raise Exception(f"Failed to add medical history: {str(e)}")
 
@@ -135,6 +182,9 @@ class Patient:
                     }
                 }
             )
+            if result.modified_count:
+                record_changes(db, self.id, self.doctor_id, self._doc, {"allergies": allergies})
+                bump_version(db, 'patients', self.doctor_id)
             return result.modified_count > 0
         except Exception as e:
             raise Exception(f"Failed to update allergies: {str(e)}")
@@ -151,23 +201,21 @@ class Patient:
                     }
                 }
             )
+            if result.modified_count:
+                record_changes(db, self.id, self.doctor_id, self._doc, {"medications": medications})
+                bump_version(db, 'patients', self.doctor_id)
             return result.modified_count > 0
         except Exception as e:
             raise Exception(f"Failed to update medications: {str(e)}")
 
     def to_dict(self):
         """Convert patient object to dictionary."""
-        return {
-            "id": self.id,
-            "name": self.name,
-            "age": self.age,
-            "gender": self.gender,
-            "contact_number": self.contact_number,
-            "email": self.email,
-            "address": self.address,
-            "medical_history": self.medical_history,
-            "allergies": self.allergies,
-            "medications": self.medications,
-            "created_at": self.created_at.isoformat() if isinstance(self.created_at, datetime) else self.created_at,
-            "updated_at": self.updated_at.isoformat() if isinstance(self.updated_at, datetime) else self.updated_at
-        }
+        return serialize(self._doc)
+
+    def to_json(self):
+        """Convert patient object to a JSON string."""
+        return json.dumps(self.to_dict(), default=_json_default, separators=(",", ":"))
+
+# (name, default) of every model field, and the projection that reads just those
+FIELDS = tuple((field.name, field.default) for field in vars(Patient).values() if isinstance(field, _Field))
+PROJECTION = dict.fromkeys((name for name, _ in FIELDS), 1)
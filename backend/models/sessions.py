@@ -0,0 +1,127 @@
+import hashlib
+import os
+import secrets
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from utils.cache import TTLCache
+
+# Refresh tokens, stored by SHA-256 digest (the token itself is never saved):
+#   {_id: digest, session_id, user_id, created_at, expires_at, used_at, revoked_at}
+# Every refresh marks the presented token used and issues a new one in the same
+# session; the TTL index drops tokens once they expire.
+REFRESH_TOKENS_COLLECTION = 'refresh_tokens'
+REFRESH_TOKEN_DAYS = float(os.getenv('REFRESH_TOKEN_DAYS', '14'))
+
+# Lifetime of the access tokens handed out with each refresh token
+ACCESS_TOKEN_MINUTES = float(os.getenv('ACCESS_TOKEN_MINUTES', '15'))
+
+# Sessions ended by logout, refresh token reuse or user deletion:
+#   {_id: session_id, user_id, revoked_at, expires_at}
+# Kept (TTL index) until the last access token of the session has expired.
+REVOKED_SESSIONS_COLLECTION = 'revoked_sessions'
+
+# The set of revoked session ids is reloaded from the database at most this
+# often (seconds), so a logout on another worker takes effect within it
+revocation_cache = TTLCache(maxsize=1, ttl=float(os.getenv('REVOCATION_CACHE_TTL', '5')))
+
+
+class SessionError(ValueError):
+    """Raised when a refresh token is unknown, expired, reused or revoked."""
+
+
+def _digest(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def _insert_token(db, session_id, user_id, now):
+    token = secrets.token_urlsafe(32)
+    db[REFRESH_TOKENS_COLLECTION].insert_one({
+        '_id': _digest(token),
+        'session_id': session_id,
+        'user_id': user_id,
+        'created_at': now,
+        'expires_at': now + timedelta(days=REFRESH_TOKEN_DAYS),
+        'used_at': None,
+        'revoked_at': None
+    })
+    return token
+
+
+def start_session(db, user_id):
+    """Open a session for a user who just logged in; returns (session_id, refresh_token)."""
+    session_id = ObjectId()
+    return session_id, _insert_token(db, session_id, ObjectId(str(user_id)), datetime.utcnow())
+
+
+def rotate(db, refresh_token):
+    """Exchange a refresh token for a new one; returns (session_id, user_id, new refresh token).
+
+    A token can be used once. Presenting an already used token means it was
+    copied, so the whole session is revoked.
+    """
+    now = datetime.utcnow()
+    tokens = db[REFRESH_TOKENS_COLLECTION]
+    current = tokens.find_one_and_update(
+        {'_id': _digest(refresh_token), 'used_at': None, 'revoked_at': None, 'expires_at': {'$gt': now}},
+        {'$set': {'used_at': now}},
+        projection={'session_id': 1, 'user_id': 1}
+    )
+    if current is None:
+        stale = tokens.find_one({'_id': _digest(refresh_token)}, {'session_id': 1, 'user_id': 1, 'used_at': 1})
+        if stale and stale.get('used_at'):
+            revoke_session(db, stale['session_id'], stale['user_id'])
+        raise SessionError('Invalid or expired refresh token')
+    token = _insert_token(db, current['session_id'], current['user_id'], now)
+    return current['session_id'], current['user_id'], token
+
+
+def _revoke(db, sessions, now):
+    """Mark the refresh tokens of sessions revoked and publish the sessions as revoked."""
+    if not sessions:
+        return
+    db[REFRESH_TOKENS_COLLECTION].update_many(
+        {'session_id': {'$in': list(sessions)}, 'revoked_at': None}, {'$set': {'revoked_at': now}})
+    # Access tokens of the session stay valid until they expire unless revoked here
+    expires_at = now + timedelta(minutes=ACCESS_TOKEN_MINUTES)
+    for session_id, user_id in sessions.items():
+        db[REVOKED_SESSIONS_COLLECTION].update_one(
+            {'_id': session_id},
+            {'$set': {'user_id': user_id, 'revoked_at': now, 'expires_at': expires_at}},
+            upsert=True
+        )
+    revocation_cache.clear()
+
+
+def revoke_session(db, session_id, user_id=None):
+    """End a session: its refresh tokens stop working and its access tokens are rejected."""
+    _revoke(db, {session_id: user_id}, datetime.utcnow())
+
+
+def revoke_token(db, refresh_token):
+    """End the session a refresh token belongs to (logout). Returns False if the token is unknown."""
+    token = db[REFRESH_TOKENS_COLLECTION].find_one({'_id': _digest(refresh_token)}, {'session_id': 1, 'user_id': 1})
+    if token is None:
+        return False
+    revoke_session(db, token['session_id'], token['user_id'])
+    return True
+
+
+def revoke_user_sessions(db, user_id):
+    """End every open session of a user (e.g. when the user is deleted)."""
+    user_id = ObjectId(str(user_id))
+    now = datetime.utcnow()
+    sessions = db[REFRESH_TOKENS_COLLECTION].distinct(
+        'session_id', {'user_id': user_id, 'revoked_at': None, 'expires_at': {'$gt': now}})
+    _revoke(db, dict.fromkeys(sessions, user_id), now)
+
+
+def revoked_sessions(db):
+    """Ids (as strings) of the sessions whose access tokens must be rejected, cached briefly."""
+    revoked = revocation_cache.get('revoked')
+    if revoked is None:
+        revoked = frozenset(str(doc['_id']) for doc in db[REVOKED_SESSIONS_COLLECTION].find(
+            {'expires_at': {'$gt': datetime.utcnow()}}, {'_id': 1}))
+        revocation_cache.set('revoked', revoked)
+    return revoked
@@ -0,0 +1,163 @@
+import base64
+import json
+import os
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from utils.pagination import PaginationError
+
+# Deletions, as seen by the doctor a document belonged to:
+#   {collection, doc_id, doctor_id, reason, updated_at}
+# reason is "deleted", or "moved" when the document went to another doctor
+# (it still exists, but has left that doctor's scope).
+TOMBSTONES_COLLECTION = 'tombstones'
+
+# Tombstones are kept this long (TTL index); older sync tokens must start over
+SYNC_TOMBSTONE_DAYS = float(os.getenv('SYNC_TOMBSTONE_DAYS', '30'))
+
+# Changes stamped in the last few seconds are left for the next sync, so a
+# write stamped before a sync but committed after it is not skipped
+SYNC_LAG_SECONDS = float(os.getenv('SYNC_LAG_SECONDS', '5'))
+
+# Collections kept in sync, in the order they are read
+SYNC_COLLECTIONS = ('patients', 'appointments', TOMBSTONES_COLLECTION)
+
+
+class SyncExpired(ValueError):
+    """Raised when a sync token is older than the tombstones kept."""
+
+
+def _doctor_key(doctor_id):
+    return str(doctor_id) if doctor_id is not None else None
+
+
+def record_tombstones(db, collection, documents, reason='deleted', date=None):
+    """Remember that documents ({_id, doctor_id}) left their doctor's scope."""
+    date = date or datetime.utcnow()
+    tombstones = [{
+        'collection': collection,
+        'doc_id': document['_id'],
+        'doctor_id': _doctor_key(document.get('doctor_id')),
+        'reason': reason,
+        'updated_at': date
+    } for document in documents]
+    if tombstones:
+        db[TOMBSTONES_COLLECTION].insert_many(tombstones)
+
+
+def record_moves(db, collection, documents, new_doctor_id, date=None):
+    """Record "moved" tombstones for the documents whose doctor is changing.
+
+    Tombstones the new doctor may hold for the same documents (from an earlier
+    move away) are dropped, so a tombstone always means "not yours now".
+    """
+    moved = [document for document in documents
+             if _doctor_key(document.get('doctor_id')) != _doctor_key(new_doctor_id)]
+    if not moved:
+        return
+    db[TOMBSTONES_COLLECTION].delete_many({
+        'collection': collection,
+        'doc_id': {'$in': [document['_id'] for document in moved]},
+        'doctor_id': _doctor_key(new_doctor_id)
+    })
+    record_tombstones(db, collection, moved, 'moved', date)
+
+
+def encode_sync_token(positions):
+    """Build an opaque token from the per-collection (updated_at, _id) positions."""
+    payload = {name: [date.isoformat(), str(key) if key is not None else None]
+               for name, (date, key) in positions.items()}
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_sync_token(token):
+    """Decode a token produced by encode_sync_token."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        positions = {}
+        for name in SYNC_COLLECTIONS:
+            date, key = payload[name]
+            positions[name] = (datetime.fromisoformat(date), ObjectId(key) if key is not None else None)
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise PaginationError('Invalid sync token')
+    # Only the tombstone position ages out; the others can stop at any old
+    # document while an initial sync is paging
+    if positions[TOMBSTONES_COLLECTION][0] < datetime.utcnow() - timedelta(days=SYNC_TOMBSTONE_DAYS):
+        raise SyncExpired('Sync token expired, sync again without since')
+    return positions
+
+
+def sync_scopes(user):
+    """Per-collection filters selecting what a user may sync."""
+    if user['role'] != 'doctor':
+        # Moves between doctors don't take anything out of an admin's view
+        return {'patients': {}, 'appointments': {}, TOMBSTONES_COLLECTION: {'reason': 'deleted'}}
+    doctor_id = str(user['_id'])
+    return {
+        'patients': {'doctor_id': doctor_id},
+        # Appointment doctor ids are stored as ObjectId, older ones as string
+        'appointments': {'doctor_id': {'$in': [ObjectId(doctor_id), doctor_id]}},
+        TOMBSTONES_COLLECTION: {'doctor_id': doctor_id}
+    }
+
+
+def changes_page(db, collection, scope, position, until, limit, projection=None):
+    """Documents of a collection changed after position and before until, oldest first.
+
+    Returns (documents, next position, more). Once a collection is caught up,
+    its position moves to until, so the next sync starts there.
+    """
+    query = dict(scope)
+    if position is None:
+        query['updated_at'] = {'$lt': until}
+    elif position[1] is None:
+        query['updated_at'] = {'$gte': position[0], '$lt': until}
+    else:
+        date, key = position
+        query['$or'] = [{'updated_at': {'$gt': date, '$lt': until}}, {'updated_at': date, '_id': {'$gt': key}}]
+    if projection and not any(value == 0 for value in projection.values()):
+        projection = dict(projection, updated_at=1)
+    cursor = db[collection].find(query, projection).sort([('updated_at', 1), ('_id', 1)]).limit(limit + 1)
+    documents = list(cursor)
+    if len(documents) > limit:
+        last = documents[limit - 1]
+        return documents[:limit], (last['updated_at'], last['_id']), True
+    if position is not None and position[0] >= until:
+        return documents, position, False
+    return documents, (until, None), False
+
+
+def sync_page(db, user, positions=None, limit=500, projection=None, now=None):
+    """Collect one page of changes for a user; returns (changes, next positions, more).
+
+    changes has the changed patients and appointments and, under "deleted",
+    the ids removed from the user's view per collection.
+    """
+    now = now or datetime.utcnow()
+    until = now - timedelta(seconds=SYNC_LAG_SECONDS)
+    # Stored dates have millisecond precision
+    until = until.replace(microsecond=until.microsecond // 1000 * 1000)
+    positions = positions or {}
+    scopes = sync_scopes(user)
+
+    changes = {'patients': [], 'appointments': [], 'deleted': {'patients': [], 'appointments': []}}
+    next_positions = {}
+    more = False
+    for name in SYNC_COLLECTIONS:
+        if name == TOMBSTONES_COLLECTION and name not in positions:
+            # A first sync has nothing to delete; later pages see what is deleted from here on
+            next_positions[name] = (until, None)
+            continue
+        fields = {'collection': 1, 'doc_id': 1, 'updated_at': 1} if name == TOMBSTONES_COLLECTION else projection
+        documents, next_positions[name], collection_more = changes_page(
+            db, name, scopes[name], positions.get(name), until, limit, fields)
+        more = more or collection_more
+        if name == TOMBSTONES_COLLECTION:
+            for tombstone in documents:
+                changes['deleted'].setdefault(tombstone['collection'], []).append(tombstone['doc_id'])
+        else:
+            changes[name] = documents
+    return changes, next_positions, more
@@ -0,0 +1,157 @@
+import base64
+import json
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from models.events import EVENTS_COLLECTION
+from models.history import HISTORY_COLLECTION
+from utils.pagination import PaginationError
+
+# Timeline items are ordered by (date desc, kind asc, key desc). The key is the
+# _id of appointments and change events, and seq * HISTORY_KEY_STRIDE + index
+# for history entries (buckets hold fewer entries than the stride).
+HISTORY_KEY_STRIDE = 1000000
+KINDS = ('appointment', 'change', 'history')
+
+# Appointment fields shown on the timeline
+APPOINTMENT_FIELDS = ('doctor_id', 'date', 'time', 'duration', 'start', 'end', 'reason', 'status', 'series_id')
+
+
+def encode_timeline_cursor(item):
+    """Build an opaque cursor pointing just after a timeline item."""
+    key = item['key']
+    payload = {'d': item['date'].isoformat(), 'k': item['kind'], 'i': str(key) if isinstance(key, ObjectId) else key}
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_timeline_cursor(token):
+    """Decode a cursor produced by encode_timeline_cursor into (date, kind, key)."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        date = datetime.fromisoformat(payload['d'])
+        kind = payload['k']
+        key = int(payload['i']) if kind == 'history' else ObjectId(payload['i'])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise PaginationError('Invalid pagination cursor')
+    if kind not in KINDS:
+        raise PaginationError('Invalid pagination cursor')
+    return date, kind, key
+
+
+def _after(kind, after, date_field, key_field):
+    """Condition selecting the items of one kind that come after the cursor."""
+    if not after:
+        return {}
+    date, cursor_kind, key = after
+    if kind > cursor_kind:
+        return {date_field: {'$lte': date}}
+    if kind < cursor_kind:
+        return {date_field: {'$lt': date}}
+    return {'$or': [{date_field: {'$lt': date}}, {date_field: date, key_field: {'$lt': key}}]}
+
+
+def history_since(db, patient_id, limit, after=None):
+    """Oldest last_date a history bucket may have and still hold an entry of the next page.
+
+    Buckets are read newest first on the patient_id/last_date index, counting
+    the dated entries of those wholly past the cursor, until they hold a page.
+    Every bucket ending before the oldest of those is too old. None means all
+    buckets are needed.
+    """
+    query = {'patient_id': patient_id, 'last_date': {'$ne': None}}
+    if after:
+        query['first_date'] = {'$lte': after[0]}
+    cursor = db[HISTORY_COLLECTION].find(query, {'_id': 0, 'dated': 1, 'first_date': 1, 'last_date': 1})
+    cursor = cursor.sort('last_date', -1)
+    counted = 0
+    since = None
+    try:
+        for bucket in cursor:
+            # Straddles the cursor: some of its entries were on earlier pages
+            if after and bucket['last_date'] >= after[0]:
+                continue
+            # Undated entries never reach the timeline; buckets not yet
+            # counted by migration 12 add nothing, which only reads further back
+            counted += bucket.get('dated', 0)
+            since = min(since, bucket['first_date']) if since else bucket['first_date']
+            if counted > limit:
+                return since
+    finally:
+        cursor.close()
+    return None
+
+
+def timeline_pipeline(patient_id, limit, after=None, since=None):
+    """Build the aggregation (run on the history buckets) merging a patient's history,
+    appointments and medication/allergy changes, newest first.
+
+    Every branch is filtered on the patient and the cursor and cut to one page
+    before the union, so the final sort only sees a few pages' worth of items.
+    History buckets ending before since (see history_since) are skipped whole.
+    """
+    page = limit + 1
+    appointments = {
+        'coll': 'appointments',
+        'pipeline': [
+            {'$match': {'patient_id': patient_id, 'start': {'$type': 'date'},
+                        **_after('appointment', after, 'start', '_id')}},
+            {'$sort': {'start': -1, '_id': -1}},
+            {'$limit': page},
+            {'$project': {
+                '_id': 0,
+                'kind': {'$literal': 'appointment'},
+                'date': '$start',
+                'key': '$_id',
+                'appointment': {'_id': '$_id', **{field: f'${field}' for field in APPOINTMENT_FIELDS}}
+            }}
+        ]
+    }
+    changes = {
+        'coll': EVENTS_COLLECTION,
+        'pipeline': [
+            {'$match': {'patient_id': patient_id, **_after('change', after, 'date', '_id')}},
+            {'$sort': {'date': -1, '_id': -1}},
+            {'$limit': page},
+            {'$project': {'_id': 0, 'kind': {'$literal': 'change'}, 'date': 1, 'key': '$_id',
+                          'field': 1, 'added': 1, 'removed': 1}}
+        ]
+    }
+    history_match = {'patient_id': patient_id}
+    if after:
+        # A bucket's first_date is its oldest entry, so later buckets can be skipped whole
+        history_match['first_date'] = {'$lte': after[0]}
+    if since:
+        history_match['last_date'] = {'$gte': since}
+    return [
+        {'$match': history_match},
+        {'$unwind': {'path': '$entries', 'includeArrayIndex': 'index'}},
+        {'$project': {
+            '_id': 0,
+            'kind': {'$literal': 'history'},
+            'date': '$entries.date',
+            'key': {'$add': [{'$multiply': ['$seq', HISTORY_KEY_STRIDE]}, '$index']},
+            'entry': '$entries'
+        }},
+        {'$match': {'date': {'$type': 'date'}, **_after('history', after, 'date', 'key')}},
+        {'$sort': {'date': -1, 'key': -1}},
+        {'$limit': page},
+        {'$unionWith': appointments},
+        {'$unionWith': changes},
+        {'$sort': {'date': -1, 'kind': 1, 'key': -1}},
+        {'$limit': page}
+    ]
+
+
+def timeline_page(db, patient_id, limit, after=None):
+    """Return one page of timeline items and the cursor of the next page.
+
+    A read of the bucket dates bounds the history first, so only the buckets
+    that can reach this page are unwound and sorted.
+    """
+    pipeline = timeline_pipeline(patient_id, limit, after, history_since(db, patient_id, limit, after))
+    items = list(db[HISTORY_COLLECTION].aggregate(pipeline, batchSize=limit + 1))
+    cursor = encode_timeline_cursor(items[limit - 1]) if len(items) > limit else None
+    return items[:limit], cursor
@@ -1,46 +1,181 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 from bson import ObjectId
+from pymongo import InsertOne
 from models.db import get_db
-from datetime import datetime
-from routes.user_routes import token_required
+from models.loader import get_loader
+from models.sync import record_moves, record_tombstones
+from datetime import datetime, timedelta
+from utils.auth import token_required
+from utils.cache import TTLCache
+from utils.intervals import IntervalSet, days_covered, parse_slot, split_by_day
+from utils.pagination import PaginationError, paginate, parse_page_args
+from utils.projection import APPOINTMENT_SUMMARY, ProjectionError, parse_fields
+from utils.recurrence import expand, parse_date
+from utils.references import (
+    APPOINTMENT_PATIENT_SUMMARY, ExpandError, expand_projection, expand_references, load_references, parse_expand,
+    patient_summary
+)
+from utils.streaming import encode_document, stream_documents
+from utils.versioning import add_validators, bump_version, get_validators, is_not_modified, not_modified
+import os
 
 appointment_bp = Blueprint('appointments', __name__)
 
+# Default appointment length and the working day used for free-slot search
+APPOINTMENT_MINUTES = int(os.getenv('APPOINTMENT_MINUTES', '30'))
+WORKDAY_START = os.getenv('WORKDAY_START', '09:00')
+WORKDAY_END = os.getenv('WORKDAY_END', '17:00')
+AVAILABILITY_MAX_DAYS = 31
+
+# Busy intervals per (doctor, day); dropped when that day's bookings change here,
+# and expired after the TTL to pick up changes made by other workers
+busy_cache = TTLCache(maxsize=4096, ttl=int(os.getenv('AVAILABILITY_CACHE_TTL', '60')))
+
+def _set_schedule(data):
+    """Store native start/end datetimes alongside the date/time strings."""
+    duration = int(data.get('duration') or APPOINTMENT_MINUTES)
+    if duration <= 0:
+        raise ValueError('duration must be a positive number of minutes')
+    data['duration'] = duration
+    data['start'] = parse_slot(data['date'], data['time'])
+    data['end'] = data['start'] + timedelta(minutes=duration)
+
+def _find_overlaps(db, doctor_id, intervals, exclude=None):
+    """Return the (start, end) intervals that overlap an existing booking.
+
+    All intervals are checked with a single query on the doctor_id/start/end index.
+    """
+    if not intervals:
+        return []
+    query = {
+        'doctor_id': doctor_id,
+        'status': {'$ne': 'cancelled'},
+        '$or': [{'start': {'$lt': end}, 'end': {'$gt': start}} for start, end in intervals]
+    }
+    if exclude:
+        query.update(exclude)
+    busy = IntervalSet(
+        (appointment['start'], appointment['end'])
+        for appointment in db.appointments.find(query, {'start': 1, 'end': 1, '_id': 0})
+    )
+    return [(start, end) for start, end in intervals if busy.overlaps(start, end)]
+
+def _resolve_references(data):
+    """Check that the patient and doctor given in data exist, and embed the patient summary.
+
+    Both are looked up together through the request's loader. Returns an
+    error message, or None.
+    """
+    data.pop('patient_summary', None)
+    patient, doctor = load_references(get_loader(), data.get('patient_id'), data.get('doctor_id'))
+    if 'patient_id' in data:
+        if patient is None:
+            return 'Patient not found'
+        # Copy the patient's name/contact so lists render without a lookup
+        if APPOINTMENT_PATIENT_SUMMARY:
+            data['patient_summary'] = patient_summary(patient)
+    if 'doctor_id' in data and doctor is None:
+        return 'Doctor not found'
+    return None
+
+def _doctor_filter(doctor_id):
+    """Match a doctor's appointments: doctor_id is stored as ObjectId, older ones as string."""
+    doctor_id = str(doctor_id)
+    return {'$in': [ObjectId(doctor_id), doctor_id]}
+
+def _invalidate_busy(doctor_id, *days):
+    for day in days:
+        busy_cache.invalidate((str(doctor_id), day))
+
+def _busy_days(db, doctor_id, first_day, last_day):
+    """Return {date: IntervalSet} for a doctor, loading uncached days in one range query."""
+    busy = {}
+    missing = []
+    day = first_day
+    while day <= last_day:
+        cached = busy_cache.get((str(doctor_id), day))
+        if cached is None:
+            missing.append(day)
+        else:
+            busy[day] = cached
+        day += timedelta(days=1)
+
+    if missing:
+        range_start = datetime.combine(missing[0], datetime.min.time())
+        range_end = datetime.combine(missing[-1] + timedelta(days=1), datetime.min.time())
+        cursor = db.appointments.find({
+            'doctor_id': doctor_id,
+            'status': {'$ne': 'cancelled'},
+            'start': {'$lt': range_end},
+            'end': {'$gt': range_start}
+        }, {'start': 1, 'end': 1, '_id': 0}).sort('start', 1)
+        loaded = split_by_day(((a['start'], a['end']) for a in cursor), missing[0], missing[-1])
+        for day in missing:
+            busy[day] = loaded[day]
+            busy_cache.set((str(doctor_id), day), loaded[day])
+    return busy
+
 @appointment_bp.route('/', methods=['GET'])
 @token_required
 def get_appointments(current_user):
-    """Get all appointments."""
+    """Get a page of appointments (?limit=&after=&sort=&count=&fields=&expand=patient,doctor)."""
     try:
         db = get_db()
         query = {}
+        doctor_id = None
         
         # If doctor, only show their appointments
         if current_user['role'] == 'doctor':
-            query['doctor_id'] = str(current_user['_id'])
+            doctor_id = str(current_user['_id'])
+            query['doctor_id'] = _doctor_filter(doctor_id)
+            
+        # Answer 304 before touching the appointments if nothing changed since the last poll
+        validators = get_validators(db, 'appointments', doctor_id)
+        if is_not_modified(validators):
+            return not_modified(validators)
             
-        appointments = list(db.appointments.find(query))
-        for appointment in appointments:
-            appointment['_id'] = str(appointment['_id'])
-            if 'patient_id' in appointment:
-                appointment['patient_id'] = str(appointment['patient_id'])
-            if 'doctor_id' in appointment:
-                appointment['doctor_id'] = str(appointment['doctor_id'])
-        return jsonify(appointments), 200
+        page = parse_page_args(request.args)
+        names = parse_expand(request.args)
+        projection = expand_projection(parse_fields(request.args, default=APPOINTMENT_SUMMARY), names)
+        appointments, headers = paginate(db.appointments, query, page, projection)
+        # References of each streamed batch are resolved together
+        loader = get_loader()
+        batch_transform = (lambda batch: expand_references(loader, batch, names)) if names else None
+        return add_validators(stream_documents(appointments, headers=headers, batch_transform=batch_transform), validators)
+    except (PaginationError, ProjectionError, ExpandError) as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @appointment_bp.route('/<appointment_id>', methods=['GET'])
-def get_appointment(appointment_id):
-    """Get a single appointment by ID."""
+@token_required
+def get_appointment(current_user, appointment_id):
+    """Get a single appointment by ID (?fields=&expand=patient,doctor)."""
     try:
         db = get_db()
-        appointment = db.appointments.find_one({'_id': ObjectId(appointment_id)})
+        query = {'_id': ObjectId(appointment_id)}
+        doctor_id = None
+        
+        # If doctor, only their own appointments
+        if current_user['role'] == 'doctor':
+            doctor_id = str(current_user['_id'])
+            query['doctor_id'] = _doctor_filter(doctor_id)
+        
+        validators = get_validators(db, 'appointments', doctor_id, resource=appointment_id)
+        if is_not_modified(validators):
+            return not_modified(validators)
+        
+        names = parse_expand(request.args)
+        projection = expand_projection(parse_fields(request.args), names)
+        appointment = db.appointments.find_one(query, projection)
         if appointment:
-            appointment['_id'] = str(appointment['_id'])
-            if 'patient_id' in appointment:
-                appointment['patient_id'] = str(appointment['patient_id'])
-            return jsonify(appointment), 200
-        return jsonify({'message': 'Appointment not found'}), 404
+            expand_references(get_loader(), [appointment], names)
+            # ObjectIds anywhere in the document are written as strings
+            response = current_app.response_class(encode_document(appointment), mimetype='application/json')
+            return add_validators(response, validators), 200
+        return jsonify({'message': 'Appointment not found or unauthorized'}), 404
+    except (ProjectionError, ExpandError) as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -62,16 +197,30 @@ def create_appointment(current_user):
         data['patient_id'] = ObjectId(data['patient_id'])
         data['doctor_id'] = ObjectId(data['doctor_id'])
         
-        # Add creation timestamp and status
-        data['created_at'] = datetime.utcnow()
+        # Add native start/end, creation timestamp and status
+        try:
+            _set_schedule(data)
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+        data['created_at'] = data['updated_at'] = datetime.utcnow()
         data['status'] = 'scheduled'
         
         # If current user is a doctor, ensure they can only create appointments for themselves
         if current_user['role'] == 'doctor' and str(data['doctor_id']) != str(current_user['_id']):
             return jsonify({'message': 'Unauthorized: Cannot create appointments for other doctors'}), 403
         
+        error = _resolve_references(data)
+        if error:
+            return jsonify({'message': error}), 400
+        
         db = get_db()
+        # Reject double-booking
+        if _find_overlaps(db, data['doctor_id'], [(data['start'], data['end'])]):
+            return jsonify({'message': 'Doctor is already booked at this time'}), 409
+        
         result = db.appointments.insert_one(data)
+        _invalidate_busy(data['doctor_id'], *days_covered(data['start'], data['end']))
+        bump_version(db, 'appointments', data['doctor_id'])
         return jsonify({
             'message': 'Appointment created successfully',
             '_id': str(result.inserted_id)
@@ -93,7 +242,7 @@ def update_appointment(current_user, appointment_id):
         
         # If doctor, only allow updating their own appointments
         if current_user['role'] == 'doctor':
-            query['doctor_id'] = ObjectId(str(current_user['_id']))
+            query['doctor_id'] = _doctor_filter(current_user['_id'])
         
         # Convert IDs if present
         if 'patient_id' in data:
@@ -103,10 +252,42 @@ def update_appointment(current_user, appointment_id):
             # Doctors can't reassign appointments to other doctors
             if current_user['role'] == 'doctor' and str(data['doctor_id']) != str(current_user['_id']):
                 return jsonify({'message': 'Unauthorized: Cannot reassign appointments to other doctors'}), 403
+        error = _resolve_references(data)
+        if error:
+            return jsonify({'message': error}), 400
         
-        result = db.appointments.update_one(query, {'$set': data})
+        # start/end are derived from date, time and duration
+        data.pop('start', None)
+        data.pop('end', None)
+        # A status change frees the slot, or takes it again (maybe rebooked meanwhile)
+        if any(field in data for field in ('date', 'time', 'duration', 'doctor_id', 'status')):
+            existing = db.appointments.find_one(
+                query, {'date': 1, 'time': 1, 'duration': 1, 'doctor_id': 1, 'status': 1, 'start': 1, 'end': 1})
+            if not existing:
+                return jsonify({'message': 'Appointment not found or unauthorized'}), 404
+            schedule = {field: data.get(field, existing.get(field)) for field in ('date', 'time', 'duration')}
+            try:
+                _set_schedule(schedule)
+            except ValueError as e:
+                return jsonify({'message': str(e)}), 400
+            data.update(schedule)
+            doctor_id = data.get('doctor_id', existing['doctor_id'])
+            interval = [(data['start'], data['end'])]
+            if data.get('status', existing.get('status')) != 'cancelled' and \
+                    _find_overlaps(db, doctor_id, interval, exclude={'_id': {'$ne': existing['_id']}}):
+                return jsonify({'message': 'Doctor is already booked at this time'}), 409
+            _invalidate_busy(doctor_id, *days_covered(data['start'], data['end']))
+            if existing.get('start'):
+                _invalidate_busy(existing['doctor_id'],
+                                 *days_covered(existing['start'], existing.get('end') or existing['start']))
         
-        if result.modified_count:
+        data['updated_at'] = datetime.utcnow()
+        previous = db.appointments.find_one_and_update(query, {'$set': data}, projection={'doctor_id': 1})
+        
+        if previous:
+            if 'doctor_id' in data:
+                record_moves(db, 'appointments', [previous], data['doctor_id'], data['updated_at'])
+            bump_version(db, 'appointments', previous.get('doctor_id'), data.get('doctor_id'))
             return jsonify({'message': 'Appointment updated successfully'}), 200
         return jsonify({'message': 'Appointment not found or unauthorized'}), 404
     except Exception as e:
@@ -122,12 +303,240 @@ def delete_appointment(current_user, appointment_id):
         
         # If doctor, only allow deleting their own appointments
         if current_user['role'] == 'doctor':
-            query['doctor_id'] = ObjectId(str(current_user['_id']))
+            query['doctor_id'] = _doctor_filter(current_user['_id'])
         
-        result = db.appointments.delete_one(query)
+        deleted = db.appointments.find_one_and_delete(query, {'doctor_id': 1, 'start': 1, 'end': 1})
         
-        if result.deleted_count:
+        if deleted:
+            record_tombstones(db, 'appointments', [deleted])
+            if deleted.get('start'):
+                _invalidate_busy(deleted['doctor_id'], *days_covered(deleted['start'], deleted.get('end') or deleted['start']))
+            bump_version(db, 'appointments', deleted.get('doctor_id'))
             return jsonify({'message': 'Appointment deleted successfully'}), 200
         return jsonify({'message': 'Appointment not found or unauthorized'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+def _series_query(current_user, series_id, start=None):
+    """Query matching the occurrences of a series the current user may change."""
+    query = {'series_id': ObjectId(series_id)}
+    if current_user['role'] == 'doctor':
+        query['doctor_id'] = _doctor_filter(current_user['_id'])
+    if start:
+        query['date'] = {'$gte': parse_date(start).isoformat()}
+    return query
+
+def _series_intervals(dates, time, duration):
+    """Build the (start, end) interval of each occurrence."""
+    length = timedelta(minutes=duration)
+    return [(start, start + length) for start in (parse_slot(day, time) for day in dates)]
+
+def _find_conflicts(db, doctor_id, dates, time, duration, exclude_series=None):
+    """Return the dates on which the doctor is already booked at this time."""
+    exclude = {'series_id': {'$ne': exclude_series}} if exclude_series else None
+    overlaps = _find_overlaps(db, doctor_id, _series_intervals(dates, time, duration), exclude)
+    return sorted({start.date().isoformat() for start, _ in overlaps})
+
+@appointment_bp.route('/series', methods=['POST'])
+@token_required
+def create_series(current_user):
+    """Create a recurring series of appointments."""
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'message': 'No data provided'}), 400
+
+        required_fields = ['patient_id', 'doctor_id', 'date', 'time', 'reason', 'recurrence']
+        for field in required_fields:
+            if field not in data:
+                return jsonify({'message': f'Missing required field: {field}'}), 400
+
+        recurrence = data.pop('recurrence')
+        dates = [day.isoformat() for day in expand(data.pop('date'), recurrence)]
+        data['duration'] = int(data.get('duration') or APPOINTMENT_MINUTES)
+        if data['duration'] <= 0:
+            return jsonify({'message': 'duration must be a positive number of minutes'}), 400
+        data.pop('start', None)
+        data.pop('end', None)
+        intervals = _series_intervals(dates, data['time'], data['duration'])
+
+        # Convert IDs to ObjectId
+        data['patient_id'] = ObjectId(data['patient_id'])
+        data['doctor_id'] = ObjectId(data['doctor_id'])
+
+        # If current user is a doctor, ensure they can only create appointments for themselves
+        if current_user['role'] == 'doctor' and str(data['doctor_id']) != str(current_user['_id']):
+            return jsonify({'message': 'Unauthorized: Cannot create appointments for other doctors'}), 403
+
+        error = _resolve_references(data)
+        if error:
+            return jsonify({'message': error}), 400
+
+        db = get_db()
+        # One query checks every occurrence for double-booking
+        conflicts = _find_conflicts(db, data['doctor_id'], dates, data['time'], data['duration'])
+        if conflicts:
+            return jsonify({'message': 'Doctor is already booked', 'conflicts': conflicts}), 409
+
+        series_id = ObjectId()
+        now = datetime.utcnow()
+        operations = [
+            InsertOne(dict(
+                data,
+                date=day,
+                start=start,
+                end=end,
+                series_id=series_id,
+                occurrence=index,
+                recurrence=recurrence,
+                status='scheduled',
+                created_at=now,
+                updated_at=now
+            ))
+            for index, (day, (start, end)) in enumerate(zip(dates, intervals))
+        ]
+        result = db.appointments.bulk_write(operations)
+        _invalidate_busy(data['doctor_id'], *(day for start, end in intervals for day in days_covered(start, end)))
+        bump_version(db, 'appointments', data['doctor_id'])
+        return jsonify({
+            'message': 'Appointment series created successfully',
+            'series_id': str(series_id),
+            'created': result.inserted_count,
+            'dates': dates
+        }), 201
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@appointment_bp.route('/series/<series_id>', methods=['PUT'])
+@token_required
+def update_series(current_user, series_id):
+    """Update every occurrence of a series (?from=YYYY-MM-DD to only change later ones)."""
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'message': 'No data provided'}), 400
+
+        # Dates, ids and the rule belong to the series itself
+        for field in ('date', 'start', 'end', 'series_id', 'occurrence', 'recurrence', '_id'):
+            if field in data:
+                return jsonify({'message': f'Cannot change {field} of a series'}), 400
+
+        db = get_db()
+        query = _series_query(current_user, series_id, request.args.get('from'))
+
+        if 'patient_id' in data:
+            data['patient_id'] = ObjectId(data['patient_id'])
+        if 'doctor_id' in data:
+            data['doctor_id'] = ObjectId(data['doctor_id'])
+            # Doctors can't reassign appointments to other doctors
+            if current_user['role'] == 'doctor' and str(data['doctor_id']) != str(current_user['_id']):
+                return jsonify({'message': 'Unauthorized: Cannot reassign appointments to other doctors'}), 403
+        error = _resolve_references(data)
+        if error:
+            return jsonify({'message': error}), 400
+
+        if 'duration' in data:
+            data['duration'] = int(data['duration'])
+            if data['duration'] <= 0:
+                return jsonify({'message': 'duration must be a positive number of minutes'}), 400
+
+        if any(field in data for field in ('time', 'duration', 'doctor_id')):
+            occurrences = list(db.appointments.find(query, {'date': 1, 'time': 1, 'duration': 1, 'doctor_id': 1}))
+            if occurrences:
+                first = occurrences[0]
+                doctor_id = data.get('doctor_id', first['doctor_id'])
+                time = data.get('time', first['time'])
+                duration = data.get('duration', first.get('duration') or APPOINTMENT_MINUTES)
+                dates = [occurrence['date'] for occurrence in occurrences]
+                conflicts = _find_conflicts(db, doctor_id, dates, time, duration, exclude_series=ObjectId(series_id))
+                if conflicts:
+                    return jsonify({'message': 'Doctor is already booked', 'conflicts': conflicts}), 409
+
+        data['updated_at'] = datetime.utcnow()
+        doctor_ids = db.appointments.distinct('doctor_id', query)
+        # Occurrences leaving their doctor, read before the update moves them out of the query
+        moving = list(db.appointments.find(query, {'doctor_id': 1})) if 'doctor_id' in data else []
+        update = {'$set': data}
+        if 'time' in data or 'duration' in data:
+            # Recompute each occurrence's start/end server-side in the same update
+            update = [
+                {'$set': {field: {'$literal': value} for field, value in data.items()}},
+                {'$set': {'start': {'$dateFromString': {'dateString': {'$concat': ['$date', 'T', '$time']}}}}},
+                {'$set': {'end': {'$add': ['$start', {'$multiply': [{'$ifNull': ['$duration', APPOINTMENT_MINUTES]}, 60000]}]}}}
+            ]
+        result = db.appointments.update_many(query, update)
+        # Series changes touch many days, drop every cached day
+        busy_cache.clear()
+        if result.matched_count:
+            record_moves(db, 'appointments', moving, data.get('doctor_id'), data['updated_at'])
+            bump_version(db, 'appointments', *doctor_ids, data.get('doctor_id'))
+            return jsonify({'message': 'Appointment series updated successfully', 'updated': result.modified_count}), 200
+        return jsonify({'message': 'Appointment series not found or unauthorized'}), 404
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@appointment_bp.route('/series/<series_id>', methods=['DELETE'])
+@token_required
+def cancel_series(current_user, series_id):
+    """Cancel every scheduled occurrence of a series (?from=YYYY-MM-DD to keep earlier ones)."""
+    try:
+        db = get_db()
+        query = _series_query(current_user, series_id, request.args.get('from'))
+        query['status'] = 'scheduled'
+
+        doctor_ids = db.appointments.distinct('doctor_id', query)
+        result = db.appointments.update_many(query, {'$set': {'status': 'cancelled', 'updated_at': datetime.utcnow()}})
+        # Series changes touch many days, drop every cached day
+        busy_cache.clear()
+        if result.matched_count:
+            bump_version(db, 'appointments', *doctor_ids)
+            return jsonify({'message': 'Appointment series cancelled successfully', 'cancelled': result.modified_count}), 200
+        return jsonify({'message': 'Appointment series not found or unauthorized'}), 404
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@appointment_bp.route('/availability', methods=['GET'])
+@token_required
+def get_availability(current_user):
+    """Get a doctor's free slots (?doctor_id=&from=YYYY-MM-DD&to=YYYY-MM-DD&duration=)."""
+    try:
+        doctor_id = request.args.get('doctor_id')
+        if not doctor_id and current_user['role'] == 'doctor':
+            doctor_id = str(current_user['_id'])
+        if not doctor_id:
+            return jsonify({'message': 'Missing required parameter: doctor_id'}), 400
+        doctor_id = ObjectId(doctor_id)
+
+        first_day = parse_date(request.args.get('from') or datetime.utcnow().strftime('%Y-%m-%d'))
+        last_day = parse_date(request.args.get('to') or first_day.isoformat())
+        if last_day < first_day:
+            return jsonify({'message': 'to must not be before from'}), 400
+        if (last_day - first_day).days >= AVAILABILITY_MAX_DAYS:
+            return jsonify({'message': f'Cannot search more than {AVAILABILITY_MAX_DAYS} days at once'}), 400
+
+        duration = int(request.args.get('duration', APPOINTMENT_MINUTES))
+        if duration <= 0:
+            return jsonify({'message': 'duration must be a positive number of minutes'}), 400
+        length = timedelta(minutes=duration)
+
+        db = get_db()
+        busy = _busy_days(db, doctor_id, first_day, last_day)
+        days = {}
+        for day, intervals in sorted(busy.items()):
+            window_start = parse_slot(day.isoformat(), WORKDAY_START)
+            window_end = parse_slot(day.isoformat(), WORKDAY_END)
+            days[day.isoformat()] = [
+                {'start': start.strftime('%H:%M'), 'end': end.strftime('%H:%M')}
+                for start, end in intervals.free_slots(window_start, window_end, length)
+            ]
+        return jsonify({'doctor_id': str(doctor_id), 'duration': duration, 'days': days}), 200
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
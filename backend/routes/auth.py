@@ -1,42 +1,11 @@
 from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
 from models.db import get_db
-import jwt
-from datetime import datetime, timedelta
-from functools import wraps
-import os
+from utils.auth import issue_tokens, load_user, token_required
+from utils.passwords import HashingBusy, hash_password, upgrade_hash, verify_password
+from datetime import datetime
 
 auth_bp = Blueprint('auth', __name__)
 
-# Secret key for JWT - in production, use environment variable
-SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'your-secret-key-here')
-
-def token_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = None
-        if 'Authorization' in request.headers:
-            token = request.headers['Authorization'].split(" ")[1]
-        
-        if not token:
-            return jsonify({'message': 'Token is missing'}), 401
-        
-        try:
-            data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            db = get_db()
-            current_user = db.users.find_one({'_id': data['user_id']})
-            if not current_user:
-                return jsonify({'message': 'Invalid token'}), 401
-        except jwt.ExpiredSignatureError:
-            return jsonify({'message': 'Token has expired'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'message': 'Invalid token'}), 401
-        except Exception as e:
-            return jsonify({'message': 'Token is invalid'}), 401
-        
-        return f(current_user, *args, **kwargs)
-    return decorated
-
 @auth_bp.route('/register', methods=['POST'])
 def register():
     try:
@@ -59,7 +28,7 @@ def register():
             return jsonify({'message': 'Email already exists'}), 400
         
         # Hash the password
-        hashed_password = generate_password_hash(data['password'])
+        hashed_password = hash_password(data['password'])
         
         # Create new user
         new_user = {
@@ -77,6 +46,8 @@ def register():
             'user_id': str(result.inserted_id)
         }), 201
         
+    except HashingBusy as e:
+        return jsonify({'message': str(e)}), 503, {'Retry-After': str(e.retry_after)}
     except Exception as e:
         return jsonify({'message': f'Error during registration: {str(e)}'}), 500
 
@@ -91,20 +62,18 @@ def login():
         db = get_db()
         user = db.users.find_one({'username': data['username']})
         
-        if not user or not check_password_hash(user['password'], data['password']):
+        if not user or not verify_password(user['password'], data['password']):
             return jsonify({'message': 'Invalid username or password'}), 401
         
-        # Generate JWT token
-        token = jwt.encode({
-            'user_id': str(user['_id']),
-            'username': user['username'],
-            'role': user['role'],
-            'exp': datetime.utcnow() + timedelta(hours=24)
-        }, SECRET_KEY)
+        # Move the stored hash to the current PASSWORD_HASH_METHOD
+        upgrade_hash(db, user, data['password'])
+        
+        # Access token plus refresh token
+        tokens = issue_tokens(db, user)
         
         return jsonify({
             'message': 'Login successful',
-            'token': token,
+            **tokens,
             'user': {
                 'id': str(user['_id']),
                 'username': user['username'],
@@ -113,6 +82,8 @@ def login():
             }
         }), 200
         
+    except HashingBusy as e:
+        return jsonify({'message': str(e)}), 503, {'Retry-After': str(e.retry_after)}
     except Exception as e:
         return jsonify({'message': f'Error during login: {str(e)}'}), 500
 
@@ -120,11 +91,15 @@ def login():
 @token_required
 def get_profile(current_user):
     try:
+        # In claims-only auth mode current_user only carries the token claims
+        user = load_user(get_db(), current_user['_id'])
+        if not user:
+            return jsonify({'message': 'User not found'}), 404
         user_data = {
-            'id': str(current_user['_id']),
-            'username': current_user['username'],
-            'email': current_user['email'],
-            'role': current_user['role']
+            'id': str(user['_id']),
+            'username': user['username'],
+            'email': user['email'],
+            'role': user['role']
         }
         return jsonify(user_data), 200
     except Exception as e:
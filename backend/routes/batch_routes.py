@@ -0,0 +1,163 @@
+from flask import Blueprint, current_app, request, jsonify
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+from utils.auth import PRINCIPAL_ENVIRON_KEY, token_required
+import json
+import os
+import threading
+
+batch_bp = Blueprint('batch', __name__)
+
+# Sub-requests accepted per batch, and threads running the read-only ones
+BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', '20'))
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', '8'))
+
+# Only these methods may run in parallel; anything else runs alone, in order
+PARALLEL_METHODS = {'GET', 'HEAD'}
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'DELETE'}
+
+# Request headers a sub-request may set, and response headers passed back
+FORWARDED_HEADERS = {'accept', 'content-type', 'if-none-match', 'if-modified-since'}
+RETURNED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Link', 'X-Total-Count', 'Retry-After')
+
+# The pool of this process, created on first use
+_pool = None
+_pool_pid = None
+_lock = threading.Lock()
+
+
+class BatchError(ValueError):
+    """Raised when a sub-request of a batch is malformed."""
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch')
+                _pool_pid = pid
+    return _pool
+
+
+def parse_sub_request(item, prefix):
+    """Validate one entry of a batch: {"method", "path", "headers", "body"}."""
+    if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+        raise BatchError('Each request needs a path')
+    method = str(item.get('method', 'GET')).upper()
+    if method not in METHODS:
+        raise BatchError(f'Unsupported method: {method}')
+    path = item['path']
+    if not path.startswith('/api/') or path.split('?', 1)[0].rstrip('/') == prefix:
+        raise BatchError(f'Invalid path: {path}')
+    headers = item.get('headers') or {}
+    if not isinstance(headers, dict):
+        raise BatchError('headers must be an object')
+    headers = {name: str(value) for name, value in headers.items() if name.lower() in FORWARDED_HEADERS}
+    return method, path, headers, item.get('body')
+
+
+def group_sub_requests(methods):
+    """Split sub-request indexes into steps run one after the other.
+
+    Consecutive reads share a step and run in parallel; every write is a step
+    of its own, so it sees the effect of the writes before it.
+    """
+    steps = []
+    for index, method in enumerate(methods):
+        if method in PARALLEL_METHODS and steps and steps[-1][0] in PARALLEL_METHODS:
+            steps[-1][1].append(index)
+        else:
+            steps.append((method, [index]))
+    return [indexes for _, indexes in steps]
+
+
+def _endpoint(app, environ):
+    """Endpoint a sub-request resolves to, after percent-decoding; None if it matches no route."""
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        return None
+    return endpoint
+
+
+def _decode_body(data, content_type):
+    text = data.decode('utf-8', 'replace')
+    try:
+        if content_type.startswith('application/x-ndjson'):
+            return [json.loads(line) for line in text.splitlines() if line.strip()]
+        if content_type.startswith('application/json'):
+            return json.loads(text) if text.strip() else None
+    except ValueError:
+        pass
+    return text
+
+
+def _dispatch(app, environ):
+    """Run one sub-request through the app, as if it came in on its own."""
+    app_iter, status, headers = run_wsgi_app(app.wsgi_app, environ, buffered=True)
+    try:
+        data = b''.join(app_iter)
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+    content_type = headers.get('Content-Type', '')
+    return {
+        'status': int(status.split(' ', 1)[0]),
+        'headers': {name: headers[name] for name in RETURNED_HEADERS if name in headers},
+        'body': _decode_body(data, content_type)
+    }
+
+
+@batch_bp.route('', methods=['POST'])
+@token_required
+def batch(current_user):
+    """Run several API requests in one round trip.
+
+    Body: {"requests": [{"method": "GET", "path": "/api/patients?limit=10"}, ...]}.
+    Sub-requests run as the caller, who is authenticated once for the whole
+    batch. Responses come back in request order.
+    """
+    try:
+        # A batch inside a batch would wait on the pool it is running on
+        if PRINCIPAL_ENVIRON_KEY in request.environ:
+            return jsonify({'message': 'Batches cannot be nested'}), 400
+        data = request.get_json(silent=True)
+        items = data.get('requests') if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return jsonify({'message': 'requests must be a non-empty list'}), 400
+        if len(items) > BATCH_MAX_REQUESTS:
+            return jsonify({'message': f'At most {BATCH_MAX_REQUESTS} requests per batch'}), 400
+        try:
+            parsed = [parse_sub_request(item, request.path.rstrip('/')) for item in items]
+        except BatchError as e:
+            return jsonify({'message': str(e)}), 400
+
+        app = current_app._get_current_object()
+        environs = []
+        for method, path, headers, body in parsed:
+            builder = EnvironBuilder(path=path, base_url=request.host_url, method=method, headers=headers, json=body)
+            try:
+                environ = builder.get_environ()
+            finally:
+                builder.close()
+            # The path check of parse_sub_request misses encoded forms such as /api/%62atch
+            if _endpoint(app, environ) == request.endpoint:
+                return jsonify({'message': f'Invalid path: {path}'}), 400
+            environ['REMOTE_ADDR'] = request.remote_addr
+            # utils.auth takes the caller from here instead of re-checking a token
+            environ[PRINCIPAL_ENVIRON_KEY] = dict(current_user)
+            environs.append(environ)
+
+        # Sub-requests always run on the pool, so each gets a context of its own
+        pool = _get_pool()
+        responses = [None] * len(environs)
+        for indexes in group_sub_requests([method for method, _, _, _ in parsed]):
+            futures = {index: pool.submit(_dispatch, app, environs[index]) for index in indexes}
+            for index, future in futures.items():
+                responses[index] = future.result()
+        return jsonify({'responses': responses}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,111 @@
+from flask import Blueprint, request, jsonify
+from bson import ObjectId
+from models.db import get_db
+from datetime import datetime, timedelta
+from utils.auth import token_required
+from utils.cache import TTLCache
+import os
+
+dashboard_bp = Blueprint('dashboard', __name__)
+
+# Summaries are cached per scope and day for a few seconds
+summary_cache = TTLCache(maxsize=1024, ttl=int(os.getenv('DASHBOARD_CACHE_TTL', '30')))
+
+# Number of days covered by the upcoming appointments breakdown
+UPCOMING_DAYS = 7
+
+def _count(facet):
+    return facet[0]['count'] if facet else 0
+
+def summary_pipeline(patient_query, appointment_query, today, until):
+    """Build the single aggregation computing every dashboard figure."""
+    is_appointment = {'$eq': ['$kind', 'appointment']}
+    is_today = {'$and': [is_appointment, {'$eq': ['$date', today]}]}
+    return [
+        {'$match': patient_query},
+        {'$project': {'_id': 0, 'kind': {'$literal': 'patient'}, 'doctor_id': {'$toString': '$doctor_id'}}},
+        {'$unionWith': {'coll': 'appointments', 'pipeline': [
+            {'$match': appointment_query},
+            {'$project': {
+                '_id': 0,
+                'kind': {'$literal': 'appointment'},
+                'doctor_id': {'$toString': '$doctor_id'},
+                'date': 1,
+                'status': 1
+            }}
+        ]}},
+        {'$facet': {
+            'total_patients': [{'$match': {'kind': 'patient'}}, {'$count': 'count'}],
+            'total_appointments': [{'$match': {'kind': 'appointment'}}, {'$count': 'count'}],
+            'today_appointments': [{'$match': {'kind': 'appointment', 'date': today}}, {'$count': 'count'}],
+            'upcoming': [
+                {'$match': {'kind': 'appointment', 'date': {'$gte': today, '$lt': until}}},
+                {'$group': {'_id': '$date', 'count': {'$sum': 1}}},
+                {'$sort': {'_id': 1}}
+            ],
+            'by_status': [
+                {'$match': {'kind': 'appointment'}},
+                {'$group': {'_id': '$status', 'count': {'$sum': 1}}}
+            ],
+            'by_doctor': [
+                {'$group': {
+                    '_id': '$doctor_id',
+                    'patients': {'$sum': {'$cond': [{'$eq': ['$kind', 'patient']}, 1, 0]}},
+                    'appointments': {'$sum': {'$cond': [is_appointment, 1, 0]}},
+                    'today_appointments': {'$sum': {'$cond': [is_today, 1, 0]}}
+                }},
+                {'$sort': {'_id': 1}}
+            ]
+        }}
+    ]
+
+@dashboard_bp.route('/summary', methods=['GET'])
+@token_required
+def get_summary(current_user):
+    """Get the dashboard figures in one request (?date=YYYY-MM-DD for "today")."""
+    try:
+        today = request.args.get('date') or datetime.utcnow().strftime('%Y-%m-%d')
+        try:
+            start = datetime.strptime(today, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({'message': 'date must be in YYYY-MM-DD format'}), 400
+        until = (start + timedelta(days=UPCOMING_DAYS)).strftime('%Y-%m-%d')
+
+        patient_query = {}
+        appointment_query = {}
+        scope = 'all'
+        # If doctor, only count their own patients and appointments
+        if current_user['role'] == 'doctor':
+            scope = str(current_user['_id'])
+            patient_query['doctor_id'] = scope
+            # Appointments may hold the doctor id as ObjectId or string
+            appointment_query['doctor_id'] = {'$in': [ObjectId(scope), scope]}
+
+        cache_key = (scope, today)
+        summary = summary_cache.get(cache_key)
+        if summary is None:
+            db = get_db()
+            pipeline = summary_pipeline(patient_query, appointment_query, today, until)
+            result = next(db.patients.aggregate(pipeline), {})
+            summary = {
+                'date': today,
+                'total_patients': _count(result.get('total_patients')),
+                'total_appointments': _count(result.get('total_appointments')),
+                'today_appointments': _count(result.get('today_appointments')),
+                'upcoming_appointments': {row['_id']: row['count'] for row in result.get('upcoming', [])},
+                'appointments_by_status': {str(row['_id']): row['count'] for row in result.get('by_status', [])}
+            }
+            if scope == 'all':
+                summary['by_doctor'] = [
+                    {
+                        'doctor_id': row['_id'],
+                        'patients': row['patients'],
+                        'appointments': row['appointments'],
+                        'today_appointments': row['today_appointments']
+                    }
+                    for row in result.get('by_doctor', [])
+                ]
+            summary_cache.set(cache_key, summary)
+        return jsonify(summary), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -1,15 +1,69 @@
 from flask import Blueprint, request, jsonify
 from bson import ObjectId
+from pymongo.errors import BulkWriteError
 from models.db import get_db
+from models.events import EVENTS_COLLECTION, TRACKED_FIELDS, change_events, delete_events, record_changes
+from models.history import (
+    HISTORY_COLLECTION, add_entries, build_buckets, decode_position, delete_history, history_page,
+    migrate_patient_history, parse_entry_date
+)
+from models.patient import raw_patients
+from models.sync import record_moves, record_tombstones
+from models.timeline import decode_timeline_cursor, timeline_page
 from datetime import datetime
-from routes.user_routes import token_required
+from utils.auth import token_required
+from utils.pagination import MAX_PAGE_SIZE, PaginationError, next_link, paginate, parse_page_args
+from utils.projection import PATIENT_SUMMARY, ProjectionError, parse_fields
+from utils.references import sync_patient_summary
+from utils.search import SEARCH_KEY_FIELDS, prefix_query, search_keys
+from utils.streaming import stream_documents, wants_ndjson
+from utils.versioning import add_validators, bump_version, get_validators, is_not_modified, not_modified
+import csv
+import json
+import os
 
 patient_bp = Blueprint('patients', __name__)
 
+REQUIRED_FIELDS = ['name', 'email', 'phone', 'address', 'date_of_birth']
+
+# Bulk import: rows validated and inserted per batch, error report capped
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '1000'))
+IMPORT_MAX_ERRORS = int(os.getenv('IMPORT_MAX_ERRORS', '1000'))
+
+# Medical history entries per request
+HISTORY_DEFAULT_LIMIT = 50
+
+# Timeline items per request
+TIMELINE_DEFAULT_LIMIT = 50
+
+# Search results per request
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 50
+
+class HistoryError(ValueError):
+    """Raised when medical history entries are malformed."""
+
+def _entry_date(value, now):
+    """Date of a history entry: now if missing, else a datetime or an ISO 8601 string (stored as UTC)."""
+    if not value:
+        return now
+    try:
+        return parse_entry_date(value)
+    except ValueError:
+        raise HistoryError(f'Invalid history entry date: {value}')
+
+def _history_entries(value, now):
+    """Validate a medical history entry or list of entries, dating undated ones."""
+    entries = value if isinstance(value, list) else [value]
+    if not all(isinstance(entry, dict) for entry in entries):
+        raise HistoryError('medical_history entries must be objects')
+    # Stored as real dates so the timeline can sort them with appointments
+    return [dict(entry, date=_entry_date(entry.get('date'), now)) for entry in entries]
+
 @patient_bp.route('/', methods=['GET'])
 @token_required
 def get_patients(current_user):
-    """Get all patients."""
+    """Get a page of patients (?limit=&after=&sort=&count=&fields=)."""
     try:
         db = get_db()
         query = {}
@@ -18,12 +72,17 @@ def get_patients(current_user):
         if current_user['role'] == 'doctor':
             query['doctor_id'] = str(current_user['_id'])
             
-        patients = list(db.patients.find(query))
-        for patient in patients:
-            patient['_id'] = str(patient['_id'])
-            if 'doctor_id' in patient:
-                patient['doctor_id'] = str(patient['doctor_id'])
-        return jsonify(patients), 200
+        # Answer 304 before touching the patients if nothing changed since the last poll
+        validators = get_validators(db, 'patients', query.get('doctor_id'))
+        if is_not_modified(validators):
+            return not_modified(validators)
+            
+        page = parse_page_args(request.args)
+        projection = parse_fields(request.args, default=PATIENT_SUMMARY)
+        patients, headers = paginate(raw_patients(db), query, page, projection)
+        return add_validators(stream_documents(patients, headers=headers), validators)
+    except (PaginationError, ProjectionError) as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -36,8 +95,7 @@ def add_patient(current_user):
         if not data:
             return jsonify({'message': 'No data provided'}), 400
             
-        required_fields = ['name', 'email', 'phone', 'address', 'date_of_birth']
-        for field in required_fields:
+        for field in REQUIRED_FIELDS:
             if field not in data:
                 return jsonify({'message': f'Missing required field: {field}'}), 400
         
@@ -48,8 +106,11 @@ def add_patient(current_user):
             # If admin is adding patient with specific doctor
             data['doctor_id'] = str(data['doctor_id'])
             
-        # Add creation timestamp
-        data['created_at'] = datetime.utcnow()
+        # Add timestamps and autocomplete keys
+        data['created_at'] = data['updated_at'] = datetime.utcnow()
+        data['search_keys'] = search_keys(data)
+        # History is kept in its own bucketed collection
+        history = _history_entries(data.pop('medical_history', None) or [], data['created_at'])
         
         db = get_db()
         # Check if email already exists
@@ -57,10 +118,219 @@ def add_patient(current_user):
             return jsonify({'message': 'Patient with this email already exists'}), 400
             
         result = db.patients.insert_one(data)
+        record_changes(db, result.inserted_id, data.get('doctor_id'), {}, data, data['created_at'])
+        if history:
+            db[HISTORY_COLLECTION].insert_many(build_buckets(result.inserted_id, data.get('doctor_id'), history))
+        bump_version(db, 'patients', data.get('doctor_id'))
         return jsonify({
             'message': 'Patient added successfully',
             '_id': str(result.inserted_id)
         }), 201
+    except HistoryError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _invalid_utf8(text):
+    # Undecodable bytes come through surrogateescape as lone surrogates
+    return any('\udc80' <= char <= '\udcff' for char in text)
+
+def _read_import_rows(stream, mimetype):
+    """Yield (row_number, document or error message) from a CSV or NDJSON body."""
+    lines = (line.decode('utf-8-sig', 'surrogateescape') for line in stream)
+    if mimetype == 'text/csv':
+        for number, row in enumerate(csv.DictReader(lines), start=1):
+            if any(_invalid_utf8(text) for item in row.items() for text in item if isinstance(text, str)):
+                yield number, 'Invalid UTF-8'
+                continue
+            yield number, {k.strip(): v.strip() for k, v in row.items() if k and v is not None and v.strip()}
+        return
+
+    number = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        number += 1
+        if _invalid_utf8(line):
+            yield number, 'Invalid UTF-8'
+            continue
+        try:
+            doc = json.loads(line)
+        except ValueError:
+            yield number, 'Invalid JSON'
+            continue
+        yield number, doc if isinstance(doc, dict) else 'Row must be a JSON object'
+
+def _batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _import_batch(db, batch, current_user, now):
+    """Validate and insert one batch. Returns (inserted count, [(row, error)])."""
+    errors = []
+    valid = []
+    seen = set()
+    history = {}
+    for number, doc in batch:
+        if isinstance(doc, str):
+            errors.append((number, doc))
+            continue
+        missing = [field for field in REQUIRED_FIELDS if not doc.get(field)]
+        if missing:
+            errors.append((number, f"Missing required field: {', '.join(missing)}"))
+            continue
+        doc.pop('_id', None)
+        doc['email'] = str(doc['email'])
+        if doc['email'] in seen:
+            errors.append((number, 'Duplicate email in import'))
+            continue
+        seen.add(doc['email'])
+        # Same doctor assignment rules as add_patient
+        if current_user['role'] == 'doctor':
+            doc['doctor_id'] = str(current_user['_id'])
+        elif 'doctor_id' in doc:
+            doc['doctor_id'] = str(doc['doctor_id'])
+        doc['created_at'] = doc['updated_at'] = now
+        doc['search_keys'] = search_keys(doc)
+        try:
+            history[number] = _history_entries(doc.pop('medical_history', None) or [], now)
+        except HistoryError as e:
+            errors.append((number, str(e)))
+            continue
+        valid.append((number, doc))
+
+    # One duplicate check for the whole batch
+    existing = {
+        patient['email']
+        for patient in db.patients.find({'email': {'$in': list(seen)}}, {'email': 1, '_id': 0})
+    } if seen else set()
+    rows = []
+    for number, doc in valid:
+        if doc['email'] in existing:
+            errors.append((number, 'Patient with this email already exists'))
+        else:
+            rows.append((number, doc))
+    if not rows:
+        return 0, errors
+
+    failed = set()
+    try:
+        result = db.patients.insert_many([doc for _, doc in rows], ordered=False)
+        inserted = len(result.inserted_ids)
+    except BulkWriteError as e:
+        # Unordered insert: every row is attempted, failures are reported by index
+        inserted = e.details.get('nInserted', 0)
+        for error in e.details.get('writeErrors', []):
+            message = 'Patient with this email already exists' if error.get('code') == 11000 else error.get('errmsg')
+            errors.append((rows[error['index']][0], message))
+            failed.add(error['index'])
+    # insert_many has set the _id of every row; add their history and change log
+    buckets = [
+        bucket
+        for index, (number, doc) in enumerate(rows) if index not in failed and history[number]
+        for bucket in build_buckets(doc['_id'], doc.get('doctor_id'), history[number])
+    ]
+    if buckets:
+        db[HISTORY_COLLECTION].insert_many(buckets)
+    events = [
+        event
+        for index, (number, doc) in enumerate(rows) if index not in failed
+        for event in change_events(doc['_id'], doc.get('doctor_id'), {}, doc, now)
+    ]
+    if events:
+        db[EVENTS_COLLECTION].insert_many(events)
+    if inserted:
+        bump_version(db, 'patients', *{doc.get('doctor_id') for _, doc in rows})
+    return inserted, errors
+
+def _import_progress(db, rows, current_user):
+    """Import rows batch by batch, yielding progress counts after each batch."""
+    now = datetime.utcnow()
+    progress = {'processed': 0, 'inserted': 0, 'failed': 0}
+    for batch in _batched(rows, IMPORT_BATCH_SIZE):
+        inserted, errors = _import_batch(db, batch, current_user, now)
+        progress['processed'] += len(batch)
+        progress['inserted'] += inserted
+        progress['failed'] += len(batch) - inserted
+        yield dict(progress), sorted(errors)
+
+@patient_bp.route('/import', methods=['POST'])
+@token_required
+def import_patients(current_user):
+    """Bulk import patients from a CSV (text/csv) or NDJSON (application/x-ndjson) body.
+
+    Responds with the counts and per-row errors, or streams one progress line
+    per batch when the client accepts application/x-ndjson.
+    """
+    try:
+        if request.mimetype not in ('text/csv', 'application/x-ndjson'):
+            return jsonify({'message': 'Content-Type must be text/csv or application/x-ndjson'}), 415
+
+        db = get_db()
+        rows = _read_import_rows(request.stream, request.mimetype)
+        progress = _import_progress(db, rows, current_user)
+
+        if wants_ndjson():
+            def lines():
+                for counts, errors in progress:
+                    counts['errors'] = [{'row': number, 'error': error} for number, error in errors]
+                    yield counts
+            return stream_documents(lines(), batch_size=1)
+
+        summary = {'processed': 0, 'inserted': 0, 'failed': 0, 'errors': []}
+        for counts, errors in progress:
+            summary.update(counts)
+            room = IMPORT_MAX_ERRORS - len(summary['errors'])
+            summary['errors'].extend({'row': number, 'error': error} for number, error in errors[:room])
+        summary['errors_truncated'] = summary['failed'] > len(summary['errors'])
+        status = 201 if summary['inserted'] else 400
+        return jsonify(summary), status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@patient_bp.route('/search', methods=['GET'])
+@token_required
+def search_patients(current_user):
+    """Search patients (?q=&mode=text|prefix&limit=&fields=).
+
+    text: ranked full-text search over name, email, phone, conditions and notes.
+    prefix: type-ahead match on the start of the name, a name word, email or phone.
+    """
+    try:
+        term = request.args.get('q', '').strip()
+        if not term:
+            return jsonify({'message': 'Missing required parameter: q'}), 400
+        mode = request.args.get('mode', 'text')
+        if mode not in ('text', 'prefix'):
+            return jsonify({'message': 'mode must be text or prefix'}), 400
+        try:
+            limit = min(max(int(request.args.get('limit', SEARCH_DEFAULT_LIMIT)), 1), SEARCH_MAX_LIMIT)
+        except ValueError:
+            return jsonify({'message': 'limit must be an integer'}), 400
+
+        query = {}
+        # If doctor, only search their patients
+        if current_user['role'] == 'doctor':
+            query['doctor_id'] = str(current_user['_id'])
+
+        projection = parse_fields(request.args, default=PATIENT_SUMMARY)
+        db = get_db()
+        if mode == 'prefix':
+            query.update(prefix_query(term))
+            cursor = raw_patients(db).find(query, projection).limit(limit)
+        else:
+            query['$text'] = {'$search': term}
+            projection = dict(projection, score={'$meta': 'textScore'})
+            cursor = raw_patients(db).find(query, projection).sort([('score', {'$meta': 'textScore'})]).limit(limit)
+        return stream_documents(cursor)
+    except ProjectionError as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -89,10 +359,32 @@ def update_patient(current_user, patient_id):
             existing = db.patients.find_one({'email': data['email'], '_id': {'$ne': ObjectId(patient_id)}})
             if existing:
                 return jsonify({'message': 'Another patient with this email already exists'}), 400
-                
-        result = db.patients.update_one(query, {'$set': data})
         
-        if result.modified_count:
+        if 'medical_history' in data:
+            return jsonify({'message': f'Add medical history with POST /api/patients/{patient_id}/history'}), 400
+        
+        # Keep the autocomplete keys in step with name/email/phone
+        data.pop('search_keys', None)
+        if any(field in data for field in SEARCH_KEY_FIELDS):
+            current = db.patients.find_one(query, {field: 1 for field in SEARCH_KEY_FIELDS})
+            if not current:
+                return jsonify({'message': 'Patient not found or unauthorized'}), 404
+            data['search_keys'] = search_keys(dict(current, **data))
+        
+        data['updated_at'] = datetime.utcnow()
+        # The previous medications/allergies are needed for the change log
+        projection = dict.fromkeys(['doctor_id', *(field for field in TRACKED_FIELDS if field in data)], 1)
+        previous = db.patients.find_one_and_update(query, {'$set': data}, projection=projection)
+        
+        if previous:
+            record_changes(db, previous['_id'], data.get('doctor_id', previous.get('doctor_id')), previous, data,
+                           data['updated_at'])
+            if 'doctor_id' in data:
+                # The previous doctor's sync sees the patient leave
+                record_moves(db, 'patients', [previous], data['doctor_id'], data['updated_at'])
+            # Keep the copies embedded in appointments in step
+            sync_patient_summary(db, previous['_id'], data)
+            bump_version(db, 'patients', previous.get('doctor_id'), data.get('doctor_id'))
             return jsonify({'message': 'Patient updated successfully'}), 200
         return jsonify({'message': 'Patient not found or unauthorized'}), 404
     except Exception as e:
@@ -111,13 +403,110 @@ def delete_patient(current_user, patient_id):
             query['doctor_id'] = str(current_user['_id'])
             
         # Check if patient has any appointments
-        if db.appointments.find_one({'patient_id': ObjectId(patient_id)}):
+        if db.appointments.find_one({'patient_id': ObjectId(patient_id)}, {'_id': 1}):
             return jsonify({'message': 'Cannot delete patient with existing appointments'}), 400
             
-        result = db.patients.delete_one(query)
+        deleted = db.patients.find_one_and_delete(query, projection={'doctor_id': 1})
         
-        if result.deleted_count:
+        if deleted:
+            delete_history(db, deleted['_id'])
+            delete_events(db, deleted['_id'])
+            record_tombstones(db, 'patients', [deleted])
+            bump_version(db, 'patients', deleted.get('doctor_id'))
             return jsonify({'message': 'Patient deleted successfully'}), 200
         return jsonify({'message': 'Patient not found or unauthorized'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+def _find_own_patient(db, current_user, patient_id, projection):
+    """Find a patient the current user may see, or None."""
+    query = {'_id': ObjectId(patient_id)}
+    # If doctor, only their own patients
+    if current_user['role'] == 'doctor':
+        query['doctor_id'] = str(current_user['_id'])
+    return db.patients.find_one(query, projection)
+
+@patient_bp.route('/<patient_id>/history', methods=['GET'])
+@token_required
+def get_history(current_user, patient_id):
+    """Get a page of a patient's medical history, newest first (?limit=&after=)."""
+    try:
+        db = get_db()
+        try:
+            limit = int(request.args.get('limit', HISTORY_DEFAULT_LIMIT))
+        except ValueError:
+            return jsonify({'message': 'limit must be an integer'}), 400
+        if limit < 1:
+            return jsonify({'message': 'limit must be positive'}), 400
+        after = decode_position(request.args['after']) if request.args.get('after') else None
+
+        patient = _find_own_patient(db, current_user, patient_id, {'doctor_id': 1, 'medical_history': 1})
+        if not patient:
+            return jsonify({'message': 'Patient not found or unauthorized'}), 404
+        # Not reached by the history migration yet: move it now
+        if 'medical_history' in patient:
+            migrate_patient_history(db, patient)
+
+        entries, cursor = history_page(db, patient['_id'], min(limit, MAX_PAGE_SIZE), after)
+        headers = {'Link': f'<{next_link(cursor)}>; rel="next"'} if cursor else None
+        return stream_documents(entries, headers=headers)
+    except PaginationError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@patient_bp.route('/<patient_id>/timeline', methods=['GET'])
+@token_required
+def get_timeline(current_user, patient_id):
+    """Get a page of a patient's chart, newest first: history entries, appointments and
+    medication/allergy changes (?limit=&after=).
+    """
+    try:
+        db = get_db()
+        try:
+            limit = int(request.args.get('limit', TIMELINE_DEFAULT_LIMIT))
+        except ValueError:
+            return jsonify({'message': 'limit must be an integer'}), 400
+        if limit < 1:
+            return jsonify({'message': 'limit must be positive'}), 400
+        after = decode_timeline_cursor(request.args['after']) if request.args.get('after') else None
+
+        patient = _find_own_patient(db, current_user, patient_id, {'doctor_id': 1, 'medical_history': 1})
+        if not patient:
+            return jsonify({'message': 'Patient not found or unauthorized'}), 404
+        if 'medical_history' in patient:
+            migrate_patient_history(db, patient)
+
+        items, cursor = timeline_page(db, patient['_id'], min(limit, MAX_PAGE_SIZE), after)
+        headers = {'Link': f'<{next_link(cursor)}>; rel="next"'} if cursor else None
+        # The sort key only matters to the cursor
+        return stream_documents(items, transform=lambda item: {k: v for k, v in item.items() if k != 'key'},
+                                headers=headers)
+    except PaginationError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@patient_bp.route('/<patient_id>/history', methods=['POST'])
+@token_required
+def add_history(current_user, patient_id):
+    """Add one medical history entry, or a list of them."""
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'message': 'No data provided'}), 400
+
+        db = get_db()
+        patient = _find_own_patient(db, current_user, patient_id, {'doctor_id': 1, 'medical_history': 1})
+        if not patient:
+            return jsonify({'message': 'Patient not found or unauthorized'}), 404
+        if 'medical_history' in patient:
+            migrate_patient_history(db, patient)
+
+        entries = _history_entries(data, datetime.utcnow())
+        add_entries(db, patient['_id'], patient.get('doctor_id'), entries)
+        return jsonify({'message': 'Medical history added successfully', 'added': len(entries)}), 201
+    except HistoryError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
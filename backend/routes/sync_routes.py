@@ -0,0 +1,42 @@
+from flask import Blueprint, current_app, request, jsonify
+from models.db import get_db
+from models.sync import SyncExpired, decode_sync_token, encode_sync_token, sync_page
+from utils.auth import token_required
+from utils.pagination import MAX_PAGE_SIZE, PaginationError
+from utils.projection import ProjectionError, parse_fields
+from utils.streaming import encode_document
+import os
+
+sync_bp = Blueprint('sync', __name__)
+
+# Changed documents returned per collection and request
+SYNC_PAGE_SIZE = int(os.getenv('SYNC_PAGE_SIZE', '500'))
+
+@sync_bp.route('', methods=['GET'])
+@token_required
+def sync(current_user):
+    """Patients and appointments changed or deleted since a sync token (?since=&limit=&fields=).
+
+    Without since every document in scope is returned. Keep calling with the
+    returned token while has_more is true; afterwards poll with the last one.
+    """
+    try:
+        since = request.args.get('since')
+        positions = decode_sync_token(since) if since else None
+        try:
+            limit = int(request.args.get('limit', SYNC_PAGE_SIZE))
+        except ValueError:
+            raise PaginationError('limit must be a number')
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            raise PaginationError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+        projection = parse_fields(request.args)
+
+        changes, positions, more = sync_page(get_db(), current_user, positions, limit, projection)
+        body = dict(changes, token=encode_sync_token(positions), has_more=more)
+        return current_app.response_class(encode_document(body), mimetype='application/json'), 200
+    except SyncExpired as e:
+        return jsonify({'message': str(e)}), 410
+    except (PaginationError, ProjectionError) as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -1,15 +1,20 @@
 from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
-import jwt
-from datetime import datetime, timedelta
+from datetime import datetime
 from bson import ObjectId
-from db import mongo
+from models.db import get_db, slow_operations
+from models.sessions import (
+    ACCESS_TOKEN_MINUTES, SessionError, revocation_cache, revoke_session, revoke_token, revoke_user_sessions, rotate
+)
+from utils.auth import (
+    generate_token, invalidate_user, issue_tokens, load_user, token_cache, token_required, user_cache
+)
+from utils.passwords import HashingBusy, hash_password, upgrade_hash, verify_password
+from utils.projection import USER_SUMMARY, ProjectionError, parse_fields
+from utils.slowlog import top_offenders
+from utils.streaming import stream_documents
 
 user_bp = Blueprint('user', __name__)
 
-# Secret key for JWT - in production, use environment variable
-SECRET_KEY = 'your-secret-key'
-
 @user_bp.route('/register', methods=['POST'])
 def register():
     try:
@@ -24,13 +29,13 @@ def register():
             return jsonify({'message': 'Invalid role. Must be either doctor or admin'}), 400
         
         # Check if username or email already exists
-        if mongo.db.users.find_one({'username': data['username']}):
+        if get_db().users.find_one({'username': data['username']}):
             return jsonify({'message': 'Username already exists'}), 400
-        if mongo.db.users.find_one({'email': data['email']}):
+        if get_db().users.find_one({'email': data['email']}):
             return jsonify({'message': 'Email already exists'}), 400
         
         # Hash password and create user
-        hashed_password = generate_password_hash(data['password'])
+        hashed_password = hash_password(data['password'])
         user = {
             'username': data['username'],
             'email': data['email'],
@@ -39,25 +44,22 @@ def register():
             'created_at': datetime.utcnow()
         }
         
-        result = mongo.db.users.insert_one(user)
+        result = get_db().users.insert_one(user)
         user_id = str(result.inserted_id)
         
-        # Generate token
-        token = jwt.encode({
-            'user_id': user_id,
-            'username': user['username'],
-            'role': user['role'],
-            'exp': datetime.utcnow() + timedelta(days=1)
-        }, SECRET_KEY)
+        # Access token plus refresh token
+        tokens = issue_tokens(get_db(), user)
         
         return jsonify({
             'message': 'User registered successfully',
-            'token': token,
+            **tokens,
             'username': user['username'],
             'role': user['role'],
             '_id': user_id
         }), 201
         
+    except HashingBusy as e:
+        return jsonify({'message': str(e)}), 503, {'Retry-After': str(e.retry_after)}
     except Exception as e:
         print(f"Registration error: {str(e)}")
         return jsonify({'message': 'An error occurred during registration'}), 500
@@ -70,69 +72,83 @@ def login():
         if not all(k in data for k in ['username', 'password']):
             return jsonify({'message': 'Missing username or password'}), 400
         
-        user = mongo.db.users.find_one({'username': data['username']})
+        user = get_db().users.find_one({'username': data['username']})
         if not user:
             return jsonify({'message': 'Invalid username or password'}), 401
             
-        if not check_password_hash(user['password'], data['password']):
+        if not verify_password(user['password'], data['password']):
             return jsonify({'message': 'Invalid username or password'}), 401
         
-        # Generate token
-        token = jwt.encode({
-            'user_id': str(user['_id']),
-            'username': user['username'],
-            'role': user['role'],
-            'exp': datetime.utcnow() + timedelta(days=1)
-        }, SECRET_KEY)
+        # Move the stored hash to the current PASSWORD_HASH_METHOD
+        upgrade_hash(get_db(), user, data['password'])
+        
+        # Access token plus refresh token
+        tokens = issue_tokens(get_db(), user)
         
         return jsonify({
-            'token': token,
+            **tokens,
             'username': user['username'],
             'role': user['role']
         }), 200
         
+    except HashingBusy as e:
+        return jsonify({'message': str(e)}), 503, {'Retry-After': str(e.retry_after)}
     except Exception as e:
         print(f"Login error: {str(e)}")
         return jsonify({'message': 'An error occurred during login'}), 500
 
-def token_required(f):
-    def decorated(*args, **kwargs):
-        token = None
-        auth_header = request.headers.get('Authorization')
+@user_bp.route('/refresh', methods=['POST'])
+def refresh():
+    """Exchange a refresh token for a new access token and refresh token, without the password."""
+    try:
+        data = request.get_json(silent=True) or {}
+        if not data.get('refresh_token'):
+            return jsonify({'message': 'Missing refresh token'}), 400
+        
+        db = get_db()
+        session_id, user_id, refresh_token = rotate(db, data['refresh_token'])
+        # Picks up role changes; deleted users can't refresh
+        user = load_user(db, user_id)
+        if not user:
+            revoke_session(db, session_id, user_id)
+            return jsonify({'message': 'Invalid or expired refresh token'}), 401
         
-        if auth_header:
-            try:
-                token = auth_header.split(" ")[1]
-            except IndexError:
-                return jsonify({'message': 'Invalid token format'}), 401
+        return jsonify({
+            'token': generate_token(user, session_id),
+            'refresh_token': refresh_token,
+            'expires_in': int(ACCESS_TOKEN_MINUTES * 60)
+        }), 200
         
-        if not token:
-            return jsonify({'message': 'Token is missing'}), 401
-            
-        try:
-            data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-            current_user = mongo.db.users.find_one({'_id': ObjectId(data['user_id'])})
-            if not current_user:
-                return jsonify({'message': 'Invalid token'}), 401
-        except jwt.ExpiredSignatureError:
-            return jsonify({'message': 'Token has expired'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'message': 'Invalid token'}), 401
-        except Exception as e:
-            return jsonify({'message': 'Token validation failed'}), 401
-            
-        return f(current_user, *args, **kwargs)
-    
-    decorated.__name__ = f.__name__
-    return decorated
+    except SessionError as e:
+        return jsonify({'message': str(e)}), 401
+    except Exception as e:
+        print(f"Refresh error: {str(e)}")
+        return jsonify({'message': 'An error occurred while refreshing the token'}), 500
+
+@user_bp.route('/logout', methods=['POST'])
+def logout():
+    """End the session of a refresh token; its access tokens are refused from now on."""
+    try:
+        data = request.get_json(silent=True) or {}
+        if not data.get('refresh_token'):
+            return jsonify({'message': 'Missing refresh token'}), 400
+        revoke_token(get_db(), data['refresh_token'])
+        return jsonify({'message': 'Logged out'}), 200
+    except Exception as e:
+        print(f"Logout error: {str(e)}")
+        return jsonify({'message': 'An error occurred during logout'}), 500
 
 @user_bp.route('/profile', methods=['GET'])
 @token_required
 def get_profile(current_user):
+    # In claims-only auth mode current_user only carries the token claims
+    user = load_user(get_db(), current_user['_id'])
+    if not user:
+        return jsonify({'message': 'User not found'}), 404
     return jsonify({
-        'username': current_user['username'],
-        'email': current_user['email'],
-        'role': current_user['role']
+        'username': user['username'],
+        'email': user['email'],
+        'role': user['role']
     }), 200
 
 @user_bp.route('/doctors', methods=['GET'])
@@ -143,14 +159,12 @@ def get_doctors(current_user):
         if current_user['role'] != 'admin':
             return jsonify({'message': 'Unauthorized access'}), 403
             
-        doctors = list(mongo.db.users.find({'role': 'doctor'}))
-        # Convert ObjectId to string for JSON serialization
-        for doctor in doctors:
-            doctor['_id'] = str(doctor['_id'])
-            # Remove password from response
-            doctor.pop('password', None)
-        
-        return jsonify(doctors), 200
+        # Stream the doctors; password hashes are never projected
+        projection = parse_fields(request.args, default=USER_SUMMARY)
+        doctors = get_db().users.find({'role': 'doctor'}, projection)
+        return stream_documents(doctors)
+    except ProjectionError as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         print(f"Error fetching doctors: {str(e)}")
         return jsonify({'message': 'An error occurred while fetching doctors'}), 500
@@ -163,14 +177,61 @@ def delete_doctor(current_user, doctor_id):
         if current_user['role'] != 'admin':
             return jsonify({'message': 'Unauthorized access'}), 403
             
-        result = mongo.db.users.delete_one({
+        result = get_db().users.delete_one({
             '_id': ObjectId(doctor_id),
             'role': 'doctor'
         })
         
         if result.deleted_count:
+            invalidate_user(doctor_id)
+            revoke_user_sessions(get_db(), doctor_id)
             return jsonify({'message': 'Doctor deleted successfully'}), 200
         return jsonify({'message': 'Doctor not found'}), 404
     except Exception as e:
         print(f"Error deleting doctor: {str(e)}")
-        return jsonify({'message': 'An error occurred while deleting doctor'}), 500 
\ No newline at end of file
+        return jsonify({'message': 'An error occurred while deleting doctor'}), 500
+
+@user_bp.route('/cache-stats', methods=['GET'])
+@token_required
+def get_cache_stats(current_user):
+    # Only admin can see cache statistics
+    if current_user['role'] != 'admin':
+        return jsonify({'message': 'Unauthorized access'}), 403
+    return jsonify({
+        'users': user_cache.stats(),
+        'tokens': token_cache.stats(),
+        'revocations': revocation_cache.stats()
+    }), 200
+
+@user_bp.route('/slow-operations', methods=['GET'])
+@token_required
+def get_slow_operations(current_user):
+    """List the slowest database operations by total time (?since=YYYY-MM-DD&limit=20)."""
+    # Only admin can see the slow operation log
+    if current_user['role'] != 'admin':
+        return jsonify({'message': 'Unauthorized access'}), 403
+    try:
+        since = request.args.get('since')
+        if since:
+            try:
+                since = datetime.strptime(since, '%Y-%m-%d')
+            except ValueError:
+                return jsonify({'message': 'since must be in YYYY-MM-DD format'}), 400
+        try:
+            limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        except ValueError:
+            return jsonify({'message': 'limit must be a number'}), 400
+
+        offenders = top_offenders(get_db(), since, limit)
+        for offender in offenders:
+            offender['shape_id'] = offender.pop('_id')
+            offender['total_ms'] = round(offender['total_ms'], 3)
+            offender['avg_ms'] = round(offender['avg_ms'], 3)
+        return jsonify({
+            'threshold_ms': slow_operations.threshold_ms,
+            'dropped': slow_operations.dropped,
+            'operations': offenders
+        }), 200
+    except Exception as e:
+        print(f"Error listing slow operations: {str(e)}")
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,57 @@
+import os
+import unittest
+from datetime import datetime
+
+# The app must not touch a real server while it is being imported
+os.environ.setdefault('RUN_MIGRATIONS', '0')
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+from models import db as database
+from models import patient
+
+
+@unittest.skipIf(mongomock is None, 'mongomock is not installed')
+class ApiTestCase(unittest.TestCase):
+    """Runs requests through the app against a fresh in-memory database.
+
+    Provides an admin and two doctors (self.admin, self.doctor, self.other)
+    and their access tokens, see headers().
+    """
+
+    def setUp(self):
+        from app import app
+        from routes.appointment_routes import busy_cache
+        from routes.dashboard_routes import summary_cache
+        from models.sessions import revocation_cache
+        from utils.auth import generate_token, token_cache, user_cache
+
+        database.set_client(mongomock.MongoClient())
+        # The stand-in can only return decoded documents
+        self.raw_reads = patient.RAW_BSON_READS
+        patient.RAW_BSON_READS = False
+        for cache in (busy_cache, summary_cache, revocation_cache, token_cache, user_cache):
+            cache.clear()
+
+        self.db = database.get_db()
+        self.client = app.test_client()
+        now = datetime.utcnow()
+        users = [
+            {'username': 'admin', 'email': 'admin@hospital.com', 'role': 'admin', 'created_at': now},
+            {'username': 'doctor', 'email': 'doctor@hospital.com', 'role': 'doctor', 'created_at': now},
+            {'username': 'other', 'email': 'other@hospital.com', 'role': 'doctor', 'created_at': now}
+        ]
+        self.db.users.insert_many(users)
+        self.admin, self.doctor, self.other = users
+        self.tokens = {user['username']: generate_token(user) for user in users}
+
+    def tearDown(self):
+        patient.RAW_BSON_READS = self.raw_reads
+
+    def headers(self, user=None, **extra):
+        headers = {'Authorization': f"Bearer {self.tokens[(user or self.doctor)['username']]}"}
+        headers.update(extra)
+        return headers
@@ -0,0 +1,125 @@
+import unittest
+from datetime import date
+
+from bson import ObjectId
+
+from routes.appointment_routes import busy_cache
+from support import ApiTestCase
+
+
+class AppointmentScheduleTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.patient_id = self.db.patients.insert_one({'name': 'Jane', 'email': 'jane@example.com'}).inserted_id
+
+    def book(self, day='2030-01-07', time='10:00', **fields):
+        body = dict({'patient_id': str(self.patient_id), 'doctor_id': str(self.doctor['_id']), 'date': day,
+                     'time': time, 'reason': 'checkup'}, **fields)
+        response = self.client.post('/api/appointments/', json=body, headers=self.headers())
+        return response.status_code, (response.get_json() or {}).get('_id')
+
+    def update(self, appointment_id, **fields):
+        return self.client.put(f'/api/appointments/{appointment_id}', json=fields, headers=self.headers()).status_code
+
+    def free_slots(self, day='2030-01-07'):
+        response = self.client.get(f'/api/appointments/availability?from={day}', headers=self.headers())
+        return [slot['start'] for slot in response.get_json()['days'][day]]
+
+    def test_cancelling_frees_the_slot_at_once(self):
+        _, appointment_id = self.book()
+        self.assertNotIn('10:00', self.free_slots())
+        self.assertEqual(self.update(appointment_id, status='cancelled'), 200)
+        self.assertIn('10:00', self.free_slots())
+
+    def test_reinstating_a_rebooked_slot_is_rejected(self):
+        _, appointment_id = self.book()
+        self.assertEqual(self.update(appointment_id, status='cancelled'), 200)
+        self.assertEqual(self.book()[0], 201)
+        self.assertEqual(self.update(appointment_id, status='scheduled'), 409)
+        self.assertEqual(self.update(appointment_id, notes='still cancelled'), 200)
+
+    def test_doctor_must_be_a_doctor(self):
+        body = {'patient_id': str(self.patient_id), 'doctor_id': str(self.admin['_id']), 'date': '2030-01-07',
+                'time': '10:00', 'reason': 'checkup'}
+        response = self.client.post('/api/appointments/', json=body, headers=self.headers(self.admin))
+        self.assertEqual((response.status_code, response.get_json()['message']), (400, 'Doctor not found'))
+        _, appointment_id = self.book()
+        response = self.client.put(f'/api/appointments/{appointment_id}', json={'doctor_id': str(self.admin['_id'])},
+                                   headers=self.headers(self.admin))
+        self.assertEqual(response.status_code, 400)
+
+    def test_patient_with_appointments_is_kept(self):
+        self.book()
+        response = self.client.delete(f'/api/patients/{self.patient_id}', headers=self.headers(self.admin))
+        self.assertEqual(response.status_code, 400)
+
+    def test_series_without_occurrences_is_rejected(self):
+        body = {'patient_id': str(self.patient_id), 'doctor_id': str(self.doctor['_id']), 'date': '2030-01-15',
+                'time': '10:00', 'reason': 'physio', 'recurrence': {'freq': 'daily', 'until': '2030-01-01'}}
+        response = self.client.post('/api/appointments/series', json=body, headers=self.headers())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.db.appointments.count_documents({}), 0)
+
+    def test_every_day_of_an_overnight_appointment_is_invalidated(self):
+        _, appointment_id = self.book(time='23:30', duration=60)
+        self.free_slots('2030-01-08')
+        key = (str(self.doctor['_id']), date(2030, 1, 8))
+        self.assertIsNotNone(busy_cache.get(key))
+        self.assertEqual(self.update(appointment_id, status='cancelled'), 200)
+        self.assertIsNone(busy_cache.get(key))
+
+
+class GetAppointmentTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        patient_id = self.db.patients.insert_one({'name': 'Jane', 'email': 'jane@example.com',
+                                                  'phone': '555'}).inserted_id
+        appointment_id = self.db.appointments.insert_one({
+            'patient_id': patient_id, 'doctor_id': self.doctor['_id'], 'date': '2030-01-07', 'time': '10:00',
+            'patient_summary': {'name': 'Jane', 'email': 'jane@example.com', 'phone': '555'}
+        }).inserted_id
+        self.path = f'/api/appointments/{appointment_id}?expand=patient'
+
+    def test_requires_a_token(self):
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 401)
+        self.assertNotIn('jane', response.get_data(as_text=True))
+
+    def test_doctors_only_see_their_own(self):
+        self.assertEqual(self.client.get(self.path, headers=self.headers(self.other)).status_code, 404)
+        for user in (self.doctor, self.admin):
+            response = self.client.get(self.path, headers=self.headers(user))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json()['patient']['email'], 'jane@example.com')
+
+
+class LegacyDoctorIdTestCase(ApiTestCase):
+    # Appointments written before doctor_id was stored as an ObjectId
+    def setUp(self):
+        super().setUp()
+        self.series_id = ObjectId()
+        self.appointment_id, _ = self.db.appointments.insert_many([
+            {'patient_id': ObjectId(), 'doctor_id': str(self.doctor['_id']), 'date': f'2030-01-{day:02d}',
+             'time': '10:00', 'reason': 'checkup', 'status': 'scheduled', 'series_id': self.series_id}
+            for day in (7, 14)
+        ]).inserted_ids
+
+    def test_doctor_can_change_their_own(self):
+        path = f'/api/appointments/{self.appointment_id}'
+        self.assertEqual(self.client.put(path, json={'notes': 'x'}, headers=self.headers(self.other)).status_code, 404)
+        self.assertEqual(self.client.put(path, json={'notes': 'x'}, headers=self.headers()).status_code, 200)
+        self.assertEqual(self.client.delete(path, headers=self.headers(self.other)).status_code, 404)
+        self.assertEqual(self.client.delete(path, headers=self.headers()).status_code, 200)
+
+    def test_doctor_can_change_their_own_series(self):
+        path = f'/api/appointments/series/{self.series_id}'
+        self.client.put(path, json={'reason': 'rehab'}, headers=self.headers(self.other))
+        self.assertEqual(self.db.appointments.count_documents({'reason': 'rehab'}), 0)
+        self.assertEqual(self.client.put(path, json={'reason': 'rehab'}, headers=self.headers()).status_code, 200)
+        self.assertEqual(self.db.appointments.count_documents({'reason': 'rehab'}), 2)
+        self.assertEqual(self.client.delete(path, headers=self.headers()).status_code, 200)
+        self.assertEqual(self.db.appointments.count_documents({'series_id': self.series_id, 'status': 'cancelled'}), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
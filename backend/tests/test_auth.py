@@ -0,0 +1,100 @@
+import hashlib
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+import jwt
+from flask import Flask, jsonify
+
+from support import ApiTestCase
+from utils import auth
+from utils.auth import SECRET_KEY, admin_required, decode_token, doctor_required
+from utils.cache import TTLCache
+
+
+def make_token(user, **claims):
+    payload = dict({'user_id': str(user['_id']), 'username': user['username'], 'role': user['role'],
+                    'exp': datetime.utcnow() + timedelta(minutes=5)}, **claims)
+    return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
+
+
+class TokenMemoTestCase(unittest.TestCase):
+    def test_memo_ends_with_the_token(self):
+        now = [1000.0]
+        cache = TTLCache(ttl=300, timer=lambda: now[0])
+        token = jwt.encode({'user_id': 'x', 'exp': int(time.time()) + 10}, SECRET_KEY, algorithm='HS256')
+        digest = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        with mock.patch.object(auth, 'token_cache', cache):
+            self.assertEqual(decode_token(token)['user_id'], 'x')
+            now[0] += 5
+            self.assertEqual(cache.get(digest)['user_id'], 'x')
+            # Kept until the token's exp, not for the cache's 300 seconds
+            now[0] += 6
+            self.assertIsNone(cache.get(digest))
+
+    def test_expired_tokens_are_not_memoized(self):
+        cache = TTLCache(ttl=300)
+        token = jwt.encode({'user_id': 'x', 'exp': int(time.time()) - 1}, SECRET_KEY, algorithm='HS256')
+        with mock.patch.object(auth, 'token_cache', cache):
+            with self.assertRaises(jwt.ExpiredSignatureError):
+                decode_token(token)
+        self.assertEqual(len(cache), 0)
+
+
+class AuthenticationTestCase(ApiTestCase):
+    def get(self, headers=None):
+        return self.client.get('/api/user/profile', headers=headers or {})
+
+    def assert_refused(self, response, message, status=401):
+        self.assertEqual(response.status_code, status)
+        self.assertEqual(response.get_json(), {'message': message})
+
+    def test_missing_token(self):
+        self.assert_refused(self.get(), 'Token is missing')
+
+    def test_malformed_header(self):
+        self.assert_refused(self.get({'Authorization': 'Bearer a b'}), 'Invalid token format')
+        self.assert_refused(self.get({'Authorization': 'Bearer not-a-jwt'}), 'Invalid token')
+        forged = jwt.encode({'user_id': str(self.doctor['_id'])}, 'another-secret', algorithm='HS256')
+        self.assert_refused(self.get({'Authorization': f'Bearer {forged}'}), 'Invalid token')
+
+    def test_expired_token(self):
+        token = make_token(self.doctor, exp=datetime.utcnow() - timedelta(seconds=1))
+        self.assert_refused(self.get({'Authorization': f'Bearer {token}'}), 'Token has expired')
+
+    def test_bare_token_and_deleted_user(self):
+        self.assertEqual(self.get({'Authorization': self.tokens['doctor']}).status_code, 200)
+        self.db.users.delete_one({'_id': self.doctor['_id']})
+        auth.invalidate_user(self.doctor['_id'])
+        self.assert_refused(self.get(self.headers()), 'Invalid token')
+
+    def test_role_decorators(self):
+        app = Flask(__name__)
+
+        @app.route('/admin')
+        @admin_required
+        def admin_only(current_user):
+            return jsonify({'user': current_user['username']})
+
+        @app.route('/doctor')
+        @doctor_required
+        def doctor_only(current_user):
+            return jsonify({'user': current_user['username']})
+
+        client = app.test_client()
+        self.assert_refused(client.get('/admin', headers=self.headers()), 'Admin privileges required', 403)
+        self.assert_refused(client.get('/doctor', headers=self.headers(self.admin)), 'Doctor privileges required', 403)
+        self.assertEqual(client.get('/admin', headers=self.headers(self.admin)).get_json(), {'user': 'admin'})
+        self.assertEqual(client.get('/doctor', headers=self.headers()).get_json(), {'user': 'doctor'})
+        self.assert_refused(client.get('/admin'), 'Token is missing')
+
+    def test_claims_only_mode_skips_the_users_lookup(self):
+        with mock.patch.object(auth, 'AUTH_CLAIMS_ONLY', True), mock.patch.object(auth, 'load_user') as load_user:
+            response = self.client.get('/api/patients/', headers=self.headers())
+            self.assertEqual(response.status_code, 200)
+            load_user.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+
+from routes.batch_routes import BatchError, group_sub_requests, parse_sub_request
+from support import ApiTestCase
+from utils.auth import PRINCIPAL_ENVIRON_KEY
+
+
+class BatchTestCase(unittest.TestCase):
+    def test_parse_sub_request(self):
+        method, path, headers, body = parse_sub_request(
+            {'method': 'post', 'path': '/api/patients', 'headers': {'Accept': 'application/json',
+                                                                   'Authorization': 'Bearer x'},
+             'body': {'name': 'Jane'}}, '/api/batch')
+        self.assertEqual((method, path, body), ('POST', '/api/patients', {'name': 'Jane'}))
+        self.assertEqual(headers, {'Accept': 'application/json'})
+        self.assertEqual(parse_sub_request({'path': '/api/patients?limit=5'}, '/api/batch')[0], 'GET')
+
+    def test_invalid_sub_requests(self):
+        for item in ({'path': '/api/batch'}, {'path': '/api/batch/?x=1'}, {'path': 'http://example.com/'},
+                     {'method': 'PATCH', 'path': '/api/patients'}, {'method': 'GET'}, 'GET /api/patients'):
+            with self.assertRaises(BatchError):
+                parse_sub_request(item, '/api/batch')
+
+    def test_reads_run_together_and_writes_alone(self):
+        methods = ['GET', 'GET', 'POST', 'PUT', 'GET', 'HEAD', 'DELETE', 'GET']
+        self.assertEqual(group_sub_requests(methods), [[0, 1], [2], [3], [4, 5], [6], [7]])
+
+
+class BatchRouteTestCase(ApiTestCase):
+    def batch(self, *requests, user=None, **kwargs):
+        response = self.client.post('/api/batch', json={'requests': list(requests)}, headers=self.headers(user),
+                                    **kwargs)
+        return response.status_code, response.get_json()
+
+    def add_patient(self, n):
+        body = {'name': f'P{n}', 'email': f'p{n}@example.com', 'phone': '555', 'address': 'x',
+                'date_of_birth': '1990-01-01'}
+        return {'method': 'POST', 'path': '/api/patients/', 'body': body}
+
+    def test_sub_requests_run_as_the_caller(self):
+        status, body = self.batch({'path': '/api/user/profile'}, {'path': '/api/user/doctors'}, user=self.other)
+        self.assertEqual(status, 200)
+        profile, doctors = body['responses']
+        self.assertEqual((profile['status'], profile['body']['username']), (200, 'other'))
+        # Doctors may not list doctors, as on a request of their own
+        self.assertEqual(doctors['status'], 403)
+        status, body = self.batch({'path': '/api/user/doctors'}, user=self.admin)
+        self.assertEqual(body['responses'][0]['status'], 200)
+
+    def test_sub_requests_are_scoped_to_the_doctor(self):
+        for user, n in ((self.doctor, 1), (self.other, 2)):
+            self.assertEqual(self.batch(self.add_patient(n), user=user)[1]['responses'][0]['status'], 201)
+        for user, names in ((self.doctor, ['P1']), (self.other, ['P2']), (self.admin, ['P1', 'P2'])):
+            status, body = self.batch({'path': '/api/patients/?fields=name'}, user=user)
+            self.assertEqual(sorted(patient['name'] for patient in body['responses'][0]['body']), names)
+
+    def test_writes_are_seen_by_later_reads(self):
+        status, body = self.batch(
+            {'path': '/api/patients/?fields=name'},
+            self.add_patient(1),
+            {'path': '/api/patients/?fields=name'},
+            {'path': '/api/patients/?fields=email'},
+            self.add_patient(2),
+            {'path': '/api/patients/?fields=name'}
+        )
+        self.assertEqual(status, 200)
+        names = [[patient.get('name') for patient in response['body']] for response in body['responses']
+                 if response['status'] == 200]
+        self.assertEqual(names, [[], ['P1'], [None], ['P1', 'P2']])
+        self.assertEqual([response['status'] for response in body['responses']], [200, 201, 200, 200, 201, 200])
+
+    def test_batches_cannot_be_nested(self):
+        for path in ('/api/batch', '/api/%62atch', '/api/b%61tch/'):
+            nested = {'method': 'POST', 'path': path, 'body': {'requests': [{'path': '/api/patients/'}]}}
+            self.assertEqual(self.batch(nested)[0], 400, path)
+        status, body = self.batch({'path': '/api/patients/'}, environ_base={PRINCIPAL_ENVIRON_KEY: dict(self.doctor)})
+        self.assertEqual((status, body['message']), (400, 'Batches cannot be nested'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import threading
+import unittest
+
+from utils.cache import TTLCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TTLCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.cache = TTLCache(maxsize=2, ttl=10, timer=self.timer)
+
+    def test_get_and_set(self):
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+
+    def test_entries_expire(self):
+        self.cache.set('a', 1)
+        self.timer.now = 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_per_entry_ttl(self):
+        self.cache.set('a', 1, ttl=30)
+        self.timer.now = 20
+        self.assertEqual(self.cache.get('a'), 1)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_invalidate(self):
+        self.cache.set('a', 1)
+        self.assertTrue(self.cache.invalidate('a'))
+        self.assertFalse(self.cache.invalidate('a'))
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_stats(self):
+        self.cache.set('a', 1)
+        self.cache.get('a')
+        self.cache.get('b')
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_concurrent_access(self):
+        cache = TTLCache(maxsize=50, ttl=60)
+
+        def worker(offset):
+            for i in range(1000):
+                cache.set((offset + i) % 100, i)
+                cache.get(i % 100)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(len(cache), 50)
+        self.assertEqual(cache.hits + cache.misses, 8000)
+
+
+if __name__ == '__main__':
+    unittest.main()
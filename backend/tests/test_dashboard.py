@@ -0,0 +1,83 @@
+import unittest
+from unittest import mock
+
+from bson import ObjectId
+
+from routes.dashboard_routes import summary_pipeline
+from support import ApiTestCase, mongomock
+
+
+class SummaryPipelineTestCase(unittest.TestCase):
+    def test_shape(self):
+        doctor_id = str(ObjectId())
+        appointment_query = {'doctor_id': {'$in': [ObjectId(doctor_id), doctor_id]}}
+        pipeline = summary_pipeline({'doctor_id': doctor_id}, appointment_query, '2030-01-07', '2030-01-14')
+        self.assertEqual(pipeline[0], {'$match': {'doctor_id': doctor_id}})
+        union = pipeline[2]['$unionWith']
+        self.assertEqual(union['coll'], 'appointments')
+        self.assertEqual(union['pipeline'][0], {'$match': appointment_query})
+        facets = pipeline[-1]['$facet']
+        self.assertEqual(set(facets), {'total_patients', 'total_appointments', 'today_appointments', 'upcoming',
+                                       'by_status', 'by_doctor'})
+        self.assertEqual(facets['upcoming'][0]['$match']['date'], {'$gte': '2030-01-07', '$lt': '2030-01-14'})
+
+
+class SummaryRouteTestCase(ApiTestCase):
+    """mongomock has no $unionWith: the aggregation is replaced and its pipelines recorded."""
+
+    def setUp(self):
+        super().setUp()
+        self.pipelines = []
+        result = {'total_patients': [{'count': 2}], 'total_appointments': [{'count': 3}],
+                  'today_appointments': [], 'upcoming': [{'_id': '2030-01-08', 'count': 1}],
+                  'by_status': [{'_id': 'scheduled', 'count': 3}],
+                  'by_doctor': [{'_id': 'd1', 'patients': 2, 'appointments': 3, 'today_appointments': 0}]}
+
+        def aggregate(collection, pipeline, *args, **kwargs):
+            self.pipelines.append(pipeline)
+            return iter([result])
+
+        patcher = mock.patch.object(mongomock.collection.Collection, 'aggregate', aggregate)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def summary(self, user, day='2030-01-07'):
+        response = self.client.get(f'/api/dashboard/summary?date={day}', headers=self.headers(user))
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_doctor_scope(self):
+        summary = self.summary(self.doctor)
+        doctor_id = str(self.doctor['_id'])
+        self.assertEqual(self.pipelines[0][0], {'$match': {'doctor_id': doctor_id}})
+        self.assertEqual(self.pipelines[0][2]['$unionWith']['pipeline'][0],
+                         {'$match': {'doctor_id': {'$in': [self.doctor['_id'], doctor_id]}}})
+        self.assertEqual(summary['total_appointments'], 3)
+        self.assertEqual(summary['upcoming_appointments'], {'2030-01-08': 1})
+        self.assertNotIn('by_doctor', summary)
+
+    def test_admin_scope(self):
+        summary = self.summary(self.admin)
+        self.assertEqual(self.pipelines[0][0], {'$match': {}})
+        self.assertEqual(summary['by_doctor'][0]['doctor_id'], 'd1')
+
+    def test_cached_per_scope_and_day(self):
+        self.summary(self.doctor)
+        self.summary(self.doctor)
+        self.assertEqual(len(self.pipelines), 1)
+        self.summary(self.other)
+        self.summary(self.admin)
+        self.summary(self.doctor, '2030-01-08')
+        self.assertEqual(len(self.pipelines), 4)
+        # Another doctor's entry doesn't answer for this one
+        self.assertEqual(self.pipelines[1][0], {'$match': {'doctor_id': str(self.other['_id'])}})
+        self.summary(self.other)
+        self.assertEqual(len(self.pipelines), 4)
+
+    def test_invalid_date(self):
+        response = self.client.get('/api/dashboard/summary?date=tomorrow', headers=self.headers())
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+from datetime import datetime
+
+from bson import ObjectId
+
+from models import history
+from models.history import build_buckets, decode_position, encode_position, history_page, parse_entry_date
+from utils.pagination import PaginationError
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class BucketTestCase(unittest.TestCase):
+    def test_build_buckets_splits_entries(self):
+        patient_id = ObjectId()
+        entries = [{'condition': str(i), 'date': datetime(2024, 1, i + 1)} for i in range(5)]
+        buckets = build_buckets(patient_id, 'doctor', entries, first_seq=-2, size=2)
+        self.assertEqual([bucket['seq'] for bucket in buckets], [-2, -1, 0])
+        self.assertEqual([bucket['count'] for bucket in buckets], [2, 2, 1])
+        self.assertEqual([bucket['dated'] for bucket in build_buckets(patient_id, 'doctor', entries + [{}], size=3)],
+                         [3, 2])
+        self.assertEqual(buckets[1]['first_date'], datetime(2024, 1, 3))
+        self.assertEqual(buckets[1]['last_date'], datetime(2024, 1, 4))
+
+    def test_entry_dates_are_stored_as_utc(self):
+        self.assertEqual(parse_entry_date('2024-01-01T10:00:00+05:00'), datetime(2024, 1, 1, 5))
+        self.assertEqual(parse_entry_date('2024-01-01T10:00:00Z'), datetime(2024, 1, 1, 10))
+        self.assertEqual(parse_entry_date('2024-01-01'), datetime(2024, 1, 1))
+        with self.assertRaises(ValueError):
+            parse_entry_date('yesterday')
+
+    def test_position_round_trip(self):
+        self.assertEqual(decode_position(encode_position(-3, 7)), (-3, 7))
+        with self.assertRaises(PaginationError):
+            decode_position('not-a-cursor')
+
+
+@unittest.skipIf(mongomock is None, 'mongomock is not installed')
+class HistoryStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = mongomock.MongoClient().db
+        self.db[history.HISTORY_COLLECTION].create_index([('patient_id', 1), ('seq', 1)], unique=True)
+        self.patient_id = ObjectId()
+        self.size = history.HISTORY_BUCKET_SIZE
+        history.HISTORY_BUCKET_SIZE = 3
+
+    def tearDown(self):
+        history.HISTORY_BUCKET_SIZE = self.size
+
+    def test_add_entries_fills_buckets_in_order(self):
+        for i in range(4):
+            history.add_entries(self.db, self.patient_id, 'doctor', [{'n': i}])
+        history.add_entries(self.db, self.patient_id, 'doctor', [{'n': 4}, {'n': 5}, {'n': 6}])
+        buckets = list(self.db[history.HISTORY_COLLECTION].find().sort('seq', 1))
+        self.assertEqual([bucket['count'] for bucket in buckets], [3, 3, 1])
+        self.assertEqual([entry['n'] for bucket in buckets for entry in bucket['entries']], list(range(7)))
+
+    def test_pages_go_newest_first(self):
+        history.add_entries(self.db, self.patient_id, 'doctor', [{'n': i} for i in range(7)])
+        entries, cursor = history_page(self.db, self.patient_id, 4)
+        self.assertEqual([entry['n'] for entry in entries], [6, 5, 4, 3])
+        entries, cursor = history_page(self.db, self.patient_id, 4, decode_position(cursor))
+        self.assertEqual([entry['n'] for entry in entries], [2, 1, 0])
+        self.assertIsNone(cursor)
+
+    def test_migrated_history_sorts_before_new_entries(self):
+        self.db.patients.insert_one({'_id': self.patient_id, 'medical_history': [{'n': 0}, {'n': 1}]})
+        history.add_entries(self.db, self.patient_id, 'doctor', [{'n': 2}])
+        self.assertEqual(history.migrate_legacy_history(self.db), 1)
+        entries, _ = history_page(self.db, self.patient_id, 10)
+        self.assertEqual([entry['n'] for entry in entries], [2, 1, 0])
+        self.assertNotIn('medical_history', self.db.patients.find_one())
+
+    def test_string_dates_are_parsed(self):
+        self.db.patients.insert_one({'_id': self.patient_id, 'medical_history': [{'date': '2024-01-02T00:00:00Z'}]})
+        history.migrate_legacy_history(self.db)
+        bucket = self.db[history.HISTORY_COLLECTION].find_one()
+        self.assertEqual(bucket['entries'][0]['date'], datetime(2024, 1, 2))
+        self.assertEqual(bucket['last_date'], datetime(2024, 1, 2))
+
+        self.db[history.HISTORY_COLLECTION].insert_many([
+            {'patient_id': self.patient_id, 'seq': 0, 'count': 3, 'first_date': datetime(2024, 2, 1),
+             'last_date': datetime(2024, 2, 1), 'entries': [
+                 {'date': '2024-03-01T12:00:00+02:00'}, {'date': datetime(2024, 2, 1)}, {'date': 'someday'}]},
+            {'patient_id': self.patient_id, 'seq': 1, 'count': 1, 'entries': [{'date': 'never'}]}
+        ])
+        self.assertEqual(history.parse_history_dates(self.db), 1)
+        bucket = self.db[history.HISTORY_COLLECTION].find_one({'seq': 0})
+        self.assertEqual([entry['date'] for entry in bucket['entries']],
+                         [datetime(2024, 3, 1, 10), datetime(2024, 2, 1), 'someday'])
+        self.assertEqual((bucket['first_date'], bucket['last_date']), (datetime(2024, 2, 1), datetime(2024, 3, 1, 10)))
+        self.assertEqual(bucket['dated'], 2)
+        self.assertEqual(history.parse_history_dates(self.db), 0)
+
+    def test_dated_entries_are_counted(self):
+        history.add_entries(self.db, self.patient_id, 'doctor', [{'n': 0, 'date': datetime(2024, 1, 1)}, {'n': 1}])
+        history.add_entries(self.db, self.patient_id, 'doctor', [{'n': 2, 'date': datetime(2024, 1, 2)}, {'n': 3}])
+        buckets = list(self.db[history.HISTORY_COLLECTION].find().sort('seq', 1))
+        self.assertEqual([(bucket['count'], bucket['dated']) for bucket in buckets], [(3, 2), (1, 0)])
+
+        self.db[history.HISTORY_COLLECTION].update_many({}, {'$unset': {'dated': ''}})
+        self.assertEqual(history.count_dated_entries(self.db), 2)
+        buckets = list(self.db[history.HISTORY_COLLECTION].find().sort('seq', 1))
+        self.assertEqual([bucket['dated'] for bucket in buckets], [2, 0])
+        self.assertEqual(history.count_dated_entries(self.db), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import json
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from models.events import EVENTS_COLLECTION
+from models.history import HISTORY_COLLECTION
+from routes import patient_routes
+from routes.patient_routes import _import_batch, _import_progress
+from support import ApiTestCase, mongomock
+
+
+def row(n, **fields):
+    return dict({'name': f'Patient {n}', 'email': f'p{n}@example.com', 'phone': f'555{n:04d}',
+                 'address': f'{n} Main Street', 'date_of_birth': '1990-01-01'}, **fields)
+
+
+@unittest.skipIf(mongomock is None, 'mongomock is not installed')
+class ImportBatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = mongomock.MongoClient().db
+        self.db.patients.create_index('email', unique=True)
+        self.doctor = {'_id': 'doctor-1', 'role': 'doctor'}
+        self.now = datetime(2024, 1, 1)
+
+    def test_invalid_rows_are_reported(self):
+        batch = [(1, row(1)), (2, 'Invalid JSON'), (3, row(3, phone='')), (4, row(4, medical_history=['x'])),
+                 (5, row(1))]
+        inserted, errors = _import_batch(self.db, batch, self.doctor, self.now)
+        self.assertEqual(inserted, 1)
+        self.assertEqual(sorted(errors), [
+            (2, 'Invalid JSON'),
+            (3, 'Missing required field: phone'),
+            (4, 'medical_history entries must be objects'),
+            (5, 'Duplicate email in import')
+        ])
+        self.assertEqual(self.db.patients.find_one()['doctor_id'], 'doctor-1')
+
+    def test_existing_emails_are_rejected(self):
+        self.db.patients.insert_one(row(1))
+        inserted, errors = _import_batch(self.db, [(1, row(1)), (2, row(2))], self.doctor, self.now)
+        self.assertEqual(inserted, 1)
+        self.assertEqual(errors, [(1, 'Patient with this email already exists')])
+
+    def test_duplicate_key_race(self):
+        # Another request inserts the same email between the check and the insert
+        find = mongomock.collection.Collection.find
+
+        def find_then_insert(collection, *args, **kwargs):
+            found = list(find(collection, *args, **kwargs))
+            if collection.name == 'patients':
+                collection.insert_one(row(2))
+            return found
+
+        batch = [(n, row(n, medical_history=[{'condition': 'flu'}], allergies=['latex'])) for n in (1, 2, 3)]
+        with mock.patch.object(mongomock.collection.Collection, 'find', find_then_insert):
+            inserted, errors = _import_batch(self.db, batch, self.doctor, self.now)
+        self.assertEqual(inserted, 2)
+        self.assertEqual(errors, [(2, 'Patient with this email already exists')])
+        # History and change events only for the rows that went in
+        self.assertEqual(self.db[HISTORY_COLLECTION].count_documents({}), 2)
+        imported = {doc['_id'] for doc in self.db.patients.find({'email': {'$in': ['p1@example.com', 'p3@example.com']}})}
+        self.assertEqual(set(self.db[EVENTS_COLLECTION].distinct('patient_id')), imported)
+
+    def test_batch_boundaries(self):
+        rows = [(n, row(n)) for n in range(1, 6)] + [(6, row(1))]
+        with mock.patch.object(patient_routes, 'IMPORT_BATCH_SIZE', 2):
+            progress = list(_import_progress(self.db, iter(rows), self.doctor))
+        self.assertEqual([counts for counts, _ in progress], [
+            {'processed': 2, 'inserted': 2, 'failed': 0},
+            {'processed': 4, 'inserted': 4, 'failed': 0},
+            {'processed': 6, 'inserted': 5, 'failed': 1}
+        ])
+        # A duplicate of a row from an earlier batch is caught by the database check
+        self.assertEqual(progress[-1][1], [(6, 'Patient with this email already exists')])
+        self.assertEqual(self.db.patients.count_documents({}), 5)
+
+
+class ImportRouteTestCase(ApiTestCase):
+    def post(self, body, content_type='application/x-ndjson', **headers):
+        return self.client.post('/api/patients/import', data=body,
+                                headers=self.headers(**dict(headers, **{'Content-Type': content_type})))
+
+    def test_summary(self):
+        body = '\n'.join([json.dumps(row(1)), 'not json', json.dumps(row(2)), ''])
+        response = self.post(body)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json(), {
+            'processed': 3, 'inserted': 2, 'failed': 1, 'errors': [{'row': 2, 'error': 'Invalid JSON'}],
+            'errors_truncated': False
+        })
+
+    def test_csv(self):
+        body = 'name,email,phone,address,date_of_birth\nJane,jane@example.com,555,1 Road,1990-01-01\nJoe,,,,\n'
+        response = self.post(body, 'text/csv')
+        self.assertEqual(response.get_json()['inserted'], 1)
+        self.assertEqual(response.get_json()['errors'][0]['row'], 2)
+
+    def test_ndjson_progress_stream(self):
+        body = '\n'.join(json.dumps(row(n)) for n in range(1, 6)) + '\n' + json.dumps(row(1))
+        with mock.patch.object(patient_routes, 'IMPORT_BATCH_SIZE', 4):
+            response = self.post(body, Accept='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.mimetype.startswith('application/x-ndjson'))
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines() if line.strip()]
+        self.assertEqual(lines, [
+            {'processed': 4, 'inserted': 4, 'failed': 0, 'errors': []},
+            {'processed': 6, 'inserted': 5, 'failed': 1,
+             'errors': [{'row': 6, 'error': 'Patient with this email already exists'}]}
+        ])
+
+    def test_invalid_utf8(self):
+        body = json.dumps(row(1)).encode() + b'\n{"name": "\xff\xfe"}\n' + json.dumps(row(3)).encode()
+        response = self.post(body)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json()['inserted'], 2)
+        self.assertEqual(response.get_json()['errors'], [{'row': 2, 'error': 'Invalid UTF-8'}])
+
+        body = b'name,email,phone,address,date_of_birth\nJ\xe9r\xf4me,j@example.com,1,x,1990-01-01\n'
+        self.assertEqual(self.post(body, 'text/csv').get_json()['errors'], [{'row': 1, 'error': 'Invalid UTF-8'}])
+
+    def test_unsupported_content_type(self):
+        self.assertEqual(self.post('{}', 'application/json').status_code, 415)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+from datetime import date, datetime, timedelta
+
+from utils.intervals import IntervalSet, days_covered, parse_slot, split_by_day
+
+
+def at(hour, minute=0, day=1):
+    return datetime(2024, 1, day, hour, minute)
+
+
+class IntervalSetTestCase(unittest.TestCase):
+    def test_overlapping_intervals_are_merged(self):
+        busy = IntervalSet([(at(10), at(11)), (at(9), at(10)), (at(10, 30), at(12))])
+        self.assertEqual(list(busy), [(at(9), at(12))])
+
+    def test_overlaps(self):
+        busy = IntervalSet([(at(9), at(10)), (at(13), at(14))])
+        self.assertTrue(busy.overlaps(at(9, 30), at(9, 45)))
+        self.assertTrue(busy.overlaps(at(12), at(13, 1)))
+        self.assertFalse(busy.overlaps(at(10), at(13)))
+        self.assertFalse(busy.overlaps(at(8), at(9)))
+
+    def test_add(self):
+        busy = IntervalSet([(at(9), at(10))])
+        busy.add(at(11), at(12))
+        busy.add(at(10), at(11))
+        self.assertEqual(list(busy), [(at(9), at(12))])
+
+    def test_free_slots(self):
+        busy = IntervalSet([(at(9, 15), at(9, 45)), (at(10, 30), at(11))])
+        slots = busy.free_slots(at(9), at(11, 30), timedelta(minutes=30))
+        self.assertEqual(slots, [(at(10), at(10, 30)), (at(11), at(11, 30))])
+
+    def test_free_slots_when_empty(self):
+        slots = IntervalSet().free_slots(at(9), at(10), timedelta(minutes=30))
+        self.assertEqual(slots, [(at(9), at(9, 30)), (at(9, 30), at(10))])
+
+    def test_split_by_day(self):
+        days = split_by_day([(at(23, day=1), at(1, day=2)), (at(9, day=3), at(10, day=3))], date(2024, 1, 1), date(2024, 1, 2))
+        self.assertEqual(sorted(days), [date(2024, 1, 1), date(2024, 1, 2)])
+        self.assertTrue(days[date(2024, 1, 2)].overlaps(at(0, 30, day=2), at(0, 45, day=2)))
+
+    def test_days_covered(self):
+        self.assertEqual(list(days_covered(at(9), at(10))), [date(2024, 1, 1)])
+        self.assertEqual(list(days_covered(at(23, 30), at(0, 30, day=2))), [date(2024, 1, 1), date(2024, 1, 2)])
+
+    def test_parse_slot(self):
+        self.assertEqual(parse_slot('2024-01-01', '09:30'), at(9, 30))
+        self.assertEqual(parse_slot('2024-01-01', '09:30:00'), at(9, 30))
+        with self.assertRaises(ValueError):
+            parse_slot('2024-01-01', 'noon')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+from models.loader import Loader
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class CountingDatabase:
+    """Wraps a database and records the collection of every find()."""
+
+    def __init__(self, db):
+        self.db = db
+        self.finds = []
+
+    def __getitem__(self, name):
+        collection = self.db[name]
+        finds = self.finds
+
+        class Collection:
+            def find(self, *args, **kwargs):
+                finds.append(name)
+                return collection.find(*args, **kwargs)
+
+        return Collection()
+
+
+@unittest.skipIf(mongomock is None, 'mongomock is not installed')
+class LoaderTestCase(unittest.TestCase):
+    def setUp(self):
+        db = mongomock.MongoClient().db
+        self.patients = db.patients.insert_many([{'name': f'p{i}'} for i in range(5)]).inserted_ids
+        self.user = db.users.insert_one({'username': 'drwho'}).inserted_id
+        db.appointments.insert_many([{'patient_id': self.patients[0]}, {'patient_id': self.patients[0]}])
+        self.db = CountingDatabase(db)
+        self.loader = Loader(self.db)
+
+    def test_one_query_per_collection(self):
+        deferred = [self.loader.load('patients', patient_id) for patient_id in self.patients]
+        doctor = self.loader.load('users', self.user, fields=('username',))
+        self.assertEqual(self.db.finds, [])
+        self.assertEqual([d.get()['name'] for d in deferred], ['p0', 'p1', 'p2', 'p3', 'p4'])
+        self.assertEqual(doctor.get(), {'_id': self.user, 'username': 'drwho'})
+        self.assertEqual(sorted(self.db.finds), ['patients', 'users'])
+
+    def test_results_and_misses_are_memoized(self):
+        missing = mongomock.ObjectId()
+        found = self.loader.load_many('patients', [self.patients[0], missing])
+        self.assertIsNone(found[missing])
+        self.assertEqual(self.loader.load('patients', missing).get(), None)
+        self.assertEqual(self.loader.load('patients', self.patients[0]).get()['name'], 'p0')
+        self.assertEqual(self.db.finds, ['patients'])
+        self.loader.clear('patients', self.patients[0])
+        self.loader.load('patients', self.patients[0]).get()
+        self.assertEqual(self.db.finds, ['patients', 'patients'])
+
+    def test_non_unique_field(self):
+        ref = self.loader.load('appointments', self.patients[0], field='patient_id', fields=('_id',))
+        none = self.loader.load('appointments', self.patients[1], field='patient_id', fields=('_id',))
+        self.assertEqual(ref.get()['patient_id'], self.patients[0])
+        self.assertIsNone(none.get())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+from types import SimpleNamespace
+
+from utils.metrics import MONGO_DOCUMENTS, MONGO_FAILURES, MONGO_LATENCY, Counter, Histogram, MongoCommandListener
+
+
+def command_event(command_name, command=None, reply=None, request_id=1, duration_micros=1500):
+    return SimpleNamespace(command_name=command_name, command=command or {}, reply=reply or {},
+                           request_id=request_id, connection_id=('localhost', 27017),
+                           duration_micros=duration_micros)
+
+
+class MetricsTestCase(unittest.TestCase):
+    def test_counter_renders_labels(self):
+        counter = Counter('requests_total', 'Requests.', ('route',))
+        counter.inc(('/a',))
+        counter.inc(('/a',), 2)
+        counter.inc(('/b"',))
+        lines = counter.render()
+        self.assertIn('# TYPE requests_total counter', lines)
+        self.assertIn('requests_total{route="/a"} 3', lines)
+        self.assertIn('requests_total{route="/b\\""} 1', lines)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        lines = histogram.render()
+        self.assertIn('latency_seconds_bucket{le="0.1"} 2', lines)
+        self.assertIn('latency_seconds_bucket{le="1"} 3', lines)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn('latency_seconds_sum 2.65', lines)
+        self.assertIn('latency_seconds_count 4', lines)
+
+    def test_listener_times_commands_per_collection(self):
+        listener = MongoCommandListener()
+        labels = ('patients', 'find')
+        before = MONGO_LATENCY.count(labels)
+        listener.started(command_event('find', {'find': 'patients', 'filter': {}}))
+        listener.succeeded(command_event('find', reply={'cursor': {'firstBatch': [{}, {}]}}))
+        self.assertEqual(MONGO_LATENCY.count(labels), before + 1)
+        self.assertGreaterEqual(MONGO_DOCUMENTS.value(labels), 2)
+
+    def test_listener_reads_collection_of_get_more(self):
+        listener = MongoCommandListener()
+        labels = ('appointments', 'getMore')
+        before = MONGO_DOCUMENTS.value(labels)
+        listener.started(command_event('getMore', {'getMore': 123, 'collection': 'appointments'}, request_id=2))
+        listener.succeeded(command_event('getMore', reply={'cursor': {'nextBatch': [{}]}}, request_id=2))
+        self.assertEqual(MONGO_DOCUMENTS.value(labels), before + 1)
+
+    def test_listener_counts_failures(self):
+        listener = MongoCommandListener()
+        labels = ('users', 'insert')
+        before = MONGO_FAILURES.value(labels)
+        listener.started(command_event('insert', {'insert': 'users'}, request_id=3))
+        listener.failed(command_event('insert', request_id=3))
+        self.assertEqual(MONGO_FAILURES.value(labels), before + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
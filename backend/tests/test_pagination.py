@@ -0,0 +1,72 @@
+import unittest
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from utils.pagination import PaginationError, decode_cursor, encode_cursor, keyset_query, sort_spec
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+def page_after(doc, sort_key, limit=2):
+    return {'limit': limit, 'sort': sort_key, 'after': decode_cursor(encode_cursor(doc, sort_key)) if doc else None}
+
+
+class CursorTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        doc = {'_id': ObjectId(), 'created_at': datetime(2024, 3, 1, 12, 30, 15, 250000)}
+        self.assertEqual(decode_cursor(encode_cursor(doc, '_id')), ('_id', doc['_id'], doc['_id']))
+        self.assertEqual(decode_cursor(encode_cursor(doc, 'created_at')), ('created_at', doc['created_at'], doc['_id']))
+
+    def test_null_sort_key(self):
+        doc = {'_id': ObjectId()}
+        self.assertEqual(decode_cursor(encode_cursor(doc, 'created_at')), ('created_at', None, doc['_id']))
+
+    def test_invalid_cursors(self):
+        valid = encode_cursor({'_id': ObjectId()}, '_id')
+        for token in ('', 'garbage', valid[:-4], encode_cursor({'_id': ObjectId(), 'name': 'x'}, 'name')):
+            with self.assertRaises(PaginationError):
+                decode_cursor(token)
+
+    def test_keyset_query(self):
+        self.assertEqual(keyset_query({'a': 1}, {'after': None}), {'a': 1})
+        last_id = ObjectId()
+        self.assertEqual(keyset_query({}, {'after': ('_id', last_id, last_id)}), {'_id': {'$gt': last_id}})
+        query = keyset_query({'a': 1}, {'after': ('_id', last_id, last_id)})
+        self.assertEqual(query, {'$and': [{'a': 1}, {'_id': {'$gt': last_id}}]})
+
+
+@unittest.skipIf(mongomock is None, 'mongomock is not installed')
+class KeysetPagingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.collection = mongomock.MongoClient().db.patients
+        start = datetime(2024, 1, 1)
+        docs = [{'n': 0}, {'n': 1, 'created_at': None}, {'n': 2, 'created_at': start},
+                {'n': 3, 'created_at': start}, {'n': 4, 'created_at': start + timedelta(days=1)}, {'n': 5}]
+        self.collection.insert_many(docs)
+
+    def walk(self, sort_key, limit):
+        seen, last = [], None
+        while True:
+            page = page_after(last, sort_key, limit)
+            docs = list(self.collection.find(keyset_query({}, page)).sort(sort_spec(page)).limit(limit))
+            if not docs:
+                return seen
+            seen.extend(doc['n'] for doc in docs)
+            last = docs[-1]
+
+    def test_every_document_is_seen_once(self):
+        for sort_key in ('_id', 'created_at'):
+            for limit in (1, 2, 4, 10):
+                with self.subTest(sort=sort_key, limit=limit):
+                    self.assertEqual(sorted(self.walk(sort_key, limit)), list(range(6)))
+
+    def test_nulls_come_first(self):
+        self.assertEqual(self.walk('created_at', 1), [0, 1, 5, 2, 3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
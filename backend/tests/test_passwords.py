@@ -0,0 +1,66 @@
+import threading
+import unittest
+from unittest import mock
+
+from werkzeug.security import generate_password_hash
+
+from utils import passwords
+from utils.passwords import HashingBusy, needs_rehash, normalize_method
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class HashMethodTestCase(unittest.TestCase):
+    def test_normalize_method(self):
+        self.assertEqual(normalize_method('scrypt'), 'scrypt:32768:8:1')
+        self.assertEqual(normalize_method('pbkdf2'), 'pbkdf2:sha256:600000')
+        self.assertEqual(normalize_method('pbkdf2:sha512'), 'pbkdf2:sha512:600000')
+        self.assertEqual(normalize_method('pbkdf2:sha256:1000'), 'pbkdf2:sha256:1000')
+
+    def test_needs_rehash(self):
+        with mock.patch.object(passwords, 'HASH_METHOD', 'pbkdf2:sha256:1000'):
+            self.assertFalse(needs_rehash(generate_password_hash('pw', 'pbkdf2:sha256:1000')))
+            self.assertTrue(needs_rehash(generate_password_hash('pw', 'pbkdf2:sha256:2000')))
+
+
+@mock.patch.object(passwords, 'HASH_METHOD', 'pbkdf2:sha256:1000')
+class HashingTestCase(unittest.TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        passwords.shutdown()
+
+    def test_hash_and_verify_in_pool(self):
+        pwhash = passwords.hash_password('secret')
+        self.assertTrue(pwhash.startswith('pbkdf2:sha256:1000$'))
+        self.assertTrue(passwords.verify_password(pwhash, 'secret'))
+        self.assertFalse(passwords.verify_password(pwhash, 'wrong'))
+
+    def test_hash_inline(self):
+        with mock.patch.object(passwords, 'PASSWORD_HASH_WORKERS', 0):
+            self.assertTrue(passwords.verify_password(passwords.hash_password('secret'), 'secret'))
+
+    def test_full_queue_is_rejected(self):
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        with mock.patch.object(passwords, '_slots', slots), \
+                mock.patch.object(passwords, 'PASSWORD_HASH_QUEUE_TIMEOUT', 0):
+            with self.assertRaises(HashingBusy):
+                passwords.hash_password('secret')
+
+    @unittest.skipIf(mongomock is None, 'mongomock is not installed')
+    def test_upgrade_hash(self):
+        db = mongomock.MongoClient().db
+        old = generate_password_hash('secret', 'pbkdf2:sha256:2000')
+        user_id = db.users.insert_one({'username': 'drwho', 'password': old}).inserted_id
+        user = db.users.find_one({'_id': user_id})
+        self.assertTrue(passwords.upgrade_hash(db, user, 'secret'))
+        upgraded = db.users.find_one({'_id': user_id})['password']
+        self.assertTrue(upgraded.startswith('pbkdf2:sha256:1000$'))
+        self.assertFalse(passwords.upgrade_hash(db, db.users.find_one({'_id': user_id}), 'secret'))
+
+
+if __name__ == '__main__':
+    unittest.main()
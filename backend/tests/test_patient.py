@@ -0,0 +1,50 @@
+import json
+import unittest
+from datetime import datetime
+
+from bson import ObjectId, encode
+from bson.raw_bson import RawBSONDocument
+
+from models.patient import Patient, serialize
+from utils.streaming import encode_document
+
+
+def raw_patient(**fields):
+    doc = dict({'_id': ObjectId(), 'name': 'Jane Doe', 'email': 'jane@example.com'}, **fields)
+    return doc, RawBSONDocument(encode(doc))
+
+
+class PatientTestCase(unittest.TestCase):
+    def test_has_no_instance_dict(self):
+        patient = Patient({'name': 'Jane'})
+        self.assertFalse(hasattr(patient, '__dict__'))
+        with self.assertRaises(AttributeError):
+            patient.nickname = 'J'
+
+    def test_fields_read_from_raw_bson(self):
+        doc, raw = raw_patient(allergies=['latex'], created_at=datetime(2024, 5, 1))
+        patient = Patient(raw)
+        self.assertEqual(patient.id, str(doc['_id']))
+        self.assertEqual(patient.name, 'Jane Doe')
+        self.assertEqual(patient.allergies, ['latex'])
+        self.assertEqual(patient.medications, [])
+        self.assertEqual(patient.address, '')
+        self.assertIsNone(patient.updated_at)
+
+    def test_missing_document_is_rejected(self):
+        with self.assertRaises(ValueError):
+            Patient(None)
+
+    def test_to_dict_is_the_same_for_raw_and_decoded(self):
+        doc, raw = raw_patient(medications=[{'name': 'ibuprofen', 'dose': '200mg'}], created_at=datetime(2024, 5, 1))
+        self.assertEqual(Patient(raw).to_dict(), Patient(doc).to_dict())
+        self.assertEqual(serialize(raw)['created_at'], '2024-05-01T00:00:00')
+        self.assertEqual(json.loads(Patient(raw).to_json())['medications'], [{'name': 'ibuprofen', 'dose': '200mg'}])
+
+    def test_stream_encoding_of_raw_documents(self):
+        doc, raw = raw_patient(contact={'phone': '555'})
+        self.assertEqual(encode_document(raw), encode_document(doc))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+from datetime import date
+
+from utils.recurrence import MAX_OCCURRENCES, RecurrenceError, expand
+
+
+class ExpandTestCase(unittest.TestCase):
+    def test_daily_with_count(self):
+        dates = expand('2024-01-30', {'freq': 'daily', 'count': 3})
+        self.assertEqual(dates, [date(2024, 1, 30), date(2024, 1, 31), date(2024, 2, 1)])
+
+    def test_weekly_defaults_to_start_weekday(self):
+        dates = expand('2024-01-01', {'freq': 'weekly', 'interval': 2, 'count': 3})
+        self.assertEqual(dates, [date(2024, 1, 1), date(2024, 1, 15), date(2024, 1, 29)])
+
+    def test_weekly_on_several_weekdays(self):
+        # 2024-01-03 is a Wednesday, so the Monday of that week is skipped
+        dates = expand('2024-01-03', {'freq': 'weekly', 'weekdays': ['MO', 'TH'], 'count': 3})
+        self.assertEqual(dates, [date(2024, 1, 4), date(2024, 1, 8), date(2024, 1, 11)])
+
+    def test_until_is_inclusive(self):
+        dates = expand('2024-01-01', {'freq': 'weekly', 'until': '2024-01-15'})
+        self.assertEqual(dates, [date(2024, 1, 1), date(2024, 1, 8), date(2024, 1, 15)])
+
+    def test_monthly_skips_short_months(self):
+        dates = expand('2024-01-31', {'freq': 'monthly', 'count': 3})
+        self.assertEqual(dates, [date(2024, 1, 31), date(2024, 3, 31), date(2024, 5, 31)])
+
+    def test_invalid_rules(self):
+        for rule in (
+            {'freq': 'hourly', 'count': 1},
+            {'freq': 'daily'},
+            {'freq': 'daily', 'count': 0},
+            {'freq': 'daily', 'count': 1, 'interval': 0},
+            {'freq': 'weekly', 'count': 1, 'weekdays': ['XX']},
+        ):
+            with self.assertRaises(RecurrenceError):
+                expand('2024-01-01', rule)
+
+    def test_no_occurrences(self):
+        with self.assertRaisesRegex(RecurrenceError, 'no occurrences'):
+            expand('2024-01-15', {'freq': 'daily', 'until': '2024-01-01'})
+
+    def test_occurrence_limit(self):
+        with self.assertRaises(RecurrenceError):
+            expand('2024-01-01', {'freq': 'daily', 'count': MAX_OCCURRENCES + 1})
+        self.assertEqual(len(expand('2024-01-01', {'freq': 'daily', 'count': MAX_OCCURRENCES})), MAX_OCCURRENCES)
+
+
+if __name__ == '__main__':
+    unittest.main()
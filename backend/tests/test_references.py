@@ -0,0 +1,86 @@
+import unittest
+from unittest import mock
+
+from bson import ObjectId
+
+from models.loader import Loader
+from utils import references
+from utils.references import (
+    ExpandError, expand_projection, expand_references, load_references, parse_expand, sync_patient_summary
+)
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class ParseExpandTestCase(unittest.TestCase):
+    def test_names(self):
+        self.assertEqual(parse_expand({'expand': 'patient, doctor,patient'}), ('patient', 'doctor'))
+        self.assertEqual(parse_expand({}), ())
+
+    def test_unknown_name(self):
+        with self.assertRaises(ExpandError):
+            parse_expand({'expand': 'patient,billing'})
+
+    def test_projection_keeps_references(self):
+        projection = expand_projection({'reason': 1}, ('patient',))
+        self.assertEqual(projection, {'reason': 1, 'patient_id': 1, 'patient_summary': 1})
+        self.assertEqual(expand_projection({'notes': 0}, ('doctor',)), {'notes': 0})
+
+
+@unittest.skipIf(mongomock is None, 'mongomock is not installed')
+class ExpandReferencesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = mongomock.MongoClient().db
+        self.doctor_id = self.db.users.insert_one({'username': 'drwho', 'email': 'd@x', 'password': 'hash'}).inserted_id
+        self.patient_id = self.db.patients.insert_one(
+            {'name': 'Jane', 'email': 'j@x', 'phone': '1', 'notes': 'private'}).inserted_id
+
+    def test_expand_from_lookup_and_embedded_copy(self):
+        docs = [
+            {'patient_id': self.patient_id, 'doctor_id': str(self.doctor_id)},
+            {'patient_id': self.patient_id, 'doctor_id': self.doctor_id,
+             'patient_summary': {'name': 'Copy', 'email': None, 'phone': None}},
+            {'patient_id': ObjectId(), 'doctor_id': 'not-an-id'}
+        ]
+        expand_references(Loader(self.db), docs, ('patient', 'doctor'))
+        self.assertEqual(docs[0]['patient'], {'_id': self.patient_id, 'name': 'Jane', 'email': 'j@x', 'phone': '1'})
+        self.assertEqual(docs[0]['doctor'], {'_id': self.doctor_id, 'username': 'drwho', 'email': 'd@x'})
+        self.assertEqual(docs[1]['patient']['name'], 'Copy')
+        self.assertIsNone(docs[2]['patient'])
+        self.assertIsNone(docs[2]['doctor'])
+
+    def test_embedded_copies_are_ignored_when_embedding_is_off(self):
+        docs = [{'patient_id': self.patient_id, 'patient_summary': {'name': 'Stale', 'email': None, 'phone': None}}]
+        with mock.patch.object(references, 'APPOINTMENT_PATIENT_SUMMARY', False):
+            self.assertEqual(expand_projection({'date': 1}, ('patient',)), {'date': 1, 'patient_id': 1})
+            expand_references(Loader(self.db), docs, ('patient',))
+        self.assertEqual(docs[0]['patient']['name'], 'Jane')
+
+    def test_load_references(self):
+        patient, doctor = load_references(Loader(self.db), str(self.patient_id), ObjectId())
+        self.assertEqual(patient['name'], 'Jane')
+        self.assertIsNone(doctor)
+
+    def test_only_doctors_are_doctors(self):
+        # The user of setUp has no role
+        self.assertIsNone(load_references(Loader(self.db), None, self.doctor_id)[1])
+        admin_id = self.db.users.insert_one({'username': 'root', 'role': 'admin'}).inserted_id
+        self.assertIsNone(load_references(Loader(self.db), None, admin_id)[1])
+        self.db.users.update_one({'_id': self.doctor_id}, {'$set': {'role': 'doctor'}})
+        self.assertEqual(load_references(Loader(self.db), None, self.doctor_id)[1]['username'], 'drwho')
+
+    def test_sync_patient_summary(self):
+        self.db.appointments.insert_many([
+            {'patient_id': self.patient_id, 'doctor_id': 'd1', 'patient_summary': {'name': 'Jane'}},
+            {'patient_id': self.patient_id, 'doctor_id': 'd1'}
+        ])
+        self.assertEqual(sync_patient_summary(self.db, self.patient_id, {'name': 'Jane Smith', 'notes': 'x'}), 1)
+        self.assertEqual(self.db.appointments.count_documents({'patient_summary.name': 'Jane Smith'}), 1)
+        self.assertEqual(sync_patient_summary(self.db, self.patient_id, {'notes': 'y'}), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
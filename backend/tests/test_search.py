@@ -0,0 +1,78 @@
+import re
+import unittest
+from unittest import mock
+
+from support import ApiTestCase, mongomock
+from utils.search import prefix_query, search_keys
+
+
+class SearchKeysTestCase(unittest.TestCase):
+    def test_keys(self):
+        patient = {'name': '  Jane  van DOE ', 'email': 'Jane@Example.com', 'phone': '+1 (555) 010-2030'}
+        self.assertEqual(search_keys(patient),
+                         sorted(['jane van doe', 'jane', 'van', 'doe', 'jane@example.com', '15550102030']))
+
+    def test_short_words_and_missing_fields(self):
+        self.assertEqual(search_keys({'name': 'J. R Smith'}), ['j.', 'j. r smith', 'smith'])
+        self.assertEqual(search_keys({}), [])
+
+
+class PrefixQueryTestCase(unittest.TestCase):
+    def pattern(self, term):
+        return prefix_query(term)['search_keys']['$regex']
+
+    def test_anchored_and_normalized(self):
+        self.assertEqual(self.pattern('  Jane   Do'), '^' + re.escape('jane do'))
+
+    def test_phone_punctuation_is_dropped(self):
+        self.assertEqual(self.pattern('(555) 010-2'), '^5550102')
+
+    def test_metacharacters_are_escaped(self):
+        for term in ('a.b', 'x*', '(jane', 'a|b', '[a-z]', 'c++', '^$', '\\d'):
+            pattern = self.pattern(term)
+            self.assertTrue(re.match(pattern, term.lower()), term)
+            self.assertIsNone(re.match(pattern, 'zz' + term.lower()), term)
+        self.assertIsNone(re.match(self.pattern('a.b'), 'axb'))
+
+
+@unittest.skipIf(mongomock is None, 'mongomock is not installed')
+class SearchRouteTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        for user, name, email in ((self.doctor, 'Jane Doe', 'jane@example.com'),
+                                  (self.doctor, 'Janet (Jan) Roe', 'janet@example.com'),
+                                  (self.other, 'Janice Poe', 'janice@example.com')):
+            body = {'name': name, 'email': email, 'phone': '555', 'address': 'x', 'date_of_birth': '1990-01-01'}
+            self.assertEqual(self.client.post('/api/patients/', json=body, headers=self.headers(user)).status_code, 201)
+
+    def search(self, q, user=None, mode='prefix'):
+        response = self.client.get('/api/patients/search', query_string={'q': q, 'mode': mode},
+                                   headers=self.headers(user))
+        self.assertEqual(response.status_code, 200)
+        return sorted(patient['name'] for patient in response.get_json())
+
+    def test_prefix_is_scoped_to_the_doctor(self):
+        self.assertEqual(self.search('jan', self.doctor), ['Jane Doe', 'Janet (Jan) Roe'])
+        self.assertEqual(self.search('jan', self.other), ['Janice Poe'])
+        self.assertEqual(self.search('jan', self.admin), ['Jane Doe', 'Janet (Jan) Roe', 'Janice Poe'])
+
+    def test_prefix_matches_words_and_escapes_the_term(self):
+        self.assertEqual(self.search('ROE', self.doctor), ['Janet (Jan) Roe'])
+        self.assertEqual(self.search('(jan', self.doctor), ['Janet (Jan) Roe'])
+        self.assertEqual(self.search('j.n', self.doctor), [])
+
+    def test_text_query_shape(self):
+        # mongomock has no $text support, so only the query sent to MongoDB is checked
+        with mock.patch.object(mongomock.collection.Collection, 'find', return_value=mock.MagicMock()) as find:
+            self.search('jane', self.doctor, mode='text')
+        query, projection = find.call_args[0]
+        self.assertEqual(query, {'doctor_id': str(self.doctor['_id']), '$text': {'$search': 'jane'}})
+        self.assertEqual(projection['score'], {'$meta': 'textScore'})
+
+    def test_invalid_mode(self):
+        response = self.client.get('/api/patients/search?q=jan&mode=fuzzy', headers=self.headers())
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from models import sessions
+from models.sessions import (
+    REFRESH_TOKENS_COLLECTION, SessionError, revoke_token, revoke_user_sessions, revoked_sessions, rotate,
+    start_session
+)
+
+from support import ApiTestCase, mongomock
+from utils.passwords import hash_password
+
+
+@unittest.skipIf(mongomock is None, 'mongomock is not installed')
+class SessionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = mongomock.MongoClient().db
+        self.user_id = ObjectId()
+        sessions.revocation_cache.clear()
+
+    def test_tokens_are_stored_hashed(self):
+        _, token = start_session(self.db, self.user_id)
+        self.assertIsNone(self.db[REFRESH_TOKENS_COLLECTION].find_one({'_id': token}))
+        self.assertEqual(self.db[REFRESH_TOKENS_COLLECTION].count_documents({}), 1)
+
+    def test_rotation(self):
+        session_id, token = start_session(self.db, self.user_id)
+        rotated_session, user_id, new_token = rotate(self.db, token)
+        self.assertEqual((rotated_session, user_id), (session_id, self.user_id))
+        self.assertNotEqual(new_token, token)
+        self.assertEqual(rotate(self.db, new_token)[0], session_id)
+
+    def test_reuse_revokes_the_session(self):
+        session_id, token = start_session(self.db, self.user_id)
+        _, _, new_token = rotate(self.db, token)
+        with self.assertRaises(SessionError):
+            rotate(self.db, token)
+        with self.assertRaises(SessionError):
+            rotate(self.db, new_token)
+        self.assertIn(str(session_id), revoked_sessions(self.db))
+
+    def test_expired_token(self):
+        _, token = start_session(self.db, self.user_id)
+        self.db[REFRESH_TOKENS_COLLECTION].update_many({}, {'$set': {'expires_at': datetime.utcnow() - timedelta(1)}})
+        with self.assertRaises(SessionError):
+            rotate(self.db, token)
+
+    def test_logout(self):
+        session_id, token = start_session(self.db, self.user_id)
+        other_session, _ = start_session(self.db, self.user_id)
+        self.assertEqual(revoked_sessions(self.db), frozenset())
+        self.assertTrue(revoke_token(self.db, token))
+        self.assertFalse(revoke_token(self.db, 'unknown'))
+        self.assertEqual(revoked_sessions(self.db), {str(session_id)})
+        revoke_user_sessions(self.db, self.user_id)
+        self.assertEqual(revoked_sessions(self.db), {str(session_id), str(other_session)})
+
+
+class SessionRouteTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db.users.update_one({'username': 'doctor'}, {'$set': {'password': hash_password('secret')}})
+
+    def post(self, path, body):
+        return self.client.post(f'/api/user/{path}', json=body)
+
+    def login(self):
+        response = self.post('login', {'username': 'doctor', 'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def profile(self, token):
+        response = self.client.get('/api/user/profile', headers={'Authorization': f'Bearer {token}'})
+        return response.status_code, response.get_json().get('message')
+
+    def test_logout_revokes_the_access_token(self):
+        tokens = self.login()
+        response = self.post('refresh', {'refresh_token': tokens['refresh_token']})
+        self.assertEqual(response.status_code, 200)
+        refreshed = response.get_json()
+        # Both access tokens are accepted, and their claims memoized
+        self.assertEqual(self.profile(tokens['token'])[0], 200)
+        self.assertEqual(self.profile(refreshed['token'])[0], 200)
+
+        self.assertEqual(self.post('logout', {'refresh_token': refreshed['refresh_token']}).status_code, 200)
+        for token in (tokens['token'], refreshed['token']):
+            self.assertEqual(self.profile(token), (401, 'Token has been revoked'))
+        self.assertEqual(self.post('refresh', {'refresh_token': refreshed['refresh_token']}).status_code, 401)
+
+    def test_reused_refresh_token_ends_the_session(self):
+        tokens = self.login()
+        refreshed = self.post('refresh', {'refresh_token': tokens['refresh_token']}).get_json()
+        self.assertEqual(self.profile(refreshed['token'])[0], 200)
+
+        # Replaying the rotated token, e.g. a stolen copy, revokes the whole session
+        self.assertEqual(self.post('refresh', {'refresh_token': tokens['refresh_token']}).status_code, 401)
+        self.assertEqual(self.profile(refreshed['token']), (401, 'Token has been revoked'))
+        self.assertEqual(self.post('refresh', {'refresh_token': refreshed['refresh_token']}).status_code, 401)
+
+        # Other sessions of the user are left alone
+        self.assertEqual(self.profile(self.login()['token'])[0], 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
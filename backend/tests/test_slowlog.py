@@ -0,0 +1,79 @@
+import unittest
+from types import SimpleNamespace
+
+from utils.slowlog import SlowOperationLog, redact_command, summarize_plan
+
+
+def command_event(command_name, command=None, request_id=1, duration_micros=250000):
+    return SimpleNamespace(command_name=command_name, command=command or {}, reply={},
+                           request_id=request_id, connection_id=('localhost', 27017),
+                           database_name='doctor_assistant', duration_micros=duration_micros)
+
+
+class RecordingLog(SlowOperationLog):
+    """Keeps entries in memory instead of handing them to the writer thread."""
+
+    def __init__(self, **kwargs):
+        super().__init__(get_client=None, get_db=None, **kwargs)
+        self.entries = []
+
+    def _submit(self, entry, explain):
+        self.entries.append((entry, explain))
+
+
+class SlowLogTestCase(unittest.TestCase):
+    def test_redact_command_hides_values(self):
+        shape = redact_command('find', {
+            'find': 'patients',
+            'filter': {'email': 'jane@example.com', 'doctor_id': {'$in': ['a', 'b', 'c']}},
+            'sort': {'created_at': 1},
+            'limit': 10,
+            'lsid': {'id': 'session'},
+            '$db': 'doctor_assistant'
+        })
+        self.assertEqual(shape, {
+            'find': 'patients',
+            'filter': {'email': '?', 'doctor_id': {'$in': ['?']}},
+            'sort': {'created_at': 1},
+            'limit': 10
+        })
+
+    def test_redact_command_drops_inserted_documents(self):
+        shape = redact_command('insert', {'insert': 'patients', 'documents': [{'name': 'Jane'}, {'name': 'John'}]})
+        self.assertEqual(shape, {'insert': 'patients', 'documents': '<2 documents>'})
+
+    def test_summarize_plan(self):
+        summary = summarize_plan({'queryPlanner': {'winningPlan': {
+            'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': 'doctor_id'}}}})
+        self.assertEqual(summary, {'stages': ['FETCH', 'IXSCAN'], 'indexes': ['doctor_id'], 'collscan': False})
+
+    def test_only_slow_commands_are_logged(self):
+        log = RecordingLog(threshold_ms=100, explain_sample=1.0)
+        log.started(command_event('find', {'find': 'patients', 'filter': {'name': 'Jane'}}))
+        log.succeeded(command_event('find', duration_micros=5000))
+        log.started(command_event('find', {'find': 'patients', 'filter': {'name': 'Jane'}}, request_id=2))
+        log.succeeded(command_event('find', request_id=2))
+        self.assertEqual(len(log.entries), 1)
+        entry, explain = log.entries[0]
+        self.assertEqual(entry['collection'], 'patients')
+        self.assertEqual(entry['duration_ms'], 250.0)
+        self.assertNotIn('Jane', entry['shape'])
+        self.assertEqual(explain[0], 'doctor_assistant')
+
+    def test_same_shape_has_same_id(self):
+        log = RecordingLog(threshold_ms=100, explain_sample=0)
+        for request_id, email in enumerate(['a@example.com', 'b@example.com']):
+            log.started(command_event('find', {'find': 'patients', 'filter': {'email': email}}, request_id=request_id))
+            log.succeeded(command_event('find', request_id=request_id))
+        self.assertEqual(log.entries[0][0]['shape_id'], log.entries[1][0]['shape_id'])
+        self.assertIsNone(log.entries[0][1])
+
+    def test_own_writes_are_not_logged(self):
+        log = RecordingLog(threshold_ms=100)
+        log.started(command_event('insert', {'insert': 'slow_operations', 'documents': [{}]}))
+        log.succeeded(command_event('insert'))
+        self.assertEqual(log.entries, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from models.sync import (
+    SYNC_LAG_SECONDS, TOMBSTONES_COLLECTION, SyncExpired, decode_sync_token, encode_sync_token, record_moves, record_tombstones,
+    sync_page
+)
+from support import ApiTestCase
+from utils.pagination import PaginationError
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class SyncTokenTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        now = datetime.utcnow().replace(microsecond=0)
+        positions = {'patients': (now, ObjectId()), 'appointments': (now, None), TOMBSTONES_COLLECTION: (now, None)}
+        self.assertEqual(decode_sync_token(encode_sync_token(positions)), positions)
+
+    def test_invalid_and_expired_tokens(self):
+        with self.assertRaises(PaginationError):
+            decode_sync_token('garbage')
+        old = datetime.utcnow() - timedelta(days=365)
+        token = encode_sync_token(dict.fromkeys(('patients', 'appointments', TOMBSTONES_COLLECTION), (old, None)))
+        with self.assertRaises(SyncExpired):
+            decode_sync_token(token)
+
+    def test_old_document_positions_are_valid(self):
+        old = datetime.utcnow() - timedelta(days=365)
+        positions = {'patients': (old, ObjectId()), 'appointments': (old, None),
+                     TOMBSTONES_COLLECTION: (datetime.utcnow().replace(microsecond=0), None)}
+        self.assertEqual(decode_sync_token(encode_sync_token(positions)), positions)
+
+
+@unittest.skipIf(mongomock is None, 'mongomock is not installed')
+class SyncPageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = mongomock.MongoClient().db
+        self.doctor = {'_id': ObjectId(), 'role': 'doctor'}
+        self.start = datetime(2024, 1, 1)
+        self.patients = [
+            self.db.patients.insert_one({'name': f'p{i}', 'doctor_id': str(self.doctor['_id']),
+                                         'updated_at': self.start + timedelta(minutes=i)}).inserted_id
+            for i in range(3)
+        ]
+        self.db.patients.insert_one({'name': 'other', 'doctor_id': 'someone', 'updated_at': self.start})
+
+    def sync(self, positions=None, limit=500, minutes=10):
+        return sync_page(self.db, self.doctor, positions, limit, now=self.start + timedelta(minutes=minutes))
+
+    def test_pages_then_steady_state(self):
+        changes, positions, more = self.sync(limit=2)
+        self.assertEqual([p['name'] for p in changes['patients']], ['p0', 'p1'])
+        self.assertTrue(more)
+        changes, positions, more = self.sync(positions, limit=2)
+        self.assertEqual([p['name'] for p in changes['patients']], ['p2'])
+        self.assertFalse(more)
+        changes, positions, more = self.sync(positions, minutes=20)
+        self.assertEqual(changes['patients'], [])
+
+    def test_paging_through_tokens(self):
+        # Documents last written long before the tombstone retention, as after the updated_at backfill
+        names = []
+        token = None
+        while True:
+            changes, positions, more = sync_page(self.db, self.doctor, decode_sync_token(token) if token else None, 2)
+            names.extend(p['name'] for p in changes['patients'])
+            token = encode_sync_token(positions)
+            if not more:
+                break
+        self.assertEqual(names, ['p0', 'p1', 'p2'])
+        changes, _, more = sync_page(self.db, self.doctor, decode_sync_token(token), 2)
+        self.assertEqual((changes['patients'], more), ([], False))
+
+    def test_first_sync_skips_tombstones(self):
+        record_tombstones(self.db, 'patients', [{'_id': self.patients[0], 'doctor_id': self.doctor['_id']}],
+                          date=self.start)
+        changes, positions, _ = self.sync()
+        self.assertEqual(changes['deleted']['patients'], [])
+        self.assertEqual(positions[TOMBSTONES_COLLECTION], (self.start + timedelta(minutes=10, seconds=-SYNC_LAG_SECONDS), None))
+
+    def test_updates_and_tombstones(self):
+        _, positions, _ = self.sync()
+        later = self.start + timedelta(minutes=12)
+        self.db.patients.update_one({'_id': self.patients[0]}, {'$set': {'name': 'renamed', 'updated_at': later}})
+        record_tombstones(self.db, 'patients', [{'_id': self.patients[1], 'doctor_id': self.doctor['_id']}], date=later)
+        changes, _, _ = self.sync(positions, minutes=20)
+        self.assertEqual([p['name'] for p in changes['patients']], ['renamed'])
+        self.assertEqual(changes['deleted']['patients'], [self.patients[1]])
+
+    def test_moving_back_drops_the_tombstone(self):
+        doctor_id = str(self.doctor['_id'])
+        patient = {'_id': self.patients[2], 'doctor_id': doctor_id}
+        record_moves(self.db, 'patients', [patient], 'someone', self.start)
+        self.assertEqual(self.db[TOMBSTONES_COLLECTION].count_documents({'doctor_id': doctor_id}), 1)
+        record_moves(self.db, 'patients', [dict(patient, doctor_id='someone')], doctor_id, self.start)
+        self.assertEqual(self.db[TOMBSTONES_COLLECTION].count_documents({'doctor_id': doctor_id}), 0)
+        record_moves(self.db, 'patients', [patient], doctor_id, self.start)
+        self.assertEqual(self.db[TOMBSTONES_COLLECTION].count_documents({}), 1)
+
+
+class SyncRouteTestCase(ApiTestCase):
+    def test_initial_sync_pages_to_the_end(self):
+        old = datetime(2020, 1, 1)
+        self.db.patients.insert_many([{'name': f'p{i}', 'doctor_id': str(self.doctor['_id']), 'updated_at': old}
+                                      for i in range(3)])
+        names = []
+        path = '/api/sync?limit=1'
+        while True:
+            response = self.client.get(path, headers=self.headers())
+            self.assertEqual(response.status_code, 200)
+            body = response.get_json()
+            names.extend(p['name'] for p in body['patients'])
+            path = f"/api/sync?limit=1&since={body['token']}"
+            if not body['has_more']:
+                break
+        self.assertEqual(names, ['p0', 'p1', 'p2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
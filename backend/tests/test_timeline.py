@@ -0,0 +1,102 @@
+import unittest
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from models.events import change_events
+from models.history import HISTORY_COLLECTION, build_buckets
+from models.timeline import decode_timeline_cursor, encode_timeline_cursor, history_since, timeline_pipeline
+from utils.pagination import PaginationError
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+class ChangeEventsTestCase(unittest.TestCase):
+    def test_added_and_removed_items(self):
+        patient_id = ObjectId()
+        events = change_events(patient_id, 'doctor', {'medications': ['a', 'b'], 'allergies': ['latex']},
+                               {'medications': ['b', 'c'], 'allergies': ['latex']}, datetime(2024, 1, 1))
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['field'], 'medications')
+        self.assertEqual(events[0]['added'], ['c'])
+        self.assertEqual(events[0]['removed'], ['a'])
+        self.assertEqual(events[0]['patient_id'], patient_id)
+
+    def test_untouched_fields_are_ignored(self):
+        self.assertEqual(change_events(ObjectId(), None, {'allergies': ['latex']}, {'name': 'Jane'}), [])
+
+
+class TimelineCursorTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        appointment_id = ObjectId()
+        date = datetime(2024, 3, 1, 9, 30)
+        cursor = encode_timeline_cursor({'kind': 'appointment', 'date': date, 'key': appointment_id})
+        self.assertEqual(decode_timeline_cursor(cursor), (date, 'appointment', appointment_id))
+        cursor = encode_timeline_cursor({'kind': 'history', 'date': date, 'key': -999998})
+        self.assertEqual(decode_timeline_cursor(cursor), (date, 'history', -999998))
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(PaginationError):
+            decode_timeline_cursor('garbage')
+
+    def test_branches_are_cut_at_the_cursor(self):
+        patient_id = ObjectId()
+        date = datetime(2024, 3, 1)
+        key = ObjectId()
+        pipeline = timeline_pipeline(patient_id, 10, (date, 'change', key))
+        unions = {stage['$unionWith']['coll']: stage['$unionWith']['pipeline'] for stage in pipeline if '$unionWith' in stage}
+        # Appointments sort before changes on the same date, history after them
+        self.assertEqual(unions['appointments'][0]['$match']['start'], {'$lt': date})
+        self.assertEqual(unions['patient_events'][0]['$match']['$or'],
+                         [{'date': {'$lt': date}}, {'date': date, '_id': {'$lt': key}}])
+        self.assertEqual(pipeline[3]['$match']['date'], {'$lte': date})
+        self.assertEqual(pipeline[-1], {'$limit': 11})
+
+    def test_history_buckets_are_bounded(self):
+        since = datetime(2024, 1, 1)
+        pipeline = timeline_pipeline(ObjectId(), 10, since=since)
+        self.assertEqual(pipeline[0]['$match']['last_date'], {'$gte': since})
+        self.assertNotIn('last_date', timeline_pipeline(ObjectId(), 10)[0]['$match'])
+
+
+@unittest.skipIf(mongomock is None, 'mongomock is not installed')
+class HistorySinceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = mongomock.MongoClient().db
+        self.patient_id = ObjectId()
+        self.start = datetime(2024, 1, 1)
+        # Four buckets of 10 daily entries, oldest first
+        entries = [{'n': n, 'date': self.start + timedelta(days=n)} for n in range(40)]
+        self.db[HISTORY_COLLECTION].insert_many(build_buckets(self.patient_id, 'doctor', entries, size=10))
+
+    def test_newest_buckets_holding_a_page(self):
+        self.assertEqual(history_since(self.db, self.patient_id, 5), self.start + timedelta(days=30))
+        self.assertEqual(history_since(self.db, self.patient_id, 10), self.start + timedelta(days=20))
+        self.assertIsNone(history_since(self.db, self.patient_id, 40))
+
+    def test_buckets_straddling_the_cursor_are_not_counted(self):
+        after = (self.start + timedelta(days=35), 'history', 35)
+        self.assertEqual(history_since(self.db, self.patient_id, 5, after), self.start + timedelta(days=20))
+
+    def test_backdated_entries(self):
+        # An entry dated years back in the newest bucket moves the bound down with it
+        self.db[HISTORY_COLLECTION].update_one({'seq': 3}, {'$set': {'first_date': datetime(2020, 1, 1)}})
+        self.assertEqual(history_since(self.db, self.patient_id, 5), datetime(2020, 1, 1))
+
+    def test_undated_entries_are_not_counted(self):
+        # The newest bucket holds three dated entries and seven without a date
+        newest = self.db[HISTORY_COLLECTION].find_one({'seq': 3})
+        entries = newest['entries'][:3] + [{'n': n} for n in range(7)]
+        self.db[HISTORY_COLLECTION].update_one({'seq': 3}, {'$set': {'entries': entries, 'dated': 3}})
+        self.assertEqual(history_since(self.db, self.patient_id, 5), self.start + timedelta(days=20))
+
+    def test_uncounted_buckets_read_further_back(self):
+        self.db[HISTORY_COLLECTION].update_one({'seq': 3}, {'$unset': {'dated': ''}})
+        self.assertEqual(history_since(self.db, self.patient_id, 5), self.start + timedelta(days=20))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import unittest
+from datetime import datetime
+
+from support import ApiTestCase
+from utils.versioning import VERSIONS_COLLECTION
+
+
+class VersionCounterTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor_id, self.other_id = str(self.doctor['_id']), str(self.other['_id'])
+        self.patient_id = str(self.db.patients.insert_one({
+            'name': 'Jane', 'email': 'jane@example.com', 'doctor_id': self.doctor_id}).inserted_id)
+
+    def versions(self):
+        return {doc['_id']: doc['version'] for doc in self.db[VERSIONS_COLLECTION].find()}
+
+    def assert_bumps(self, scopes, request, status=None):
+        """Run request() and check which version counters it moved."""
+        before = self.versions()
+        response = request()
+        if status:
+            self.assertEqual(response.status_code, status, response.get_data(as_text=True))
+        after = self.versions()
+        changed = {key for key in after if after[key] != before.get(key)}
+        self.assertEqual(changed, set(scopes))
+        return response
+
+    def appointment(self, **fields):
+        body = dict({'patient_id': self.patient_id, 'doctor_id': self.doctor_id, 'date': '2030-01-07',
+                     'time': '10:00', 'reason': 'checkup'}, **fields)
+        return self.client.post('/api/appointments/', json=body, headers=self.headers())
+
+    def test_patient_writes(self):
+        new = {'name': 'Joe', 'email': 'joe@example.com', 'phone': '555', 'address': '1 Road',
+               'date_of_birth': '1990-01-01'}
+        self.assert_bumps({'patients:all', f'patients:{self.doctor_id}'},
+                          lambda: self.client.post('/api/patients/', json=new, headers=self.headers()), 201)
+        self.assert_bumps({'patients:all', f'patients:{self.doctor_id}'},
+                          lambda: self.client.put(f'/api/patients/{self.patient_id}', json={'address': '2 Road'},
+                                                  headers=self.headers()), 200)
+        # Reassigning changes the lists of both doctors
+        self.assert_bumps({'patients:all', f'patients:{self.doctor_id}', f'patients:{self.other_id}'},
+                          lambda: self.client.put(f'/api/patients/{self.patient_id}', json={'doctor_id': self.other_id},
+                                                  headers=self.headers(self.admin)), 200)
+        self.assert_bumps({'patients:all', f'patients:{self.other_id}'},
+                          lambda: self.client.delete(f'/api/patients/{self.patient_id}',
+                                                     headers=self.headers(self.admin)), 200)
+
+    def test_import(self):
+        body = '{"name": "A", "email": "a@example.com", "phone": "1", "address": "x", "date_of_birth": "1990-01-01"}'
+        self.assert_bumps({'patients:all', f'patients:{self.doctor_id}'},
+                          lambda: self.client.post('/api/patients/import', data=body, headers=self.headers(
+                              **{'Content-Type': 'application/x-ndjson'})), 201)
+
+    def test_rejected_writes_bump_nothing(self):
+        self.assert_bumps(set(), lambda: self.client.put(f'/api/patients/{self.patient_id}', json={'address': 'x'},
+                                                         headers=self.headers(self.other)), 404)
+        self.assert_bumps(set(), lambda: self.appointment(time='noon'), 400)
+
+    def test_appointment_writes(self):
+        scopes = {'appointments:all', f'appointments:{self.doctor_id}'}
+        appointment_id = self.assert_bumps(scopes, self.appointment, 201).get_json()['_id']
+        path = f'/api/appointments/{appointment_id}'
+        self.assert_bumps(scopes, lambda: self.client.put(path, json={'notes': 'x'}, headers=self.headers()), 200)
+        self.assert_bumps(scopes | {f'appointments:{self.other_id}'},
+                          lambda: self.client.put(path, json={'doctor_id': self.other_id},
+                                                  headers=self.headers(self.admin)), 200)
+        self.assert_bumps({'appointments:all', f'appointments:{self.other_id}'},
+                          lambda: self.client.delete(path, headers=self.headers(self.admin)), 200)
+
+    def test_series_writes(self):
+        scopes = {'appointments:all', f'appointments:{self.doctor_id}'}
+        body = {'patient_id': self.patient_id, 'doctor_id': self.doctor_id, 'date': '2030-01-07', 'time': '10:00',
+                'reason': 'physio', 'recurrence': {'freq': 'weekly', 'count': 3}}
+        series_id = self.assert_bumps(scopes, lambda: self.client.post(
+            '/api/appointments/series', json=body, headers=self.headers()), 201).get_json()['series_id']
+        path = f'/api/appointments/series/{series_id}'
+        self.assert_bumps(scopes, lambda: self.client.put(path, json={'reason': 'rehab'}, headers=self.headers()), 200)
+        self.assert_bumps(scopes, lambda: self.client.delete(path, headers=self.headers()), 200)
+
+    def test_patient_rename_bumps_appointments(self):
+        self.appointment()
+        self.assert_bumps({'patients:all', f'patients:{self.doctor_id}', 'appointments:all',
+                           f'appointments:{self.doctor_id}'},
+                          lambda: self.client.put(f'/api/patients/{self.patient_id}', json={'name': 'Jane Roe'},
+                                                  headers=self.headers()), 200)
+
+
+class ConditionalGetTestCase(ApiTestCase):
+    def get(self, path, user=None, **headers):
+        return self.client.get(path, headers=self.headers(user, **headers))
+
+    def add_patient(self, user, n):
+        body = {'name': f'P{n}', 'email': f'p{n}@example.com', 'phone': '555', 'address': 'x',
+                'date_of_birth': '1990-01-01'}
+        self.assertEqual(self.client.post('/api/patients/', json=body, headers=self.headers(user)).status_code, 201)
+
+    def test_if_none_match(self):
+        self.add_patient(self.doctor, 1)
+        first = self.get('/api/patients/')
+        etag = first.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        self.assertEqual(first.headers['Cache-Control'], 'private, no-cache')
+
+        cached = self.get('/api/patients/', **{'If-None-Match': etag})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.get_data(), b'')
+        self.assertEqual(cached.headers['ETag'], etag)
+
+        # Another doctor's write leaves this doctor's list alone, their own does not
+        self.add_patient(self.other, 2)
+        self.assertEqual(self.get('/api/patients/', **{'If-None-Match': etag}).status_code, 304)
+        self.add_patient(self.doctor, 3)
+        self.assertEqual(self.get('/api/patients/', **{'If-None-Match': etag}).status_code, 200)
+
+    def test_pages_and_fields_have_their_own_tags(self):
+        tags = {self.get(path).headers['ETag'] for path in
+                ('/api/patients/', '/api/patients/?limit=5', '/api/patients/?fields=name')}
+        self.assertEqual(len(tags), 3)
+        self.assertNotEqual(self.get('/api/patients/').headers['ETag'],
+                            self.get('/api/patients/', self.admin).headers['ETag'])
+
+    def test_format_has_its_own_tag(self):
+        response = self.get('/api/patients/')
+        self.assertIn('Accept', response.headers['Vary'])
+        ndjson = self.get('/api/patients/', Accept='application/x-ndjson')
+        self.assertNotEqual(ndjson.headers['ETag'], response.headers['ETag'])
+        self.assertEqual(self.get('/api/patients/', **{'If-None-Match': response.headers['ETag'],
+                                                       'Accept': 'application/x-ndjson'}).status_code, 200)
+
+    def test_if_modified_since(self):
+        self.add_patient(self.doctor, 1)
+        last_modified = self.get('/api/appointments/').headers.get('Last-Modified')
+        self.assertIsNone(last_modified)
+        self.db[VERSIONS_COLLECTION].update_one({'_id': f"patients:{self.doctor['_id']}"},
+                                                {'$set': {'updated_at': datetime(2030, 1, 7, 10, 0, 0, 500000)}})
+        last_modified = self.get('/api/patients/').headers['Last-Modified']
+        self.assertEqual(last_modified, 'Mon, 07 Jan 2030 10:00:00 GMT')
+        # The write may have come after the client's copy within that second
+        self.assertEqual(self.get('/api/patients/', **{'If-Modified-Since': last_modified}).status_code, 200)
+        later = 'Mon, 07 Jan 2030 10:00:01 GMT'
+        self.assertEqual(self.get('/api/patients/', **{'If-Modified-Since': later}).status_code, 304)
+        # If-None-Match wins over If-Modified-Since
+        response = self.get('/api/patients/', **{'If-Modified-Since': last_modified, 'If-None-Match': 'W/"stale"'})
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
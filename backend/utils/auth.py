@@ -1,36 +1,102 @@
 from functools import wraps
-from flask import request, jsonify, current_app
+from flask import request, jsonify
 import jwt
 from bson.objectid import ObjectId
 from models.db import get_db
+from models.sessions import ACCESS_TOKEN_MINUTES, revoked_sessions, start_session
+from utils.cache import TTLCache
+from utils.passwords import verify_password
+from utils.projection import exclude_sensitive
 from datetime import datetime, timedelta
+import hashlib
 import os
+import time
 
 # Get secret key from environment variable
 SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'your-secret-key-here')
 
-def generate_token(user_data):
-    """Generate JWT token for authenticated users."""
+# Claims-only mode: trust user_id/username/role from the signed token and skip
+# the users lookup entirely. Deleting a user or changing a role then only takes
+# effect when the user's token expires.
+AUTH_CLAIMS_ONLY = os.getenv('AUTH_CLAIMS_ONLY', '0') == '1'
+
+# Authenticated users cached by id, so protected endpoints skip the users lookup.
+# Entries are dropped explicitly on delete/role change and expire after the TTL
+# (which also bounds staleness across worker processes).
+user_cache = TTLCache(
+    maxsize=int(os.getenv('USER_CACHE_SIZE', '10000')),
+    ttl=int(os.getenv('USER_CACHE_TTL', '60'))
+)
+
+# Already verified tokens, keyed by SHA-256 digest and kept until the token's
+# own exp at the latest, so the HMAC check runs once per token and TTL.
+token_cache = TTLCache(
+    maxsize=int(os.getenv('TOKEN_CACHE_SIZE', '10000')),
+    ttl=int(os.getenv('TOKEN_CACHE_TTL', '300'))
+)
+
+# WSGI environ key under which an already authenticated user is handed to
+# internal sub-requests (see routes/batch_routes.py). Clients can't set it:
+# HTTP headers only ever reach the environ as HTTP_* keys.
+PRINCIPAL_ENVIRON_KEY = 'doctor_assistant.principal'
+
+class AuthError(Exception):
+    """Raised when a request cannot be authenticated or authorized."""
+
+    def __init__(self, message, status=401):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+def load_user(db, user_id):
+    """Get a user (without password hash) by id, from the cache when possible."""
+    key = str(user_id)
+    user = user_cache.get(key)
+    if user is None:
+        user = db.users.find_one({'_id': ObjectId(key)}, exclude_sensitive())
+        if not user:
+            return None
+        user_cache.set(key, user)
+    # Hand out a copy so a route cannot modify the cached entry
+    return dict(user)
+
+def invalidate_user(user_id):
+    """Drop a user from the cache after it is deleted or its role changes."""
+    user_cache.invalidate(str(user_id))
+
+def generate_token(user_data, session_id=None):
+    """Generate a short-lived JWT access token, tied to a refresh session if given."""
     try:
         payload = {
             'user_id': str(user_data['_id']),
             'username': user_data['username'],
             'role': user_data['role'],
-            'exp': datetime.utcnow() + timedelta(days=1)  # Token expires in 1 day
+            'exp': datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_MINUTES)
         }
+        if session_id is not None:
+            payload['sid'] = str(session_id)
         token = jwt.encode(payload, SECRET_KEY, algorithm='HS256')
         return token
     except Exception as e:
         print(f"Token generation error: {str(e)}")
         return None
 
+def issue_tokens(db, user):
+    """Start a session for a user who just authenticated: access token plus refresh token."""
+    session_id, refresh_token = start_session(db, user['_id'])
+    return {
+        'token': generate_token(user, session_id),
+        'refresh_token': refresh_token,
+        'expires_in': int(ACCESS_TOKEN_MINUTES * 60)
+    }
+
 def authenticate_user(username, password):
     """Authenticate a user and return a token."""
     try:
         db = get_db()
         user = db.users.find_one({'username': username})
-        
-        if user and user.check_password(password):
+
+        if user and verify_password(user['password'], password):
             token = generate_token(user)
             return token
         return None
@@ -38,121 +104,92 @@ def authenticate_user(username, password):
         print(f"Authentication error: {str(e)}")
         return None
 
+def decode_token(token):
+    """Verify a token and return its claims, memoized by token digest."""
+    digest = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    claims = token_cache.get(digest)
+    if claims is not None:
+        return claims
+
+    claims = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    remaining = claims['exp'] - time.time() if 'exp' in claims else token_cache.ttl
+    if remaining > 0:
+        token_cache.set(digest, claims, ttl=min(remaining, token_cache.ttl))
+    return claims
+
+def get_request_token():
+    """Read the token from the Authorization header ("Bearer <token>" or bare)."""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return None
+    parts = auth_header.split()
+    if len(parts) == 2 and parts[0].lower() == 'bearer':
+        return parts[1]
+    if len(parts) == 1:
+        return parts[0]
+    raise AuthError('Invalid token format')
+
+def authenticate_request():
+    """Return the user making the current request or raise AuthError."""
+    principal = request.environ.get(PRINCIPAL_ENVIRON_KEY)
+    if principal is not None:
+        return dict(principal)
+
+    token = get_request_token()
+    if not token:
+        raise AuthError('Token is missing')
+
+    try:
+        claims = decode_token(token)
+    except jwt.ExpiredSignatureError:
+        raise AuthError('Token has expired')
+    except jwt.InvalidTokenError:
+        raise AuthError('Invalid token')
+    except Exception:
+        raise AuthError('Token validation failed')
+
+    try:
+        # Tokens of a session ended by logout are refused before they expire
+        revoked = 'sid' in claims and claims['sid'] in revoked_sessions(get_db())
+    except Exception:
+        raise AuthError('Token validation failed')
+    if revoked:
+        raise AuthError('Token has been revoked')
+
+    try:
+        if AUTH_CLAIMS_ONLY:
+            return {
+                '_id': ObjectId(claims['user_id']),
+                'username': claims.get('username'),
+                'role': claims.get('role')
+            }
+        current_user = load_user(get_db(), claims['user_id'])
+    except Exception:
+        raise AuthError('Token validation failed')
+
+    if not current_user:
+        raise AuthError('Invalid token')
+    return current_user
+
 # =========================
-# Token Required Decorator
+# Auth Decorators
 # =========================
-def token_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = None
-        
-        # Get token from header
-        auth_header = request.headers.get('Authorization')
-        if auth_header:
-            try:
-                token = auth_header.split(" ")[1] if "Bearer" in auth_header else auth_header
-            except IndexError:
-                return jsonify({"error": "Invalid token format"}), 401
-
-        if not token:
-            return jsonify({"error": "Token is missing"}), 401
-
-        try:
-            # Decode token
-            data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            
-            # Get user from database
-            db = get_db()
-            current_user = db.users.find_one({'_id': ObjectId(data['user_id'])})
-            if not current_user:
-                return jsonify({"error": "Invalid token"}), 401
-                
-        except jwt.ExpiredSignatureError:
-            return jsonify({"error": "Token has expired"}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({"error": "Invalid token"}), 401
-        except Exception as e:
-            return jsonify({"error": str(e)}), 401
-
-        return f(current_user, *args, **kwargs)
-    return decorated
-
-def admin_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = None
-        
-        # Get token from header
-        auth_header = request.headers.get('Authorization')
-        if auth_header:
-            try:
-                token = auth_header.split(" ")[1] if "Bearer" in auth_header else auth_header
-            except IndexError:
-                return jsonify({"error": "Invalid token format"}), 401
-
-        if not token:
-            return jsonify({"error": "Token is missing"}), 401
-
-        try:
-            # Decode token
-            data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            
-            # Get user from database
-            db = get_db()
-            current_user = db.users.find_one({'_id': ObjectId(data['user_id'])})
-            if not current_user:
-                return jsonify({"error": "Invalid token"}), 401
-                
-            # Check if user is admin
-            if current_user['role'] != 'admin':
-                return jsonify({"error": "Admin privileges required"}), 403
-                
-        except jwt.ExpiredSignatureError:
-            return jsonify({"error": "Token has expired"}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({"error": "Invalid token"}), 401
-        except Exception as e:
-            return jsonify({"error": str(e)}), 401
-
-        return f(current_user, *args, **kwargs)
-    return decorated
-
-def doctor_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = None
-        
-        # Get token from header
-        auth_header = request.headers.get('Authorization')
-        if auth_header:
+def _auth_required(role=None):
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
             try:
-                token = auth_header.split(" ")[1] if "Bearer" in auth_header else auth_header
-            except IndexError:
-                return jsonify({"error": "Invalid token format"}), 401
-
-        if not token:
-            return jsonify({"error": "Token is missing"}), 401
-
-        try:
-            # Decode token
-            data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            
-            # Get user from database
-            db = get_db()
-            current_user = db.users.find_one({'_id': ObjectId(data['user_id'])})
-            if not current_user:
-                return jsonify({"error": "Invalid token"}), 401
-                
-            # Check if user is doctor
-            if current_user['role'] != 'doctor':
-                return jsonify({"error": "Doctor privileges required"}), 403
-                
-        except jwt.ExpiredSignatureError:
-            return jsonify({"error": "Token has expired"}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({"error": "Invalid token"}), 401
-        except Exception as e:
-            return jsonify({"error": str(e)}), 401
-
-        return f(current_user, *args, **kwargs)
-    return decorated
+                current_user = authenticate_request()
+            except AuthError as e:
+                return jsonify({'message': e.message}), e.status
+
+            if role and current_user['role'] != role:
+                return jsonify({'message': f'{role.capitalize()} privileges required'}), 403
+
+            return f(current_user, *args, **kwargs)
+        return decorated
+    return decorator
+
+token_required = _auth_required()
+admin_required = _auth_required('admin')
+doctor_required = _auth_required('doctor')
@@ -0,0 +1,95 @@
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+
+def parse_slot(day, time):
+    """Combine a YYYY-MM-DD date and an HH:MM[:SS] time into a datetime."""
+    for fmt in ('%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return datetime.strptime(f'{day} {time}', fmt)
+        except (TypeError, ValueError):
+            continue
+    raise ValueError(f'Invalid date/time: {day} {time}')
+
+
+class IntervalSet:
+    """Sorted, merged set of busy [start, end) intervals.
+
+    Overlapping or touching intervals are merged when the set is built, so
+    overlap checks are a single binary search and free slots a linear walk.
+    """
+
+    def __init__(self, intervals=()):
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(intervals):
+            self._append(start, end)
+
+    def _append(self, start, end):
+        if self.ends and start <= self.ends[-1]:
+            self.ends[-1] = max(self.ends[-1], end)
+        else:
+            self.starts.append(start)
+            self.ends.append(end)
+
+    def add(self, start, end):
+        """Add a busy interval, merging it with its neighbours."""
+        intervals = list(zip(self.starts, self.ends))
+        intervals.append((start, end))
+        self.starts, self.ends = [], []
+        for interval_start, interval_end in sorted(intervals):
+            self._append(interval_start, interval_end)
+
+    def overlaps(self, start, end):
+        """Check whether [start, end) intersects a busy interval."""
+        index = bisect_right(self.ends, start)
+        return index < len(self.starts) and self.starts[index] < end
+
+    def free_slots(self, window_start, window_end, length):
+        """Return the free [start, end) slots of the given length within a window.
+
+        Slots are aligned to the window start, like a clinic's timetable.
+        """
+        slots = []
+        slot = window_start
+        index = bisect_right(self.ends, window_start)
+        while slot + length <= window_end:
+            # Skip busy intervals that end before this slot starts
+            while index < len(self.ends) and self.ends[index] <= slot:
+                index += 1
+            if index < len(self.starts) and self.starts[index] < slot + length:
+                # Jump to the first aligned slot after the busy interval
+                steps = -(-(self.ends[index] - window_start) // length)
+                slot = window_start + steps * length
+                continue
+            slots.append((slot, slot + length))
+            slot += length
+        return slots
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return iter(zip(self.starts, self.ends))
+
+
+def days_covered(start, end):
+    """Yield every calendar day an interval touches, from start.date() to end.date()."""
+    day = start.date()
+    while day <= end.date():
+        yield day
+        day += timedelta(days=1)
+
+
+def split_by_day(intervals, first_day, last_day):
+    """Group intervals into IntervalSets per calendar day (date -> IntervalSet)."""
+    days = {}
+    day = first_day
+    while day <= last_day:
+        days[day] = []
+        day += timedelta(days=1)
+    for start, end in intervals:
+        for day in days_covered(start, end):
+            if day in days:
+                days[day].append((start, end))
+    return {day: IntervalSet(busy) for day, busy in days.items()}
@@ -0,0 +1,299 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, request
+from pymongo import monitoring
+
+# Set METRICS_ENABLED=0 to turn off collection and the /metrics endpoint
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+
+PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Bucket upper bounds, in seconds and bytes
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    """Base of the metric types: a family of series keyed by label values.
+
+    Each update is a dict lookup and an addition under a lock, cheap enough
+    to leave on for every request and every database command.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._series.get(labels, 0)
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            series = list(self._series.items())
+        for labels, value in series:
+            lines.append(f'{self.name}{_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+class Gauge(Counter):
+    """Value that goes up and down."""
+
+    kind = 'gauge'
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._series[labels] = value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in fixed cumulative buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts (last one is +Inf), then sum
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, labels=()):
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = _labels(self.labelnames, labels, f'le="{_format_value(float(bound))}"')
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """Metrics exposed on /metrics, plus callbacks that refresh gauges at scrape time."""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = {}
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        for collect in self.collectors.values():
+            collect()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    'http_requests_total', 'HTTP requests by route and status.',
+    ('blueprint', 'endpoint', 'method', 'status')))
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'Time from receiving a request to sending the last byte of its response.',
+    ('blueprint', 'endpoint', 'method')))
+RESPONSE_SIZE = REGISTRY.register(Histogram(
+    'http_response_size_bytes', 'Size of response bodies, streamed ones included.',
+    ('blueprint', 'endpoint', 'method'), SIZE_BUCKETS))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    'http_requests_in_flight', 'Requests currently being handled.', ('blueprint',)))
+MONGO_LATENCY = REGISTRY.register(Histogram(
+    'mongodb_command_duration_seconds', 'MongoDB command round trip time as measured by the driver.',
+    ('collection', 'command'), MONGO_LATENCY_BUCKETS))
+MONGO_DOCUMENTS = REGISTRY.register(Counter(
+    'mongodb_command_documents_total', 'Documents returned or written by MongoDB commands.',
+    ('collection', 'command')))
+MONGO_FAILURES = REGISTRY.register(Counter(
+    'mongodb_command_failures_total', 'MongoDB commands that failed.', ('collection', 'command')))
+CACHE_ENTRIES = REGISTRY.register(Gauge(
+    'cache_entries', 'Entries held by in-process caches.', ('cache',)))
+CACHE_REQUESTS = REGISTRY.register(Gauge(
+    'cache_requests', 'Lookups served by in-process caches since start.', ('cache', 'result')))
+PASSWORD_HASH_DURATION = REGISTRY.register(Histogram(
+    'password_hash_duration_seconds', 'Time spent hashing or verifying a password in the hashing pool.',
+    ('operation',)))
+PASSWORD_HASH_PENDING = REGISTRY.register(Gauge(
+    'password_hash_pending', 'Password hashes queued or running in the hashing pool.'))
+PASSWORD_HASH_REJECTED = REGISTRY.register(Counter(
+    'password_hash_rejected_total', 'Password hashes refused because the hashing queue was full.',
+    ('operation',)))
+
+
+def register_cache(name, cache):
+    """Export the stats of a TTLCache under the given name."""
+    def collect():
+        stats = cache.stats()
+        CACHE_ENTRIES.set(stats['size'], (name,))
+        CACHE_REQUESTS.set(stats['hits'], (name, 'hit'))
+        CACHE_REQUESTS.set(stats['misses'], (name, 'miss'))
+    REGISTRY.collectors[f'cache:{name}'] = collect
+
+
+# Commands whose first key is not a collection name
+_COLLECTION_KEYS = {'getMore': 'collection'}
+
+
+def _command_documents(command_name, reply):
+    """Number of documents a command returned or wrote, from its reply."""
+    cursor = reply.get('cursor')
+    if cursor:
+        return len(cursor.get('firstBatch') or cursor.get('nextBatch') or ())
+    if command_name in ('insert', 'update', 'delete'):
+        return reply.get('n', 0)
+    if command_name == 'findAndModify':
+        return 1 if reply.get('value') else 0
+    if command_name == 'distinct':
+        return len(reply.get('values') or ())
+    return 0
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Time every command sent on the shared client, per collection."""
+
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        key = _COLLECTION_KEYS.get(event.command_name, event.command_name)
+        collection = event.command.get(key)
+        if not isinstance(collection, str):
+            collection = ''
+        self._pending[(event.request_id, event.connection_id)] = collection
+
+    def _finish(self, event):
+        collection = self._pending.pop((event.request_id, event.connection_id), '')
+        labels = (collection, event.command_name)
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, labels)
+        return labels
+
+    def succeeded(self, event):
+        labels = self._finish(event)
+        documents = _command_documents(event.command_name, event.reply)
+        if documents:
+            MONGO_DOCUMENTS.inc(labels, documents)
+
+    def failed(self, event):
+        MONGO_FAILURES.inc(self._finish(event))
+
+
+mongo_listener = MongoCommandListener()
+
+
+def _count_bytes(iterable, counter):
+    for chunk in iterable:
+        counter[0] += len(chunk)
+        yield chunk
+
+
+def _before_request():
+    blueprint = request.blueprint or ''
+    g.metrics_started = time.perf_counter()
+    IN_FLIGHT.inc((blueprint,))
+
+
+def _after_request(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    blueprint = request.blueprint or ''
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    method = request.method
+    status = str(response.status_code)
+    size = [0]
+    if response.is_streamed:
+        # Streamed bodies are only done (and sized) when the server closes them
+        response.response = _count_bytes(response.iter_encoded(), size)
+    else:
+        size[0] = response.content_length or 0
+
+    def finish():
+        labels = (blueprint, endpoint, method)
+        REQUEST_LATENCY.observe(time.perf_counter() - started, labels)
+        RESPONSE_SIZE.observe(size[0], labels)
+        REQUESTS.inc((blueprint, endpoint, method, status))
+        IN_FLIGHT.dec((blueprint,))
+
+    response.call_on_close(finish)
+    return response
+
+
+def metrics():
+    """Expose all metrics in the Prometheus text format."""
+    return Response(REGISTRY.render(), mimetype=PROMETHEUS_MIMETYPE)
+
+
+def init_app(app):
+    """Record request metrics for the app and serve them on /metrics."""
+    if not METRICS_ENABLED:
+        return
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
@@ -0,0 +1,136 @@
+import base64
+import json
+import os
+from datetime import datetime
+from urllib.parse import urlencode
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import request
+
+# Page size limits - every list query is bounded so memory per request stays flat
+DEFAULT_PAGE_SIZE = int(os.getenv('PAGE_SIZE_DEFAULT', '100'))
+MAX_PAGE_SIZE = int(os.getenv('PAGE_SIZE_MAX', '1000'))
+
+# Fields a list can be ordered by; _id is always the tie-breaker
+SORT_KEYS = ('_id', 'created_at')
+
+
+class PaginationError(ValueError):
+    """Raised when pagination query parameters are invalid."""
+
+
+def encode_cursor(doc, sort_key):
+    """Build an opaque cursor pointing just after the given document."""
+    value = doc.get(sort_key)
+    if isinstance(value, datetime):
+        value = {'$date': value.isoformat()}
+    payload = {'k': sort_key, 'v': str(value) if isinstance(value, ObjectId) else value, 'id': str(doc['_id'])}
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a cursor produced by encode_cursor into (sort_key, value, _id)."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        sort_key = payload['k']
+        last_id = ObjectId(payload['id'])
+        value = payload.get('v')
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise PaginationError('Invalid pagination cursor')
+
+    if sort_key not in SORT_KEYS:
+        raise PaginationError('Invalid pagination cursor')
+    if sort_key == '_id':
+        value = last_id
+    elif isinstance(value, dict) and '$date' in value:
+        value = datetime.fromisoformat(value['$date'])
+    return sort_key, value, last_id
+
+
+def parse_page_args(args):
+    """Read limit/after/sort/count from the query string."""
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise PaginationError('limit must be an integer')
+    if limit < 1:
+        raise PaginationError('limit must be positive')
+
+    sort_key = args.get('sort', '_id')
+    if sort_key not in SORT_KEYS:
+        raise PaginationError(f"sort must be one of: {', '.join(SORT_KEYS)}")
+
+    after = None
+    if args.get('after'):
+        after = decode_cursor(args['after'])
+        if after[0] != sort_key:
+            raise PaginationError('Cursor does not match the requested sort')
+
+    return {
+        'limit': min(limit, MAX_PAGE_SIZE),
+        'sort': sort_key,
+        'after': after,
+        'count': args.get('count', '').lower() in ('1', 'true', 'yes')
+    }
+
+
+def keyset_query(query, page):
+    """Restrict a query to the documents that come after the page cursor."""
+    if not page['after']:
+        return query
+
+    sort_key, value, last_id = page['after']
+    if sort_key == '_id':
+        condition = {'_id': {'$gt': last_id}}
+    elif value is None:
+        # Missing and null keys sort first, every set key comes after them
+        condition = {'$or': [
+            {sort_key: {'$ne': None}},
+            {sort_key: None, '_id': {'$gt': last_id}}
+        ]}
+    else:
+        condition = {'$or': [
+            {sort_key: {'$gt': value}},
+            {sort_key: value, '_id': {'$gt': last_id}}
+        ]}
+    return {'$and': [query, condition]} if query else condition
+
+
+def sort_spec(page):
+    """Return the sort specification for a page."""
+    if page['sort'] == '_id':
+        return [('_id', 1)]
+    return [(page['sort'], 1), ('_id', 1)]
+
+
+def next_link(cursor):
+    """Build the URL of the next page, keeping the other query parameters."""
+    args = request.args.to_dict()
+    args['after'] = cursor
+    args.pop('count', None)
+    return f"{request.base_url}?{urlencode(args)}"
+
+
+def paginate(collection, query, page, projection=None):
+    """Return a cursor over one page of documents plus the Link / X-Total-Count headers.
+
+    The next-page cursor is found with a small probe on the sort keys only, so
+    the page itself can be streamed straight from the returned cursor.
+    """
+    page_query = keyset_query(query, page)
+    spec = sort_spec(page)
+    headers = {}
+
+    # Look at the last document of this page and the one after it
+    keys = {key: 1 for key, _ in spec}
+    probe = list(collection.find(page_query, keys).sort(spec).skip(page['limit'] - 1).limit(2))
+    if len(probe) == 2:
+        headers['Link'] = f'<{next_link(encode_cursor(probe[0], page["sort"]))}>; rel="next"'
+    if page['count']:
+        headers['X-Total-Count'] = str(collection.count_documents(query))
+
+    cursor = collection.find(page_query, projection).sort(spec).limit(page['limit'])
+    return cursor, headers
@@ -0,0 +1,156 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from utils.metrics import PASSWORD_HASH_DURATION, PASSWORD_HASH_PENDING, PASSWORD_HASH_REJECTED
+
+# werkzeug hash method for new passwords, e.g. "scrypt:32768:8:1" or
+# "pbkdf2:sha256:600000". Stored hashes made with other parameters are
+# replaced on the next successful login.
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')
+
+# Processes hashing passwords (0 hashes in the request thread instead)
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+# Hashes queued or running at once; beyond that requests wait up to
+# PASSWORD_HASH_QUEUE_TIMEOUT seconds for a slot and then get a 503
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', str(max(PASSWORD_HASH_WORKERS, 1) * 8)))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', '2'))
+
+# multiprocessing start method of the pool (platform default if unset)
+PASSWORD_HASH_START_METHOD = os.getenv('PASSWORD_HASH_START_METHOD') or None
+
+# Parameters werkzeug fills in when a method is given without them
+_METHOD_DEFAULTS = {'scrypt': ('32768', '8', '1'), 'pbkdf2': ('sha256', '600000')}
+
+# The pool of this process, created on first use
+_pool = None
+_pool_pid = None
+_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+
+
+class HashingBusy(Exception):
+    """Raised when too many password hashes are already waiting."""
+
+    retry_after = 1
+
+
+def normalize_method(method):
+    """Spell out a werkzeug hash method with all its parameters ("scrypt" -> "scrypt:32768:8:1")."""
+    name, *params = method.split(':')
+    defaults = _METHOD_DEFAULTS.get(name, ())
+    return ':'.join([name, *params, *defaults[len(params):]])
+
+
+HASH_METHOD = normalize_method(PASSWORD_HASH_METHOD)
+
+
+def needs_rehash(pwhash):
+    """Whether a stored hash was made with other parameters than HASH_METHOD."""
+    return pwhash.split('$', 1)[0] != HASH_METHOD
+
+
+def _timed(function, *args):
+    # Runs in a pool process; the time spent there is what gets reported
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def _reset_after_fork():
+    global _pool, _pool_pid, _lock, _slots
+    _pool = None
+    _pool_pid = None
+    _lock = threading.Lock()
+    _slots = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _lock:
+            if _pool is None or _pool_pid != pid:
+                context = None
+                if PASSWORD_HASH_START_METHOD:
+                    context = multiprocessing.get_context(PASSWORD_HASH_START_METHOD)
+                _pool = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, mp_context=context)
+                _pool_pid = pid
+    return _pool
+
+
+def _submit(function, *args):
+    global _pool
+    pool = _get_pool()
+    try:
+        return pool.submit(_timed, function, *args).result()
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a new pool and try once more
+        with _lock:
+            if _pool is pool:
+                _pool = None
+        return _get_pool().submit(_timed, function, *args).result()
+
+
+def _run(operation, function, *args):
+    """Run a hash function in the pool, holding one of the pending slots meanwhile."""
+    slots = _slots
+    if not slots.acquire(timeout=PASSWORD_HASH_QUEUE_TIMEOUT):
+        PASSWORD_HASH_REJECTED.inc((operation,))
+        raise HashingBusy('Too many logins in progress, try again shortly')
+    PASSWORD_HASH_PENDING.inc()
+    try:
+        if PASSWORD_HASH_WORKERS > 0:
+            result, seconds = _submit(function, *args)
+        else:
+            result, seconds = _timed(function, *args)
+    finally:
+        PASSWORD_HASH_PENDING.dec()
+        slots.release()
+    PASSWORD_HASH_DURATION.observe(seconds, (operation,))
+    return result
+
+
+def hash_password(password):
+    """Hash a password with HASH_METHOD."""
+    return _run('hash', generate_password_hash, password, HASH_METHOD)
+
+
+def verify_password(pwhash, password):
+    """Check a password against a stored hash."""
+    return _run('verify', check_password_hash, pwhash, password)
+
+
+def upgrade_hash(db, user, password):
+    """Replace the stored hash of a user who just logged in if the hash parameters changed.
+
+    Failures are ignored: the old hash still works and the upgrade is tried
+    again at the next login.
+    """
+    if not needs_rehash(user['password']):
+        return False
+    try:
+        pwhash = hash_password(password)
+    except HashingBusy:
+        return False
+    result = db.users.update_one({'_id': user['_id'], 'password': user['password']}, {'$set': {'password': pwhash}})
+    return bool(result.modified_count)
+
+
+def shutdown():
+    """Stop the pool processes (they are started again when needed)."""
+    global _pool
+    with _lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=True)
+        _pool = None
@@ -0,0 +1,55 @@
+import re
+
+# Fields that must never leave the database, whatever the client asks for
+SENSITIVE_FIELDS = ('password', 'password_hash')
+
+# Default projections used by list endpoints when no ?fields= is given
+PATIENT_SUMMARY = ('name', 'email', 'phone', 'doctor_id', 'created_at')
+APPOINTMENT_SUMMARY = ('patient_id', 'doctor_id', 'date', 'time', 'reason', 'status', 'created_at')
+USER_SUMMARY = ('username', 'email', 'role', 'created_at')
+
+# Fields returned for referenced documents (?expand=) and embedded copies
+PATIENT_REFERENCE = ('name', 'email', 'phone')
+DOCTOR_REFERENCE = ('username', 'email')
+
+# Plain (optionally dotted) field names only - no operators or positional paths
+FIELD_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$')
+
+
+class ProjectionError(ValueError):
+    """Raised when the fields query parameter is invalid."""
+
+
+def exclude_sensitive():
+    """Projection returning the full document minus sensitive fields."""
+    return {field: 0 for field in SENSITIVE_FIELDS}
+
+
+def build_projection(fields):
+    """Build an inclusion projection from a list of field names."""
+    projection = {}
+    for field in sorted(set(fields), key=len):
+        if not FIELD_PATTERN.match(field):
+            raise ProjectionError(f'Invalid field name: {field}')
+        if field.split('.')[0] in SENSITIVE_FIELDS:
+            continue
+        # Skip sub-paths of fields already selected, MongoDB rejects path collisions
+        if any(field.startswith(parent + '.') for parent in projection):
+            continue
+        projection[field] = 1
+    return projection or {'_id': 1}
+
+
+def parse_fields(args, default=None):
+    """Turn ?fields=a,b,c into a MongoDB projection.
+
+    Without the parameter the default field list is used (or the full
+    document when there is no default). ?fields=* returns the full document.
+    Sensitive fields are always excluded.
+    """
+    fields = args.get('fields', '').strip()
+    if fields == '*' or (not fields and default is None):
+        return exclude_sensitive()
+    if not fields:
+        return build_projection(default)
+    return build_projection(f.strip() for f in fields.split(',') if f.strip())
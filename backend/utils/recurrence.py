@@ -0,0 +1,103 @@
+import calendar
+import os
+from datetime import date, datetime, timedelta
+
+# Upper bound on the occurrences one series can expand to
+MAX_OCCURRENCES = int(os.getenv('SERIES_MAX_OCCURRENCES', '104'))
+
+FREQUENCIES = ('daily', 'weekly', 'monthly')
+WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+
+
+class RecurrenceError(ValueError):
+    """Raised when a recurrence rule is invalid."""
+
+
+def parse_date(value):
+    """Parse a YYYY-MM-DD string."""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise RecurrenceError(f'Invalid date: {value}')
+
+
+def _add_months(day, months):
+    month = day.month - 1 + months
+    year = day.year + month // 12
+    month = month % 12 + 1
+    if day.day > calendar.monthrange(year, month)[1]:
+        return None
+    return date(year, month, day.day)
+
+
+def _candidates(start, freq, interval, weekdays):
+    """Yield dates matching the rule, in order, without any end condition."""
+    if freq == 'daily':
+        day = start
+        while True:
+            yield day
+            day += timedelta(days=interval)
+    elif freq == 'weekly':
+        week = start - timedelta(days=start.weekday())
+        while True:
+            for weekday in weekdays:
+                day = week + timedelta(days=weekday)
+                if day >= start:
+                    yield day
+            week += timedelta(weeks=interval)
+    else:
+        months = 0
+        while True:
+            day = _add_months(start, months)
+            # Months without this day of the month are skipped
+            if day:
+                yield day
+            months += interval
+
+
+def expand(start, rule):
+    """Expand a recurrence rule into the list of occurrence dates.
+
+    rule is a dict such as {"freq": "weekly", "interval": 1, "count": 10,
+    "weekdays": ["MO", "TH"]}; "until" (YYYY-MM-DD, inclusive) may be used
+    instead of, or together with, "count".
+    """
+    if isinstance(start, str):
+        start = parse_date(start)
+    if not isinstance(rule, dict):
+        raise RecurrenceError('recurrence must be an object')
+
+    freq = rule.get('freq')
+    if freq not in FREQUENCIES:
+        raise RecurrenceError(f"freq must be one of: {', '.join(FREQUENCIES)}")
+
+    interval = rule.get('interval', 1)
+    if not isinstance(interval, int) or interval < 1:
+        raise RecurrenceError('interval must be a positive integer')
+
+    count = rule.get('count')
+    if count is not None and (not isinstance(count, int) or count < 1):
+        raise RecurrenceError('count must be a positive integer')
+    until = parse_date(rule['until']) if rule.get('until') else None
+    if count is None and until is None:
+        raise RecurrenceError('recurrence needs count or until')
+
+    weekdays = [start.weekday()]
+    if rule.get('weekdays'):
+        try:
+            weekdays = sorted({WEEKDAYS.index(day.upper()) for day in rule['weekdays']})
+        except (AttributeError, ValueError):
+            raise RecurrenceError(f"weekdays must be taken from: {', '.join(WEEKDAYS)}")
+
+    dates = []
+    for day in _candidates(start, freq, interval, weekdays):
+        if until and day > until:
+            break
+        if count is not None and len(dates) >= count:
+            break
+        if len(dates) >= MAX_OCCURRENCES:
+            raise RecurrenceError(f'A series cannot have more than {MAX_OCCURRENCES} occurrences')
+        dates.append(day)
+    if not dates:
+        raise RecurrenceError('recurrence produces no occurrences')
+    return dates
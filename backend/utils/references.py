@@ -0,0 +1,120 @@
+import os
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from utils.projection import DOCTOR_REFERENCE, PATIENT_REFERENCE
+from utils.versioning import bump_version
+
+# Embed a copy of the patient's name/email/phone in each appointment
+# (set APPOINTMENT_PATIENT_SUMMARY=0 to store bare patient ids only)
+APPOINTMENT_PATIENT_SUMMARY = os.getenv('APPOINTMENT_PATIENT_SUMMARY', '1') == '1'
+
+# ?expand= name -> (reference field, collection, fields returned, embedded copy)
+EXPANDABLE = {
+    'patient': ('patient_id', 'patients', PATIENT_REFERENCE, 'patient_summary'),
+    'doctor': ('doctor_id', 'users', DOCTOR_REFERENCE, None),
+}
+
+
+class ExpandError(ValueError):
+    """Raised when the expand query parameter is invalid."""
+
+
+def parse_expand(args):
+    """Turn ?expand=patient,doctor into a tuple of reference names."""
+    names = tuple(dict.fromkeys(name.strip() for name in args.get('expand', '').split(',') if name.strip()))
+    unknown = [name for name in names if name not in EXPANDABLE]
+    if unknown:
+        raise ExpandError(f"expand must be one of: {', '.join(EXPANDABLE)}")
+    return names
+
+
+def _embedded_copy(embedded):
+    # Copies left from before APPOINTMENT_PATIENT_SUMMARY=0 are no longer kept in sync
+    return embedded if APPOINTMENT_PATIENT_SUMMARY else None
+
+
+def expand_projection(projection, names):
+    """Make sure an inclusion projection returns what the expansion needs."""
+    if not names or any(value == 0 for value in projection.values()):
+        return projection
+    projection = dict(projection)
+    for name in names:
+        field, _, _, embedded = EXPANDABLE[name]
+        projection[field] = 1
+        if _embedded_copy(embedded):
+            projection[embedded] = 1
+    return projection
+
+
+def _object_id(value):
+    if isinstance(value, ObjectId):
+        return value
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+
+def expand_references(loader, docs, names):
+    """Attach the referenced documents to a batch of documents.
+
+    Embedded copies are used when present (and embedding is on); the remaining
+    references are queued on the request's loader and resolved together, one
+    $in query per collection for the whole batch.
+    """
+    pending = []
+    for name in names:
+        field, collection, fields, embedded = EXPANDABLE[name]
+        embedded = _embedded_copy(embedded)
+        for doc in docs:
+            ref_id = _object_id(doc.get(field))
+            if embedded and doc.get(embedded):
+                doc[name] = dict(doc[embedded], _id=ref_id)
+            elif ref_id is None:
+                doc[name] = None
+            else:
+                pending.append((doc, name, loader.load(collection, ref_id, fields=fields)))
+    for doc, name, ref in pending:
+        doc[name] = ref.get()
+    return docs
+
+
+def load_references(loader, patient_id, doctor_id):
+    """Look up the patient and doctor of an appointment together; (patient, doctor), None if missing.
+
+    A user whose role isn't doctor counts as missing, so an admin id can't
+    end up as an appointment's doctor.
+    """
+    refs = []
+    for name, ref_id in (('patient', patient_id), ('doctor', doctor_id)):
+        _, collection, fields, _ = EXPANDABLE[name]
+        if name == 'doctor':
+            fields = fields + ('role',)
+        ref_id = _object_id(ref_id)
+        refs.append(loader.load(collection, ref_id, fields=fields) if ref_id else None)
+    patient, doctor = (ref.get() if ref else None for ref in refs)
+    if doctor is not None and doctor.get('role') != 'doctor':
+        doctor = None
+    return patient, doctor
+
+
+def patient_summary(patient):
+    """The copy of a patient embedded in its appointments."""
+    return {field: patient.get(field) for field in PATIENT_REFERENCE}
+
+
+def sync_patient_summary(db, patient_id, changes):
+    """Copy changed name/email/phone values into the patient's appointments."""
+    update = {f'patient_summary.{field}': changes[field] for field in PATIENT_REFERENCE if field in changes}
+    if not APPOINTMENT_PATIENT_SUMMARY or not update:
+        return 0
+    query = {'patient_id': _object_id(patient_id), 'patient_summary': {'$exists': True}}
+    doctor_ids = db.appointments.distinct('doctor_id', query)
+    update['updated_at'] = datetime.utcnow()
+    result = db.appointments.update_many(query, {'$set': update})
+    if result.modified_count:
+        bump_version(db, 'appointments', *doctor_ids)
+    return result.modified_count
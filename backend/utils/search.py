@@ -0,0 +1,37 @@
+import re
+
+# Patient fields that feed the prefix autocomplete keys
+SEARCH_KEY_FIELDS = ('name', 'email', 'phone')
+
+# Minimum length of a word indexed on its own
+MIN_WORD_LENGTH = 2
+
+
+def normalize(value):
+    """Lowercase and collapse whitespace."""
+    return ' '.join(str(value).lower().split())
+
+
+def search_keys(patient):
+    """Build the lowercase prefix keys of a patient: full name, each name word, email and phone digits."""
+    keys = set()
+    name = normalize(patient.get('name') or '')
+    if name:
+        keys.add(name)
+        keys.update(word for word in name.split(' ') if len(word) >= MIN_WORD_LENGTH)
+    email = normalize(patient.get('email') or '')
+    if email:
+        keys.add(email)
+    digits = re.sub(r'\D', '', str(patient.get('phone') or ''))
+    if digits:
+        keys.add(digits)
+    return sorted(keys)
+
+
+def prefix_query(term):
+    """Build an anchored, index-friendly prefix match on search_keys."""
+    term = normalize(term)
+    digits = re.sub(r'[\s()+\-.]', '', term)
+    if digits.isdigit():
+        term = digits
+    return {'search_keys': {'$regex': '^' + re.escape(term)}}
@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import queue
+import random
+import threading
+from datetime import datetime
+
+from bson.son import SON
+from flask import has_request_context, request
+from pymongo import monitoring
+
+# Commands slower than this are logged (set SLOW_OP_THRESHOLD_MS=0 to turn off)
+SLOW_OP_THRESHOLD_MS = float(os.getenv('SLOW_OP_THRESHOLD_MS', '100'))
+
+# Fraction of slow operations whose query plan is captured with explain
+SLOW_OP_EXPLAIN_SAMPLE = float(os.getenv('SLOW_OP_EXPLAIN_SAMPLE', '0.1'))
+
+# Capped collection holding the log, and its size in bytes
+SLOW_OPS_COLLECTION = 'slow_operations'
+SLOW_OPS_LOG_BYTES = int(os.getenv('SLOW_OP_LOG_BYTES', str(16 * 1024 * 1024)))
+
+# Slow operations waiting to be written; more are dropped rather than slowing requests down
+SLOW_OP_QUEUE_SIZE = int(os.getenv('SLOW_OP_QUEUE_SIZE', '1000'))
+
+# Driver fields that say nothing about the query
+IGNORED_FIELDS = {'lsid', '$db', '$clusterTime', 'txnNumber', '$readPreference', 'readConcern',
+                  'writeConcern', 'apiVersion', 'apiStrict', 'apiDeprecationErrors', 'autocommit',
+                  'startTransaction'}
+
+# Fields whose values are query options, not patient data, and are kept as is
+KEPT_FIELDS = {'sort', '$sort', 'projection', '$project', 'hint', 'limit', '$limit', 'skip', '$skip',
+               'batchSize', 'upsert', 'multi', 'new', 'remove', 'fields', 'ordered', 'singleBatch'}
+
+# Commands that explain() accepts
+EXPLAINABLE = {'find', 'aggregate', 'count', 'distinct', 'update', 'delete', 'findAndModify'}
+
+# Commands whose collection is not the value of the first key
+_COLLECTION_KEYS = {'getMore': 'collection'}
+
+
+def _redact(value, key=None):
+    if key in KEPT_FIELDS:
+        return value
+    if isinstance(value, dict):
+        return {k: _redact(v, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = []
+        for item in value:
+            item = _redact(item)
+            # Lists of values ($in, ...) and repeated statements collapse to one entry
+            if item not in items:
+                items.append(item)
+        return items
+    return '?'
+
+
+def redact_command(command_name, command):
+    """Keep the shape of a command (fields and operators) and replace every value by '?'."""
+    shape = {}
+    for key, value in command.items():
+        if key in IGNORED_FIELDS:
+            continue
+        if key == command_name:
+            shape[key] = value if isinstance(value, str) else '?'
+        elif key == 'documents':
+            shape[key] = f'<{len(value)} documents>'
+        else:
+            shape[key] = _redact(value, key)
+    return shape
+
+
+def plan_stages(plan):
+    """Yield every stage name in an explain plan tree."""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from plan_stages(item)
+
+
+def _plan_indexes(plan):
+    if isinstance(plan, dict):
+        if 'indexName' in plan:
+            yield plan['indexName']
+        for value in plan.values():
+            yield from _plan_indexes(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_indexes(item)
+
+
+def summarize_plan(explain):
+    """Reduce explain() output to the stages and indexes of the winning plan."""
+    planner = explain.get('queryPlanner')
+    if planner is None:
+        # Aggregations report the plan of their $cursor stage
+        planner = next((stage['$cursor']['queryPlanner'] for stage in explain.get('stages', [])
+                        if '$cursor' in stage), {})
+    plan = planner.get('winningPlan', {})
+    stages = sorted(set(plan_stages(plan)))
+    return {
+        'stages': stages,
+        'indexes': sorted(set(_plan_indexes(plan))),
+        'collscan': 'COLLSCAN' in stages
+    }
+
+
+def ensure_slow_log(db):
+    """Create the capped collection of the slow operation log."""
+    if SLOW_OPS_COLLECTION not in db.list_collection_names():
+        db.create_collection(SLOW_OPS_COLLECTION, capped=True, size=SLOW_OPS_LOG_BYTES)
+    db[SLOW_OPS_COLLECTION].create_index([('shape_id', 1), ('ts', 1)], name='shape_id_ts')
+
+
+class SlowOperationLog(monitoring.CommandListener):
+    """Record commands slower than the threshold, with the request that issued them.
+
+    Entries are written (and plans explained) by a background thread, so a
+    slow request does not get slower for being logged.
+    """
+
+    def __init__(self, get_client, get_db, threshold_ms=None, explain_sample=None):
+        self._get_client = get_client
+        self._get_db = get_db
+        self.threshold_ms = SLOW_OP_THRESHOLD_MS if threshold_ms is None else threshold_ms
+        self.explain_sample = SLOW_OP_EXPLAIN_SAMPLE if explain_sample is None else explain_sample
+        self.queue = queue.Queue(maxsize=SLOW_OP_QUEUE_SIZE)
+        self.dropped = 0
+        self._pending = {}
+        self._worker = None
+        self._worker_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.threshold_ms > 0
+
+    def started(self, event):
+        key = _COLLECTION_KEYS.get(event.command_name, event.command_name)
+        collection = event.command.get(key)
+        if (isinstance(collection, str) and collection != SLOW_OPS_COLLECTION
+                and event.command_name != 'explain'):
+            self._pending[(event.request_id, event.connection_id)] = (collection, event.command)
+
+    def _finish(self, event, failed=False):
+        pending = self._pending.pop((event.request_id, event.connection_id), None)
+        duration_ms = event.duration_micros / 1000
+        if pending is None or duration_ms < self.threshold_ms:
+            return
+        collection, command = pending
+        shape = json.dumps(redact_command(event.command_name, command), sort_keys=True, default=str)
+        entry = {
+            'ts': datetime.utcnow(),
+            'collection': collection,
+            'command': event.command_name,
+            'shape': shape,
+            'shape_id': hashlib.sha1(shape.encode('utf-8')).hexdigest()[:16],
+            'duration_ms': round(duration_ms, 3),
+            'failed': failed,
+            'path': None,
+            'method': None,
+            'endpoint': None
+        }
+        if has_request_context():
+            entry.update(path=request.path, method=request.method,
+                         endpoint=request.url_rule.rule if request.url_rule else None)
+        explain = None
+        if event.command_name in EXPLAINABLE and random.random() < self.explain_sample:
+            explain = (event.database_name, command)
+        self._submit(entry, explain)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def _submit(self, entry, explain):
+        self._start_worker()
+        try:
+            self.queue.put_nowait((entry, explain))
+        except queue.Full:
+            self.dropped += 1
+
+    def _start_worker(self):
+        pid = os.getpid()
+        if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or self._worker_pid != pid or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='slow-operation-log', daemon=True)
+                self._worker_pid = pid
+                self._worker.start()
+
+    def explain(self, database_name, command):
+        """Explain a command (planner only, the query is not run again)."""
+        command = SON((key, value) for key, value in command.items() if key not in IGNORED_FIELDS)
+        result = self._get_client()[database_name].command(
+            SON([('explain', command), ('verbosity', 'queryPlanner')]))
+        return summarize_plan(result)
+
+    def write(self, entry, explain=None):
+        if explain:
+            try:
+                entry['explain'] = self.explain(*explain)
+            except Exception as e:
+                entry['explain'] = {'error': str(e)}
+        self._get_db()[SLOW_OPS_COLLECTION].insert_one(entry)
+
+    def _run(self):
+        while True:
+            entry, explain = self.queue.get()
+            try:
+                self.write(entry, explain)
+            except Exception as e:
+                print(f"Failed to log slow operation: {e}")
+            finally:
+                self.queue.task_done()
+
+
+def top_offenders(db, since=None, limit=20):
+    """Group the logged slow operations by command shape, most total time first."""
+    pipeline = []
+    if since:
+        pipeline.append({'$match': {'ts': {'$gte': since}}})
+    pipeline += [
+        {'$sort': {'ts': -1}},
+        {'$group': {
+            '_id': '$shape_id',
+            'collection': {'$first': '$collection'},
+            'command': {'$first': '$command'},
+            'shape': {'$first': '$shape'},
+            'count': {'$sum': 1},
+            'total_ms': {'$sum': '$duration_ms'},
+            'max_ms': {'$max': '$duration_ms'},
+            'avg_ms': {'$avg': '$duration_ms'},
+            'failures': {'$sum': {'$cond': ['$failed', 1, 0]}},
+            'endpoints': {'$addToSet': '$endpoint'},
+            'last_seen': {'$first': '$ts'},
+            # null sorts before documents, so this keeps a captured plan if there is one
+            'explain': {'$max': '$explain'}
+        }},
+        {'$sort': {'total_ms': -1}},
+        {'$limit': limit}
+    ]
+    return list(db[SLOW_OPS_COLLECTION].aggregate(pipeline))
@@ -0,0 +1,94 @@
+import json
+import os
+from datetime import date, datetime
+
+from bson import ObjectId, decode as decode_bson
+from bson.raw_bson import RawBSONDocument
+from flask import Response, request, stream_with_context
+from werkzeug.http import http_date
+
+# Number of documents pulled from the cursor and written per chunk
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '500'))
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def _default(value):
+    """Convert BSON types that json cannot serialize (same output as jsonify)."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return http_date(value)
+    if isinstance(value, RawBSONDocument):
+        return decode_bson(value.raw)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def encode_document(doc):
+    """Serialize a single MongoDB document to a compact JSON string."""
+    if isinstance(doc, RawBSONDocument):
+        # Decode the whole BSON document in one pass instead of field by field
+        doc = decode_bson(doc.raw)
+    return json.dumps(doc, default=_default, separators=(',', ':'))
+
+
+def wants_ndjson():
+    """Check whether the client asked for newline-delimited JSON."""
+    best = request.accept_mimetypes.best_match([NDJSON_MIMETYPE, 'application/json'])
+    return best == NDJSON_MIMETYPE
+
+
+def _batches(cursor, batch_size):
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _generate(cursor, transform, batch_transform, batch_size, ndjson):
+    first = True
+    if not ndjson:
+        yield '['
+    try:
+        for batch in _batches(cursor, batch_size):
+            if batch_transform:
+                batch = batch_transform(batch)
+            if transform:
+                batch = [transform(doc) for doc in batch]
+            chunk = (encode_document(doc) for doc in batch)
+            if ndjson:
+                yield ''.join(line + '\n' for line in chunk)
+            else:
+                body = ','.join(chunk)
+                yield body if first else ',' + body
+                first = False
+    finally:
+        if hasattr(cursor, 'close'):
+            cursor.close()
+    if not ndjson:
+        yield ']'
+
+
+def stream_documents(cursor, transform=None, headers=None, status=200, batch_size=None, batch_transform=None):
+    """Stream a pymongo cursor as a chunked JSON array, or NDJSON if requested.
+
+    Documents are pulled from the cursor in batches and encoded on the fly,
+    so memory use does not depend on the size of the result set.
+    batch_transform receives each batch as a list, e.g. to resolve references
+    of the whole batch at once; transform is then applied per document.
+    """
+    batch_size = batch_size or STREAM_BATCH_SIZE
+    if hasattr(cursor, 'batch_size'):
+        cursor = cursor.batch_size(batch_size)
+
+    ndjson = wants_ndjson()
+    return Response(
+        stream_with_context(_generate(cursor, transform, batch_transform, batch_size, ndjson)),
+        status=status,
+        headers=headers,
+        mimetype=NDJSON_MIMETYPE if ndjson else 'application/json'
+    )
@@ -0,0 +1,73 @@
+import hashlib
+from datetime import datetime, timezone
+
+from flask import Response, request
+from pymongo import UpdateOne
+
+from utils.streaming import wants_ndjson
+
+# One counter document per collection and scope ("patients:all", "patients:<doctor_id>")
+VERSIONS_COLLECTION = 'collection_versions'
+
+
+def _key(collection, scope):
+    return f'{collection}:{scope}'
+
+
+def bump_version(db, collection, *doctor_ids):
+    """Record a write to a collection, for everyone and for the doctors it concerns."""
+    now = datetime.utcnow()
+    keys = [_key(collection, 'all')] + [_key(collection, str(doctor_id)) for doctor_id in doctor_ids if doctor_id]
+    db[VERSIONS_COLLECTION].bulk_write([
+        UpdateOne({'_id': key}, {'$inc': {'version': 1}, '$set': {'updated_at': now}}, upsert=True)
+        for key in dict.fromkeys(keys)
+    ], ordered=False)
+
+
+def get_validators(db, collection, doctor_id=None, resource=''):
+    """Build the weak ETag and Last-Modified of a collection view.
+
+    The ETag combines the scope's version counter with the query string and
+    the negotiated format, so each page / field selection / representation
+    of a list has its own tag.
+    """
+    scope = str(doctor_id) if doctor_id else 'all'
+    doc = db[VERSIONS_COLLECTION].find_one({'_id': _key(collection, scope)}) or {}
+    representation = 'ndjson' if wants_ndjson() else 'json'
+    query_string = request.query_string.decode('latin-1')
+    variant = hashlib.sha1(f'{representation}:{resource}?{query_string}'.encode('utf-8')).hexdigest()[:12]
+    updated_at = doc.get('updated_at')
+    if updated_at:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    return {
+        'etag': f"{collection}-{scope}-{doc.get('version', 0)}-{variant}",
+        'updated_at': updated_at,
+        # HTTP dates have whole seconds
+        'last_modified': updated_at.replace(microsecond=0) if updated_at else None
+    }
+
+
+def is_not_modified(validators):
+    """Check If-None-Match / If-Modified-Since against the current validators."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(validators['etag'])
+    if request.if_modified_since and validators['updated_at']:
+        # Strictly older only: a write later in the second Last-Modified was
+        # truncated to must not be answered with 304
+        return validators['updated_at'] < request.if_modified_since
+    return False
+
+
+def add_validators(response, validators):
+    """Attach the validators so the client can revalidate instead of refetching."""
+    response.set_etag(validators['etag'], weak=True)
+    if validators['last_modified']:
+        response.last_modified = validators['last_modified']
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Accept')
+    return response
+
+
+def not_modified(validators):
+    """Build an empty 304 response carrying the validators."""
+    return add_validators(Response(status=304), validators)